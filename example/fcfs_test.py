@@ -1,13 +1,6 @@
-import sys
 import os
-import pandas
-
-import scipy.stats
-import simpy
 
 project_dir = os.path.abspath(os.path.join(os.path.join(__file__, os.pardir), os.pardir))
-ppe_dir = os.path.abspath(os.path.join(project_dir, "ppe"))
-sys.path.insert(0, ppe_dir)
 
 resource_dir = os.path.abspath(os.path.join(project_dir, "resources"))
 results_dir = os.path.abspath(os.path.join(project_dir, "generated_results"))
@@ -15,19 +8,20 @@ if not os.path.isdir(results_dir):
     os.mkdir(results_dir)
 
 
+import ppe.arrivals
 import ppe.framework
 import ppe.implement
+import ppe.sampling
 
 seed=0
 minutes_per_day = 60 * 24
 icu_survival_probs = {ppe.framework.InfectionSeverity.REQ_VENT: 0.5}
 noicu_survival_probs = {ppe.framework.InfectionSeverity.REQ_VENT: 0.05}
 icu_dist = {ppe.framework.InfectionSeverity.REQ_VENT: 1}
-stay_dists = {ppe.framework.InfectionSeverity.REQ_VENT: scipy.stats.poisson(mu=10 * minutes_per_day)}
+stay_dists = {ppe.framework.InfectionSeverity.REQ_VENT: ppe.sampling.Poisson(mu=10 * minutes_per_day)}
 
 demand_filepath = os.path.abspath(os.path.join(resource_dir, "demands_3_24.csv"))
-demand_frame = pandas.read_csv(demand_filepath)
-est_icu_demands = demand_frame['T_600'].values.ravel() * (3 / 5.6) * (1 / 3)
+est_icu_demands = ppe.arrivals.read_demand_column(demand_filepath, 'T_600') * (3 / 5.6) * (1 / 3)
 
 
 def interarrival_function(x: float) -> float:
@@ -35,7 +29,6 @@ def interarrival_function(x: float) -> float:
     return minutes_per_day / est_icu_demands[day_index]
 
 
-env = simpy.Environment()
 myhospital = ppe.implement.HospitalStateImpl(existing_patients={}, bedusers=set(), ventusers=set())
 mypolicy = ppe.implement.FirstComeFirstServedPolicy(max_beds=180, max_ventilators=150)
 model = ppe.implement.HospitalModelImpl(icu_survivalprobs=icu_survival_probs,
@@ -48,10 +41,6 @@ event_outpath = os.path.abspath(os.path.join(results_dir,"sim_out_event.csv"))
 patient_outpath = os.path.abspath(os.path.join(results_dir,"patient_out_event.csv"))
 with open(event_outpath, 'w') as event_file:
     with open(patient_outpath, 'w') as patient_file:
-        sim_process = ppe.framework.icu_process(env=env, hospital_state=myhospital,
-                                                logger=ppe.implement.CSVLogger(event_file=event_file,
-                                                                               patient_file=patient_file),
-                                                policy=mypolicy, model=model)
-
-        env.process(sim_process)
-        env.run(120 * minutes_per_day - 1)
+        ppe.framework.run_icu(hospital_state=myhospital,
+                              logger=ppe.implement.CSVLogger(event_file=event_file, patient_file=patient_file),
+                              policy=mypolicy, model=model, until=120 * minutes_per_day - 1)
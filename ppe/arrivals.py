@@ -0,0 +1,181 @@
+import csv
+import typing
+import numpy
+from . import sampling
+
+
+DEFAULT_CHUNK_SIZE = 8192
+
+
+def read_demand_table(path: str) -> typing.Tuple[typing.List[str], numpy.ndarray]:
+    """
+    Reads a demand file (such as resources/demands_3_24.csv) as its column names and an array with one row per day and
+    one column per scenario.
+
+    :param path: path to the demand csv
+    """
+    # The resource files are saved with a byte order mark, which utf-8-sig strips from the first header.
+    with open(path, newline='', encoding='utf-8-sig') as demand_file:
+        reader = csv.reader(demand_file)
+        header = next(reader, [])
+        rows = [[float(v) for v in row] for row in reader if row]
+    return header, numpy.array(rows, dtype=float).reshape(len(rows), len(header))
+
+
+def read_demand_column(path: str, column: str) -> numpy.ndarray:
+    """
+    Reads one scenario column of a demand file as an array of daily values.
+
+    :param path: path to the demand csv
+    :param column: name of the scenario column, e.g. 'T_600'
+    """
+    header, table = read_demand_table(path)
+    if column not in header:
+        raise RuntimeError("Demand file {} has no column {}.".format(path, column))
+    return table[:, header.index(column)].copy()
+
+
+class PiecewiseRateArrivals:
+    """
+    Non-homogeneous Poisson arrival process whose rate is constant over each period (typically a day), as given by
+    one column of a demand file.
+
+    Arrival times are produced by exact time-rescaling: unit-rate Poisson epochs are mapped through the inverse of the
+    piecewise-linear cumulative intensity. Rate changes inside an interarrival gap are therefore handled exactly,
+    unlike evaluating the rate at the previous arrival time. The process ends at the end of the last period.
+    """
+    _rates: numpy.ndarray
+    _cumulative: numpy.ndarray
+    _period_length: float
+    _start_time: float
+    _random_state: numpy.random.RandomState
+    _chunk_size: int
+
+    def __init__(self, rates: typing.Sequence[float], period_length: float = 1.0, start_time: float = 0.0,
+                 random_state=None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param rates: expected number of arrivals in each period
+        :param period_length: length of a period in simulation time units (e.g. minutes per day)
+        :param start_time: simulation time at which the first period begins
+        :param random_state: a numpy RandomState, or a seed (int or SeedSequence) used to create one
+        :param chunk_size: number of arrivals produced per vectorized step when streaming
+        """
+        self._rates = numpy.asarray(rates, dtype=float).ravel()
+        if self._rates.size == 0:
+            raise RuntimeError("At least one period rate is required.")
+        if numpy.any(self._rates < 0) or not numpy.all(numpy.isfinite(self._rates)):
+            raise RuntimeError("Arrival rates must be finite and nonnegative.")
+        self._cumulative = numpy.concatenate(([0.0], numpy.cumsum(self._rates)))
+        self._period_length = period_length
+        self._start_time = start_time
+        self._random_state = sampling.make_random_state(random_state)
+        self._chunk_size = chunk_size
+
+    def end_time(self) -> float:
+        return self._start_time + self._period_length * self._rates.size
+
+    def expected_arrivals(self) -> float:
+        return float(self._cumulative[-1])
+
+    def invert(self, cumulative_intensity: numpy.ndarray) -> numpy.ndarray:
+        """
+        Maps values of the cumulative intensity (expected arrivals since start_time) to simulation times.
+        """
+        # side='right' skips over zero-rate periods, so the selected period always has a positive rate.
+        period = numpy.searchsorted(self._cumulative, cumulative_intensity, side='right') - 1
+        period = numpy.minimum(period, self._rates.size - 1)
+        offset = (cumulative_intensity - self._cumulative[period]) / self._rates[period]
+        return self._start_time + self._period_length * (period + offset)
+
+    def generate_all(self) -> numpy.ndarray:
+        """
+        Generates the complete arrival stream over the horizon in a single vectorized pass.
+        """
+        total = self.expected_arrivals()
+        count = self._random_state.poisson(total)
+        epochs = numpy.sort(self._random_state.random_sample(size=count)) * total
+        return self.invert(epochs)
+
+    def chunks(self) -> typing.Iterator[numpy.ndarray]:
+        """
+        Lazily generates the arrival stream in arrays of at most chunk_size arrival times, so that long horizons do not
+        need to be materialized at once.
+        """
+        total = self.expected_arrivals()
+        last_epoch = 0.0
+        while True:
+            epochs = last_epoch + numpy.cumsum(self._random_state.standard_exponential(size=self._chunk_size))
+            last_epoch = epochs[-1]
+            if last_epoch >= total:
+                epochs = epochs[epochs < total]
+                if epochs.size > 0:
+                    yield self.invert(epochs)
+                return
+            yield self.invert(epochs)
+
+    def __iter__(self) -> 'ArrivalStream':
+        return ArrivalStream(self)
+
+
+class ArrivalStream:
+    """
+    Iterator over the arrival times of a PiecewiseRateArrivals, produced chunk by chunk. Unlike a generator it can be
+    copied and pickled part way through, e.g. as part of a simulation snapshot, and reseeded to give a copy its own
+    future arrivals.
+    """
+    _arrivals: PiecewiseRateArrivals
+    _random_state: numpy.random.RandomState
+    _epochs: typing.List[float]  # unit-rate epochs of the current chunk
+    _times: typing.List[float]  # the same, mapped to arrival times
+    _position: int
+    _last_epoch: float  # epoch of the last arrival returned
+
+    def __init__(self, arrivals: PiecewiseRateArrivals):
+        self._arrivals = arrivals
+        self._random_state = arrivals._random_state
+        self._epochs = []
+        self._times = []
+        self._position = 0
+        self._last_epoch = 0.0
+
+    def __iter__(self) -> 'ArrivalStream':
+        return self
+
+    def __next__(self) -> float:
+        if self._position >= len(self._times):
+            self._next_chunk()
+        self._last_epoch = self._epochs[self._position]
+        time = self._times[self._position]
+        self._position += 1
+        return time
+
+    def _next_chunk(self):
+        total = self._arrivals.expected_arrivals()
+        start = self._epochs[-1] if self._epochs else self._last_epoch
+        if start >= total:
+            raise StopIteration
+        epochs = start + numpy.cumsum(self._random_state.standard_exponential(size=self._arrivals._chunk_size))
+        if epochs[-1] >= total:
+            # Keep the last epoch, so that the next call knows the stream has ended.
+            epochs = numpy.append(epochs[epochs < total], epochs[-1])
+            times = self._arrivals.invert(epochs[:-1])
+            self._epochs = epochs.tolist()
+            self._times = times.tolist()
+        else:
+            self._epochs = epochs.tolist()
+            self._times = self._arrivals.invert(epochs).tolist()
+        self._position = 0
+        if not self._times:
+            raise StopIteration
+
+    def reseed(self, random_state):
+        """
+        Discards the arrivals drawn but not yet returned and draws the rest of the stream from random_state. The
+        process is memoryless, so the result is still a sample of the same arrival process.
+
+        :param random_state: a numpy RandomState, or a seed (int or SeedSequence) used to create one
+        """
+        self._random_state = sampling.make_random_state(random_state)
+        self._epochs = []
+        self._times = []
+        self._position = 0
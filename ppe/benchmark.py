@@ -0,0 +1,344 @@
+"""
+Benchmarks of the simulation hot paths, with fixed seeds and a column of a demand file.
+
+Run with python -m ppe.benchmark --demand-file resources/demands_3_24.csv --output report.json
+[--baseline benchmarks/baseline.json], or the ppe-benchmark command of an installed package. The report is json; when
+a baseline report is given, throughput drops and memory increases beyond the tolerance are listed and the exit status
+is 1, so the benchmarks can gate changes before they reach production sweeps.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import typing
+import numpy
+from . import arrivals
+from . import framework
+from . import implement
+from . import sampling
+
+REPORT_FORMAT = 1
+MINUTES_PER_DAY = 60 * 24
+DEMAND_COLUMN = 'T_600'
+DEMAND_SCALE = (3 / 5.6) * (1 / 3)  # the scaling of example/fcfs_test.py
+SEED = 0
+# Infections per minute of contact, high enough that dozens of staff are infected during the staffed transmission
+# benchmark.
+TRANSMISSION_RATES = {'patient_to_staff_rate': 2e-5, 'staff_to_patient_rate': 2e-5, 'staff_to_staff_rate': 1e-6,
+                      'ppe_effectiveness': 0.5}
+
+_REQ_VENT = framework.InfectionSeverity.REQ_VENT
+
+
+class BenchmarkResult(typing.NamedTuple):
+    name: str
+    seconds: float  # fastest of the repeats
+    events: int  # simpy or heap engine events processed, or variates drawn for the sampling benchmark
+    arrivals: int
+    events_per_second: float
+    arrivals_per_second: float
+    peak_memory_bytes: typing.Optional[int]  # peak traced allocation during one run; None if not measured
+
+
+class Regression(typing.NamedTuple):
+    benchmark: str
+    metric: str
+    baseline: float
+    current: float
+    change: float  # relative change, (current - baseline) / baseline
+
+
+def _daily_rates(demand_path: str) -> numpy.ndarray:
+    return arrivals.read_demand_column(demand_path, DEMAND_COLUMN) * DEMAND_SCALE
+
+
+def _model(demand_path: str, sampling_mode: sampling.SamplingMode, stay_days: float,
+           transmission_rates: typing.Optional[typing.Dict[str, float]] = None,
+           interarrivals: bool = False) -> implement.HospitalModelImpl:
+    """
+    :param interarrivals: if set, arrivals are drawn as exponential interarrival times whose scale follows the demand
+        column, through the interarrival_function of example/fcfs_test.py, instead of by arrivals.PiecewiseRateArrivals
+    """
+    daily_rates = _daily_rates(demand_path)
+    if interarrivals:
+        def interarrival_function(time: float) -> float:
+            # Arrivals past the end of the demand column keep its last rate.
+            return MINUTES_PER_DAY / daily_rates[min(int(time / MINUTES_PER_DAY), len(daily_rates) - 1)]
+        arrival_process = {'interarrival_function': interarrival_function}
+    else:
+        arrival_process = {'arrival_times': arrivals.PiecewiseRateArrivals(daily_rates, period_length=MINUTES_PER_DAY,
+                                                                           random_state=SEED)}
+    return implement.HospitalModelImpl(icu_survivalprobs={_REQ_VENT: 0.5}, noicu_survivalprobs={_REQ_VENT: 0.05},
+                                       severity_dist={_REQ_VENT: 1},
+                                       stay_dists={_REQ_VENT: sampling.Poisson(mu=stay_days * MINUTES_PER_DAY)},
+                                       seed=SEED, sampling_mode=sampling_mode, **arrival_process,
+                                       **(transmission_rates or {}))
+
+
+def _run_counting(simulation: framework.ICUSimulation, until: float) -> int:
+    """
+    Runs a simulation until the given time like ICUSimulation.run, counting the events processed.
+    """
+    env = simulation.env
+    events = 0
+    while env.peek() < until:
+        env.step()
+        events += 1
+    return events
+
+
+def _simulation_run(simulation: framework.ICUSimulation, until: float,
+                    count_arrivals: typing.Callable[[], int]) -> typing.Callable[[], typing.Tuple[int, int]]:
+    def run():
+        simulation.start()
+        return _run_counting(simulation, until), count_arrivals()
+    return run
+
+
+def fcfs_icu(demand_path: str, sampling_mode: sampling.SamplingMode = sampling.SamplingMode.LEGACY, days: int = 120):
+    """
+    icu_process under FirstComeFirstServedPolicy with a SummaryLogger, as in example/fcfs_test.py.
+    """
+    logger = implement.SummaryLogger()
+    simulation = framework.ICUSimulation(
+        hospital_state=implement.HospitalStateImpl(existing_patients={}, bedusers=set(), ventusers=set()),
+        logger=logger, policy=implement.FirstComeFirstServedPolicy(max_beds=180, max_ventilators=150),
+        model=_model(demand_path, sampling_mode, stay_days=10))
+    return _simulation_run(simulation, days * MINUTES_PER_DAY - 1, lambda: logger.arrivals)
+
+
+def least_busy_roster(demand_path: str, num_staff: int = 2000, max_patients: int = 2, days: int = 60,
+                      transmission_rates: typing.Optional[typing.Dict[str, float]] = None):
+    """
+    icu_process under LeastBusyPolicy with a large roster, half of it on shift at the start. Exercises the staff
+    indexes of HospitalStateImpl, shift ends and reassignments, and with transmission_rates also the contact tracking
+    and the transmission draws at every shift end.
+    """
+    def status(last_shift_end: int) -> framework.StaffStatus:
+        return framework.StaffStatus(covid_status=framework.InfectionStatus.SUSCEPTIBLE,
+                                     covid_severity=framework.InfectionSeverity.NOT_INFECTED,
+                                     test_status=framework.TestStatus.NOT_SUSPECTED, last_shift_end=last_shift_end)
+
+    shift_length = 12 * 60
+    active = {framework.StaffInfo(i): status(0) for i in range(num_staff // 2)}
+    inactive = {framework.StaffInfo(i): status(-i) for i in range(num_staff // 2, num_staff)}
+    # Stagger the first shift ends, so that shifts end throughout the day.
+    options = {s: framework.StaffOptions(ppe=framework.PPE.FULL_PPE, shift_end=1 + s.sid * shift_length // len(active))
+               for s in active}
+    hospital = implement.HospitalStateImpl(existing_patients={}, ppe_level=implement.PPEStock(10 ** 9),
+                                           inactive_staff=inactive, active_staff=active,
+                                           active_staff_options=options,
+                                           existing_assignments={s: set() for s in active}, bedusers=set(),
+                                           ventusers=set())
+    logger = implement.SummaryLogger()
+    simulation = framework.ICUSimulation(hospital_state=hospital, logger=logger,
+                                         policy=implement.LeastBusyPolicy(max_patients=max_patients,
+                                                                          shift_length=shift_length),
+                                         model=_model(demand_path, sampling.SamplingMode.BUFFERED, stay_days=3,
+                                                      transmission_rates=transmission_rates))
+    return _simulation_run(simulation, days * MINUTES_PER_DAY - 1, lambda: logger.arrivals)
+
+
+def loss_system(demand_path: str, days: int = 120):
+    """
+    The FirstComeFirstServedPolicy run of fcfs_icu on run_loss_system, the heap engine that run_icu uses for
+    unstaffed loss-system policies.
+    """
+    hospital = implement.HospitalStateImpl(existing_patients={}, bedusers=set(), ventusers=set())
+    logger = implement.SummaryLogger()
+    policy = implement.FirstComeFirstServedPolicy(max_beds=180, max_ventilators=150)
+    model = _model(demand_path, sampling.SamplingMode.LEGACY, stay_days=10)
+
+    def run():
+        framework.run_loss_system(hospital_state=hospital, logger=logger, policy=policy, model=model,
+                                  until=days * MINUTES_PER_DAY - 1)
+        # The engine processes every arrival, and the exit of every admitted patient who has left; all of them had beds.
+        return logger.arrivals + logger.admissions - hospital.num_beds_used(), logger.arrivals
+    return run
+
+
+def csv_logger(demand_path: str, days: int = 120):
+    """
+    The FirstComeFirstServedPolicy run of fcfs_icu with a CSVLogger writing both files to memory.
+    """
+    event_file, patient_file = io.StringIO(), io.StringIO()
+    simulation = framework.ICUSimulation(
+        hospital_state=implement.HospitalStateImpl(existing_patients={}, bedusers=set(), ventusers=set()),
+        logger=implement.CSVLogger(event_file=event_file, patient_file=patient_file),
+        policy=implement.FirstComeFirstServedPolicy(max_beds=180, max_ventilators=150),
+        model=_model(demand_path, sampling.SamplingMode.LEGACY, stay_days=10))
+
+    def count_arrivals() -> int:
+        # The patient file has a header and one row per arrival.
+        return patient_file.getvalue().count('\n') - 1
+    return _simulation_run(simulation, days * MINUTES_PER_DAY - 1, count_arrivals)
+
+
+def model_sampling(demand_path: str, sampling_mode: sampling.SamplingMode = sampling.SamplingMode.LEGACY,
+                   num_patients: int = 40000):
+    """
+    HospitalModelImpl alone: the severity, interarrival, outcome and stay draws of num_patients patients, five variates
+    each. Arrivals come from the interarrival_function path, which draws every variate from the model's own streams.
+    """
+    model = _model(demand_path, sampling_mode, stay_days=10, interarrivals=True)
+
+    def run():
+        for _ in range(num_patients):
+            arrival = model.generate_next_arrival()
+            model.generate_icu_outcome(arrival.patient, arrival.status)
+            model.generate_noicu_outcome(arrival.patient, arrival.status)
+            model.generate_stay_length(arrival.patient, arrival.status)
+        # generate_next_arrival draws the severity and the interarrival time.
+        return 5 * num_patients, num_patients
+    return run
+
+
+# Every benchmark is a function that takes the path of the demand file, does the setup and returns the run to time,
+# which returns the number of events and arrivals it processed.
+BENCHMARKS: typing.Dict[str, typing.Callable[[str], typing.Callable[[], typing.Tuple[int, int]]]] = {
+    'fcfs_icu_legacy': fcfs_icu,
+    'fcfs_icu_buffered': lambda demand_path: fcfs_icu(demand_path, sampling.SamplingMode.BUFFERED),
+    'least_busy_large_roster': least_busy_roster,
+    'least_busy_transmission': lambda demand_path: least_busy_roster(demand_path, num_staff=100,
+                                                                     transmission_rates=TRANSMISSION_RATES),
+    'loss_system': loss_system,
+    'csv_logger': csv_logger,
+    'model_sampling_legacy': model_sampling,
+    'model_sampling_buffered': lambda demand_path: model_sampling(demand_path, sampling.SamplingMode.BUFFERED),
+}
+
+
+def run_benchmark(name: str, demand_path: str, repeats: int = 3, measure_memory: bool = True) -> BenchmarkResult:
+    """
+    Times a benchmark of BENCHMARKS. Each repeat sets the benchmark up again, and only the run is timed. Memory is
+    measured in an extra run, since tracing allocations slows the run down.
+    """
+    make_run = BENCHMARKS[name]
+    best = None
+    counts = None
+    for _ in range(repeats):
+        run = make_run(demand_path)
+        start = time.perf_counter()
+        counts = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak_memory = None
+    if measure_memory:
+        run = make_run(demand_path)
+        tracemalloc.start()
+        try:
+            run()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    events, num_arrivals = counts
+    return BenchmarkResult(name=name, seconds=best, events=events, arrivals=num_arrivals,
+                           events_per_second=events / best, arrivals_per_second=num_arrivals / best,
+                           peak_memory_bytes=peak_memory)
+
+
+def run_benchmarks(demand_path: str, names: typing.Optional[typing.Iterable[str]] = None, repeats: int = 3,
+                   measure_memory: bool = True) -> typing.Dict:
+    """
+    Runs benchmarks and returns the report, a json-compatible dictionary.
+
+    :param demand_path: the demand file whose DEMAND_COLUMN drives the arrivals, normally resources/demands_3_24.csv
+
+    :param names: names of BENCHMARKS to run; all of them by default
+    :param repeats: the fastest of this many runs is reported
+    :param measure_memory: whether to measure peak memory
+    """
+    if names is None:
+        names = list(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            raise RuntimeError("Unknown benchmark {}.".format(name))
+    results = [run_benchmark(name, demand_path, repeats=repeats, measure_memory=measure_memory) for name in names]
+    return {
+        'format': REPORT_FORMAT,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'repeats': repeats,
+        'demand': '{}:{}'.format(os.path.basename(demand_path), DEMAND_COLUMN),
+        'benchmarks': {r.name: r._asdict() for r in results},
+    }
+
+
+def compare(report: typing.Dict, baseline: typing.Dict, tolerance: float = 0.1) -> typing.List[Regression]:
+    """
+    Lists the regressions of a report against a baseline report: throughput lower or peak memory higher by more than
+    tolerance (relative), and changed event counts, which mean that the benchmark no longer does the same work.
+    Benchmarks missing from either report are ignored.
+    """
+    regressions = []
+    for name, current in report['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if previous is None:
+            continue
+        for metric in ('events', 'arrivals'):
+            if current[metric] != previous[metric]:
+                regressions.append(Regression(benchmark=name, metric=metric, baseline=previous[metric],
+                                              current=current[metric],
+                                              change=(current[metric] - previous[metric]) / max(previous[metric], 1)))
+        for metric, sign in (('events_per_second', -1), ('arrivals_per_second', -1), ('peak_memory_bytes', 1)):
+            if current.get(metric) is None or not previous.get(metric):
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            if sign * change > tolerance:
+                regressions.append(Regression(benchmark=name, metric=metric, baseline=previous[metric],
+                                              current=current[metric], change=change))
+    return regressions
+
+
+def _format_report(report: typing.Dict) -> str:
+    lines = ["{:<26}{:>10}{:>14}{:>14}{:>12}".format('benchmark', 'seconds', 'events/s', 'arrivals/s', 'peak MB')]
+    for name, result in report['benchmarks'].items():
+        memory = result['peak_memory_bytes']
+        lines.append("{:<26}{:>10.3f}{:>14.0f}{:>14.0f}{:>12}".format(
+            name, result['seconds'], result['events_per_second'], result['arrivals_per_second'],
+            '-' if memory is None else "{:.1f}".format(memory / 2 ** 20)))
+    return '\n'.join(lines)
+
+
+def main(argv: typing.Optional[typing.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m ppe.benchmark', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--demand-file', required=True,
+                        help="demand csv with a {} column, e.g. resources/demands_3_24.csv of the source tree; "
+                             "baseline reports are only comparable on the same file".format(DEMAND_COLUMN))
+    parser.add_argument('--output', help="write the json report to this file")
+    parser.add_argument('--baseline', help="compare against this json report")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="relative slowdown or memory increase reported as a regression (default 0.1)")
+    parser.add_argument('--repeats', type=int, default=3, help="report the fastest of this many runs (default 3)")
+    parser.add_argument('--no-memory', action='store_true', help="do not measure peak memory")
+    parser.add_argument('benchmarks', nargs='*', help="benchmarks to run (default all): " + ', '.join(BENCHMARKS))
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.demand_file, args.benchmarks or None, repeats=args.repeats,
+                            measure_memory=not args.no_memory)
+    print(_format_report(report))
+    if args.output is not None:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare(report, json.load(baseline_file), tolerance=args.tolerance)
+    for r in regressions:
+        print("REGRESSION {}: {} {:g} -> {:g} ({:+.1%})".format(r.benchmark, r.metric, r.baseline, r.current, r.change))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
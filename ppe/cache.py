@@ -0,0 +1,237 @@
+import enum
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+import typing
+import numpy
+from . import replication
+
+
+_code_version: typing.Optional[str] = None
+
+
+def code_version() -> str:
+    """
+    A hash of the source files of this package, so that cached results are not reused after the code changes.
+    """
+    global _code_version
+    if _code_version is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(package_dir)):
+            if name.endswith('.py'):
+                digest.update(name.encode())
+                with open(os.path.join(package_dir, name), 'rb') as source:
+                    digest.update(source.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def _canonical(value):
+    """
+    Converts a value into a json-compatible structure that only depends on its content.
+    """
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, enum.Enum):
+        return "{}.{}".format(type(value).__name__, value.name)
+    if isinstance(value, numpy.generic):
+        return _canonical(value.item())
+    if isinstance(value, numpy.ndarray):
+        array = numpy.ascontiguousarray(value)
+        return {'array': str(array.dtype), 'shape': list(array.shape),
+                'sha256': hashlib.sha256(array.tobytes()).hexdigest()}
+    if isinstance(value, numpy.random.SeedSequence):
+        return {'seed_sequence': _canonical(value.entropy), 'spawn_key': list(value.spawn_key),
+                'pool_size': value.pool_size}
+    if isinstance(value, tuple) and hasattr(value, '_fields'):
+        return {'type': type(value).__qualname__, 'fields': {f: _canonical(getattr(value, f)) for f in value._fields}}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, dict):
+        items = [(json.dumps(_canonical(k), sort_keys=True), _canonical(v)) for k, v in value.items()]
+        return {'dict': sorted(items, key=lambda item: item[0])}
+    if hasattr(value, 'dist') and hasattr(value, 'args') and hasattr(value, 'kwds'):
+        # A frozen scipy.stats distribution
+        return {'distribution': value.dist.name, 'args': _canonical(tuple(value.args)),
+                'kwds': _canonical(dict(value.kwds))}
+    raise RuntimeError("Cannot fingerprint a value of type {}.".format(type(value).__name__))
+
+
+def content_hash(*parts) -> str:
+    """
+    A content hash of parts alone, for keys that must stay the same when the code changes.
+    """
+    content = json.dumps(_canonical(parts), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def fingerprint(*parts) -> str:
+    """
+    A content hash of parts, together with the code version.
+    """
+    content = json.dumps([code_version(), _canonical(parts)], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def scenario_key(scenario: replication.ICUScenario, horizon: float, seed, kind: str = 'summary') -> str:
+    """
+    The cache key of one run of a scenario: its demand data, policy type and parameters, model parameters, the
+    horizon, the seed and the code version.
+
+    :param kind: what is cached for the run, e.g. 'summary' or 'events'
+    """
+    return fingerprint(kind, scenario, horizon, seed)
+
+
+class ResultCache:
+    """
+    A content-addressed cache of results on disk, shared between processes and users of the same directory.
+
+    Each entry is one pickle file named by its key. Entries are written to a temporary file and moved into place, so
+    concurrent writers never expose partial entries and readers see either the old state or the complete entry. The
+    modification time records the last use; when the cache grows beyond max_bytes or max_entries, the least recently
+    used entries are removed. Entries that cannot be read, e.g. truncated by a full disk, are treated as missing.
+    """
+    _directory: str
+    _max_bytes: typing.Optional[int]
+    _max_entries: typing.Optional[int]
+    _evict_interval: int
+    _temp_max_age: float
+    _puts: int
+
+    def __init__(self, directory: str, max_bytes: typing.Optional[int] = None,
+                 max_entries: typing.Optional[int] = None, evict_interval: int = 64, temp_max_age: float = 3600.0):
+        """
+        :param directory: cache directory; created if needed
+        :param max_bytes: size limit of all entries together
+        :param max_entries: limit on the number of entries
+        :param evict_interval: the limits are enforced once every this many puts by this object (and on evict)
+        :param temp_max_age: seconds after which evict removes temporary files, which are left behind by writers that
+            were killed before moving them into place
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._evict_interval = evict_interval
+        self._temp_max_age = temp_max_age
+        self._puts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key + '.pkl')
+
+    def get(self, key: str, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                value = pickle.load(entry)
+        except FileNotFoundError:
+            return default
+        except Exception:
+            # Unpickling damaged data can raise almost anything. The next put replaces the entry.
+            return default
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def put(self, key: str, value):
+        handle, temp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as entry:
+                pickle.dump(value, entry, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self._puts += 1
+        if self._puts % self._evict_interval == 0:
+            self.evict()
+
+    def get_or_run(self, key: str, run: typing.Callable[[], typing.Any]):
+        """
+        Returns the cached value for key, or runs run and caches its result.
+        """
+        value = self.get(key)
+        if value is None:
+            value = run()
+            self.put(key, value)
+        return value
+
+    def _entries(self, suffix: str = '.pkl') -> typing.List[typing.Tuple[float, int, str]]:
+        entries = []
+        with os.scandir(self._directory) as scan:
+            for item in scan:
+                if item.name.endswith(suffix):
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def __len__(self) -> int:
+        return len(self._entries())
+
+    def evict(self):
+        """
+        Removes temporary files older than temp_max_age, and the least recently used entries until the cache is within
+        its limits.
+        """
+        stale = time.time() - self._temp_max_age
+        for modified, _, path in self._entries('.tmp'):
+            if modified < stale:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        if self._max_bytes is None and self._max_entries is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in entries:
+            if (self._max_bytes is None or total <= self._max_bytes) and \
+                    (self._max_entries is None or count <= self._max_entries):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+            total -= size
+            count -= 1
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def cached_replication(cache: typing.Optional[ResultCache], scenario: replication.ICUScenario, horizon: float,
+                       index: int, seed: numpy.random.SeedSequence) -> replication.ReplicationSummary:
+    """
+    run_replication of scenario.build, reusing the cached summary of an identical run if there is one.
+    """
+    if cache is None:
+        return replication.run_replication(scenario.build, horizon, index, seed)
+    summary = cache.get_or_run(scenario_key(scenario, horizon, seed),
+                               lambda: replication.run_replication(scenario.build, horizon, 0, seed))
+    return summary._replace(replication=index)
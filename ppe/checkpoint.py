@@ -0,0 +1,92 @@
+import typing
+from . import cache as result_cache
+from . import framework
+from . import implement
+from . import replication
+
+
+def prefix_configuration(policy: framework.HospitalPolicy, time: float):
+    """
+    A description of how policy behaves before time. Policies with a configuration_before method (e.g.
+    FirstComeFirstServedPolicy with a capacity schedule) share a prefix with any policy of the same type whose
+    configuration before time is equal; other policies only share prefixes with equal policies.
+    """
+    configuration_before = getattr(policy, 'configuration_before', None)
+    if configuration_before is None:
+        return type(policy).__qualname__, policy
+    return type(policy).__qualname__, configuration_before(time)
+
+
+def _base_key(scenario: replication.ICUScenario, seed) -> str:
+    # Everything except the policy must match for two runs to share a prefix, including demand after the checkpoint,
+    # since the arrival stream in a snapshot has already drawn some arrivals ahead.
+    return result_cache.fingerprint('checkpoint', scenario._replace(policy=None), seed)
+
+
+def _index_key(base_key: str) -> str:
+    return result_cache.fingerprint('checkpoint-index', base_key)
+
+
+def _checkpoint_key(base_key: str, policy: framework.HospitalPolicy, time: float) -> str:
+    return result_cache.fingerprint('checkpoint', base_key, prefix_configuration(policy, time), time)
+
+
+def find_checkpoint(cache: result_cache.ResultCache, scenario: replication.ICUScenario, horizon: float,
+                    seed) -> typing.Optional[framework.SimulationSnapshot]:
+    """
+    The latest checkpoint no later than horizon from which a run of scenario can be continued, or None.
+    """
+    base_key = _base_key(scenario, seed)
+    for time in sorted(cache.get(_index_key(base_key), ()), reverse=True):
+        if time > horizon:
+            continue
+        snapshot = cache.get(_checkpoint_key(base_key, scenario.policy, time))
+        if snapshot is not None:
+            return snapshot
+    return None
+
+
+def run_incremental(cache: result_cache.ResultCache, scenario: replication.ICUScenario, horizon: float, seed,
+                    checkpoint_times: typing.Iterable[float] = (), replication_index: int = 0,
+                    ) -> replication.ReplicationSummary:
+    """
+    Runs scenario until horizon, starting from the latest cached checkpoint whose prefix matches rather than from
+    time 0, and stores new checkpoints along the way.
+
+    Checkpoints are taken at the change times of the policy (e.g. FirstComeFirstServedPolicy.capacity_schedule), at
+    checkpoint_times and at horizon. A checkpoint at time t can be reused by any run with the same model parameters,
+    demand and seed whose policy has the same prefix_configuration at t, so changing a parameter from day N only
+    re-simulates from the latest checkpoint before day N. The summary is identical to run_replication of the
+    scenario with the same seed.
+
+    :param cache: where checkpoints are stored; snapshots must be picklable, as those of ICUScenario runs are
+    :param scenario: the run to do
+    :param horizon: simulation time at which the run stops
+    :param seed: seed of the run, as for ICUScenario.build
+    :param checkpoint_times: additional times to checkpoint at
+    :param replication_index: recorded as the replication of the summary
+    """
+    base_key = _base_key(scenario, seed)
+    snapshot = find_checkpoint(cache, scenario, horizon, seed)
+    if snapshot is None:
+        setup = scenario.build(seed)
+        simulation = framework.ICUSimulation(hospital_state=setup.hospital_state, logger=implement.SummaryLogger(),
+                                            policy=setup.policy, model=setup.model)
+        simulation.start()
+    else:
+        simulation = framework.ICUSimulation.resume(snapshot, policy=scenario.policy)
+
+    times = set(checkpoint_times)
+    times.update(getattr(scenario.policy, 'change_times', list)())
+    times.add(horizon)
+    new_times = []
+    for time in sorted(t for t in times if simulation.env.now < t <= horizon):
+        simulation.run(time)
+        cache.put(_checkpoint_key(base_key, scenario.policy, time), simulation.snapshot(include_logger=True))
+        new_times.append(time)
+
+    if new_times:
+        # Concurrent runs may overwrite each other's additions; a lost time only means a missed reuse.
+        index_key = _index_key(base_key)
+        cache.put(index_key, sorted(set(cache.get(index_key, ())).union(new_times)))
+    return replication.summarize(simulation.logger, replication_index)
@@ -0,0 +1,156 @@
+"""
+A store of parsed demand scenarios: the columns of resources/demands_*.csv files as daily float arrays, indexed by file
+and column.
+
+The files are parsed once, by arrivals.read_demand_table, into one flat float64 block. The block can be saved as a .npy
+file and memory-mapped by later runs, or placed in shared memory for the worker processes of a sweep, which then attach to it
+read-only without parsing anything.
+"""
+import contextlib
+import json
+import os
+import typing
+from multiprocessing import shared_memory
+import numpy
+from . import arrivals
+
+# (offset, length) in the block of every column, by file name and then column name.
+DemandIndex = typing.Dict[str, typing.Dict[str, typing.Tuple[int, int]]]
+
+
+class SharedDemandStore(typing.NamedTuple):
+    """
+    What a worker process needs to attach to a store placed in shared memory by share_store. It is small, so it can
+    be passed to every worker.
+    """
+    name: str  # of the shared memory block
+    size: int  # number of values in the block
+    index: DemandIndex
+
+
+class DemandStore:
+    """
+    Daily demand values of the columns of one or more demand files. Files are identified by their base name, as in the
+    keys of sweep cells. Columns are returned as read-only views of the block, so they are never copied.
+    """
+    _values: numpy.ndarray
+    _index: DemandIndex
+    _memory: typing.Optional[shared_memory.SharedMemory]  # kept open as long as the store uses it
+
+    def __init__(self, values: numpy.ndarray, index: DemandIndex,
+                 memory: typing.Optional[shared_memory.SharedMemory] = None):
+        self._values = values
+        self._values.flags.writeable = False
+        self._index = index
+        self._memory = memory
+
+    @classmethod
+    def from_files(cls, paths: typing.Iterable[str],
+                   columns: typing.Optional[typing.Iterable[str]] = None) -> 'DemandStore':
+        """
+        Parses demand files in one pass each.
+
+        :param paths: paths of the demand csv files. Their base names must differ.
+        :param columns: if given, only these columns are kept, from the files that have them
+        """
+        wanted = None if columns is None else set(columns)
+        blocks = []
+        index = {}
+        offset = 0
+        for path in paths:
+            name = os.path.basename(path)
+            if name in index:
+                raise RuntimeError("Two demand files are named {}.".format(name))
+            header, table = arrivals.read_demand_table(path)
+            index[name] = {}
+            for i, column in enumerate(header):
+                if wanted is not None and column not in wanted:
+                    continue
+                blocks.append(table[:, i])
+                index[name][column] = (offset, len(table))
+                offset += len(table)
+        values = numpy.concatenate(blocks) if blocks else numpy.zeros(0)
+        return cls(values, index)
+
+    def files(self) -> typing.List[str]:
+        return list(self._index.keys())
+
+    def columns(self, file: str) -> typing.List[str]:
+        return list(self._file_index(file).keys())
+
+    def column(self, file: str, column: str) -> numpy.ndarray:
+        """
+        The daily values of a column, as a read-only view.
+
+        :param file: name or path of the demand file
+        """
+        location = self._file_index(file).get(column)
+        if location is None:
+            raise RuntimeError("Demand file {} has no column {}.".format(file, column))
+        offset, length = location
+        return self._values[offset:offset + length]
+
+    def _file_index(self, file: str) -> typing.Dict[str, typing.Tuple[int, int]]:
+        columns = self._index.get(os.path.basename(file))
+        if columns is None:
+            raise RuntimeError("Demand file {} is not in the store.".format(file))
+        return columns
+
+    def save(self, path: str):
+        """
+        Saves the store as path.npy, holding the block, and path.json, holding the index.
+        """
+        numpy.save(path + '.npy', self._values)
+        with open(path + '.json', 'w') as index_file:
+            json.dump(self._index, index_file)
+
+    @classmethod
+    def load(cls, path: str) -> 'DemandStore':
+        """
+        Loads a store saved by save. The block is memory-mapped, so only the pages of the columns used are read.
+        """
+        with open(path + '.json') as index_file:
+            index = {f: {c: tuple(location) for c, location in columns.items()}
+                     for f, columns in json.load(index_file).items()}
+        return cls(numpy.load(path + '.npy', mmap_mode='r'), index)
+
+    @classmethod
+    def attach(cls, shared: SharedDemandStore) -> 'DemandStore':
+        """
+        Attaches to a store placed in shared memory by share_store, e.g. in a worker process.
+        """
+        memory = shared_memory.SharedMemory(name=shared.name)
+        return cls(numpy.ndarray((shared.size,), dtype=float, buffer=memory.buf), shared.index, memory)
+
+
+@contextlib.contextmanager
+def share_store(store: DemandStore) -> typing.Iterator[SharedDemandStore]:
+    """
+    Copies a store into a shared memory block for the duration of the with block, which then removes it.
+    """
+    values = store._values
+    memory = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        numpy.ndarray(values.shape, dtype=float, buffer=memory.buf)[:] = values
+        yield SharedDemandStore(name=memory.name, size=len(values), index=store._index)
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+# The store of the sweep cells run in a worker process; attached once per worker by attach_worker_store.
+_worker_store: typing.Optional[DemandStore] = None
+
+
+def attach_worker_store(shared: SharedDemandStore):
+    """
+    Process pool initializer that attaches the worker to a shared store, which worker_store then returns.
+    """
+    global _worker_store
+    _worker_store = DemandStore.attach(shared)
+
+
+def worker_store() -> DemandStore:
+    if _worker_store is None:
+        raise RuntimeError("This process is not attached to a demand store.")
+    return _worker_store
@@ -0,0 +1,265 @@
+import math
+import typing
+import numpy
+from . import framework
+from . import replication
+
+
+class FluidResult(typing.NamedTuple):
+    """
+    Output of FluidModel.run. Arrays indexed by scenario have shape (scenarios,); curves have shape
+    (scenarios, steps) and give the value at the end of each time step. Totals use the same definitions as
+    replication.ReplicationSummary, so they can be compared with simulated means.
+    """
+    times: numpy.ndarray  # start time of each step
+    beds: numpy.ndarray
+    ventilators: numpy.ndarray
+    blocked: numpy.ndarray  # arrivals declined during each step
+    arrivals: numpy.ndarray
+    admissions: numpy.ndarray
+    declines: numpy.ndarray
+    deaths: numpy.ndarray
+    discharges: numpy.ndarray
+    peak_beds: numpy.ndarray
+    peak_ventilators: numpy.ndarray
+
+
+class FluidModel:
+    """
+    A deterministic, time-stepped mean-field approximation of an ICU run under FirstComeFirstServedPolicy, for
+    screening many capacity and demand combinations at once.
+
+    Patients are treated as a continuous flow. In each step the expected arrivals of each severity are admitted up to
+    the free beds (and, for REQ_VENT patients, the free ventilators), sharing scarce beds in proportion to arrivals, as
+    first-come-first-served does on average. The expected exits of every admitted cohort are spread over later steps
+    according to the discretized stay distribution. Every scenario is advanced in the same vectorized step.
+
+    The approximation ignores randomness, so it underestimates peaks, and it smooths the blocking near capacity. Use
+    calibration_report to check it against the discrete-event simulation.
+    """
+    _severities: typing.Tuple[framework.InfectionSeverity, ...]
+    _severity_probs: numpy.ndarray
+    _needs_ventilator: numpy.ndarray
+    _icu_death_probs: numpy.ndarray
+    _noicu_death_probs: numpy.ndarray
+    _stay_pmfs: numpy.ndarray  # (severities, max stay in steps + 1), mass of leaving k steps after admission
+    _period_length: float
+    _step: float
+
+    def __init__(self, icu_survivalprobs: typing.Dict[framework.InfectionSeverity, float],
+                 noicu_survivalprobs: typing.Dict[framework.InfectionSeverity, float],
+                 severity_dist: typing.Dict[framework.InfectionSeverity, float],
+                 stay_dists: typing.Dict, period_length: float = 1.0, step: typing.Optional[float] = None,
+                 tail_probability: float = 1e-9):
+        """
+        :param icu_survivalprobs: as for HospitalModelImpl
+        :param noicu_survivalprobs: as for HospitalModelImpl
+        :param severity_dist: as for HospitalModelImpl
+        :param stay_dists: as for HospitalModelImpl; distributions of stay length in simulation time, with cdf and
+            ppf methods
+        :param period_length: length of a demand period in simulation time units (e.g. minutes per day)
+        :param step: length of a time step; a 24th of a period by default
+        :param tail_probability: stays beyond this upper quantile are cut off and counted at the cutoff
+        """
+        self._severities = tuple(severity_dist.keys())
+        self._severity_probs = numpy.array([severity_dist[s] for s in self._severities], dtype=float)
+        self._needs_ventilator = numpy.array([s == framework.InfectionSeverity.REQ_VENT for s in self._severities])
+        self._icu_death_probs = numpy.array([1 - icu_survivalprobs[s] for s in self._severities], dtype=float)
+        self._noicu_death_probs = numpy.array([1 - noicu_survivalprobs[s] for s in self._severities], dtype=float)
+        self._period_length = period_length
+        self._step = period_length / 24 if step is None else step
+
+        # A patient admitted uniformly within a step and staying x leaves about round(x / step) steps later.
+        pmfs = []
+        for severity in self._severities:
+            dist = stay_dists[severity]
+            max_steps = max(int(math.ceil(dist.ppf(1 - tail_probability) / self._step)), 1)
+            edges = (numpy.arange(max_steps + 1) + 0.5) * self._step
+            cdf = numpy.concatenate(([0.0], dist.cdf(edges[:-1]), [1.0]))
+            pmfs.append(numpy.diff(cdf))
+        width = max(len(p) for p in pmfs)
+        self._stay_pmfs = numpy.zeros((len(pmfs), width))
+        for i, pmf in enumerate(pmfs):
+            self._stay_pmfs[i, :len(pmf)] = pmf
+        # Exits in the step of admission are counted in the next step, as the census is recorded after admissions.
+        self._stay_pmfs[:, 1] += self._stay_pmfs[:, 0]
+        self._stay_pmfs[:, 0] = 0
+
+    @classmethod
+    def from_scenario(cls, scenario: replication.ICUScenario, step: typing.Optional[float] = None) -> 'FluidModel':
+        return cls(icu_survivalprobs=scenario.icu_survivalprobs, noicu_survivalprobs=scenario.noicu_survivalprobs,
+                   severity_dist=scenario.severity_dist, stay_dists=scenario.stay_dists,
+                   period_length=scenario.period_length, step=step)
+
+    def step_length(self) -> float:
+        return self._step
+
+    def num_steps(self, horizon: float) -> int:
+        return int(math.ceil(horizon / self._step))
+
+    def policy_capacity(self, policy: framework.HospitalPolicy,
+                        horizon: float) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        The bed and ventilator capacity of a policy in each step until horizon, shape (1, steps), for run. Policies with
+        a capacity_at method (e.g. FirstComeFirstServedPolicy with a capacity_schedule) get the capacity at the start
+        of each step; others need max_beds and max_ventilators.
+        """
+        times = numpy.arange(self.num_steps(horizon)) * self._step
+        capacity_at = getattr(policy, 'capacity_at', None)
+        if capacity_at is not None:
+            capacity = numpy.array([capacity_at(t) for t in times], dtype=float).reshape(len(times), 2)
+            return capacity[None, :, 0], capacity[None, :, 1]
+        if not hasattr(policy, 'max_beds') or not hasattr(policy, 'max_ventilators'):
+            raise RuntimeError("The fluid model needs a policy with max_beds and max_ventilators.")
+        return (numpy.full((1, len(times)), policy.max_beds, dtype=float),
+                numpy.full((1, len(times)), policy.max_ventilators, dtype=float))
+
+    def run(self, daily_rates, max_beds, max_ventilators, horizon: float) -> FluidResult:
+        """
+        Propagates every scenario from an empty ICU at time 0 until horizon.
+
+        :param daily_rates: expected arrivals per period, shape (periods,) or (scenarios, periods). Periods after the
+            last have no arrivals, as with arrivals.PiecewiseRateArrivals.
+        :param max_beds: bed capacity, a scalar, shape (scenarios,), or shape (scenarios, steps) for capacity that
+            changes over time (see policy_capacity)
+        :param max_ventilators: ventilator capacity, shaped like max_beds
+        :param horizon: simulation time at which the runs stop
+        """
+        rates = numpy.atleast_2d(numpy.asarray(daily_rates, dtype=float))
+        max_beds = numpy.asarray(max_beds, dtype=float)
+        max_ventilators = numpy.asarray(max_ventilators, dtype=float)
+        num_scenarios = numpy.broadcast(rates[:, 0], _first_step(max_beds), _first_step(max_ventilators)).size
+        rates = numpy.broadcast_to(rates, (num_scenarios, rates.shape[1]))
+
+        num_steps = self.num_steps(horizon)
+        beds_cap = _capacity_per_step(max_beds, num_scenarios, num_steps)
+        vents_cap = _capacity_per_step(max_ventilators, num_scenarios, num_steps)
+        times = numpy.arange(num_steps) * self._step
+        period = (times / self._period_length).astype(int)
+        # Expected arrivals per step for every scenario, (steps, scenarios).
+        step_arrivals = numpy.zeros((num_steps, num_scenarios))
+        in_range = period < rates.shape[1]
+        step_arrivals[in_range] = rates[:, period[in_range]].T * (self._step / self._period_length)
+
+        num_severities = len(self._severities)
+        ring_size = self._stay_pmfs.shape[1]
+        offsets = numpy.arange(ring_size)
+        # Admissions of the last ring_size steps; slot t % ring_size holds step t. Exits are the stay pmf applied to
+        # this history, a matrix-vector product per severity, rather than spreading each cohort over future steps.
+        admitted_history = numpy.zeros((num_severities, ring_size, num_scenarios))
+        census = numpy.zeros((num_severities, num_scenarios))
+        vent = self._needs_ventilator[:, None]
+
+        beds_curve = numpy.zeros((num_scenarios, num_steps))
+        vents_curve = numpy.zeros((num_scenarios, num_steps))
+        blocked_curve = numpy.zeros((num_scenarios, num_steps))
+        admissions = numpy.zeros(num_scenarios)
+        deaths = numpy.zeros(num_scenarios)
+        discharges = numpy.zeros(num_scenarios)
+
+        for t in range(num_steps):
+            # Slot j holds admissions from (t - j) % ring_size steps ago. The slot of step t itself holds admissions
+            # from ring_size steps ago, which have all left, and gets weight pmf[0] = 0.
+            weights = self._stay_pmfs[:, (t - offsets) % ring_size]
+            exits = numpy.stack([weights[c] @ admitted_history[c] for c in range(num_severities)])
+            census -= exits
+            deaths += self._icu_death_probs @ exits
+            discharges += (1 - self._icu_death_probs) @ exits
+
+            arriving = self._severity_probs[:, None] * step_arrivals[t]
+            free_beds = numpy.maximum(beds_cap[:, t] - census.sum(axis=0), 0)
+            free_vents = numpy.maximum(vents_cap[:, t] - census[self._needs_ventilator].sum(axis=0), 0)
+            vent_arrivals = arriving[self._needs_ventilator].sum(axis=0)
+            vent_share = numpy.divide(numpy.minimum(vent_arrivals, free_vents), vent_arrivals,
+                                      out=numpy.ones(num_scenarios), where=vent_arrivals > 0)
+            wanting = numpy.where(vent, arriving * vent_share, arriving)
+            total_wanting = wanting.sum(axis=0)
+            bed_share = numpy.divide(numpy.minimum(total_wanting, free_beds), total_wanting,
+                                     out=numpy.ones(num_scenarios), where=total_wanting > 0)
+            admitted = wanting * bed_share
+            declined = arriving - admitted
+
+            census += admitted
+            admissions += admitted.sum(axis=0)
+            deaths += self._noicu_death_probs @ declined
+            admitted_history[:, t % ring_size, :] = admitted
+
+            beds_curve[:, t] = census.sum(axis=0)
+            vents_curve[:, t] = census[self._needs_ventilator].sum(axis=0)
+            blocked_curve[:, t] = declined.sum(axis=0)
+
+        arrivals = step_arrivals.sum(axis=0)
+        return FluidResult(times=times, beds=beds_curve, ventilators=vents_curve, blocked=blocked_curve,
+                           arrivals=arrivals, admissions=admissions, declines=blocked_curve.sum(axis=1),
+                           deaths=deaths, discharges=discharges, peak_beds=beds_curve.max(axis=1, initial=0),
+                           peak_ventilators=vents_curve.max(axis=1, initial=0))
+
+
+def _first_step(capacity: numpy.ndarray) -> numpy.ndarray:
+    return capacity[:, 0] if capacity.ndim == 2 else capacity
+
+
+def _capacity_per_step(capacity: numpy.ndarray, num_scenarios: int, num_steps: int) -> numpy.ndarray:
+    """
+    Broadcasts a capacity argument of FluidModel.run to shape (scenarios, steps).
+    """
+    if capacity.ndim < 2:
+        capacity = numpy.broadcast_to(capacity, (num_scenarios,))[:, None]
+    return numpy.broadcast_to(capacity, (num_scenarios, num_steps))
+
+
+class CalibrationRow(typing.NamedTuple):
+    scenario: int
+    output: str
+    simulated_mean: float
+    simulated_half_width: float
+    fluid: float
+    relative_error: float  # (fluid - simulated_mean) / simulated_mean
+    within_interval: bool  # fluid value inside the simulated confidence interval
+    trusted: bool  # within_interval or abs(relative_error) <= tolerance
+
+
+def calibration_report(scenarios: typing.Sequence[replication.ICUScenario], horizon: float,
+                       num_replications: int = 20,
+                       outputs: typing.Sequence[str] = ('admissions', 'declines', 'deaths', 'discharges', 'peak_beds',
+                                                        'peak_ventilators'),
+                       tolerance: float = 0.05, confidence: float = 0.95, step: typing.Optional[float] = None,
+                       seed=None, max_workers: typing.Optional[int] = None) -> typing.List[CalibrationRow]:
+    """
+    Compares the fluid approximation with discrete-event replications of the same scenarios, output by output, to show
+    where the approximation can be trusted.
+
+    :param scenarios: scenarios whose policy has max_beds and max_ventilators, e.g. FirstComeFirstServedPolicy, whose
+        capacity_schedule is followed
+    :param horizon: simulation time at which the runs stop
+    :param num_replications: discrete-event replications per scenario
+    :param outputs: fields of ReplicationSummary to compare
+    :param tolerance: relative error below which an output is trusted even outside the confidence interval
+    :param confidence: confidence level of the simulated intervals
+    :param step: time step of the fluid model
+    :param seed: root seed of the replications
+    :param max_workers: number of worker processes for the replications. 1 runs everything in this process.
+    """
+    rows = []
+    for index, scenario in enumerate(scenarios):
+        model = FluidModel.from_scenario(scenario, step=step)
+        max_beds, max_ventilators = model.policy_capacity(scenario.policy, horizon)
+        fluid = model.run(scenario.daily_rates, max_beds, max_ventilators, horizon)
+        summaries = replication.run_replications(scenario.build, horizon, num_replications, seed=seed,
+                                                 max_workers=max_workers)
+        for output in outputs:
+            statistics = replication.RunningStatistics()
+            for summary in summaries:
+                statistics.add(getattr(summary, output))
+            half_width = statistics.half_width(confidence)
+            fluid_value = float(getattr(fluid, output)[0])
+            if statistics.mean != 0:
+                relative_error = (fluid_value - statistics.mean) / statistics.mean
+            else:
+                relative_error = 0.0 if fluid_value == 0 else math.inf
+            within_interval = abs(fluid_value - statistics.mean) <= half_width
+            rows.append(CalibrationRow(scenario=index, output=output, simulated_mean=statistics.mean,
+                                       simulated_half_width=half_width, fluid=fluid_value,
+                                       relative_error=relative_error, within_interval=within_interval,
+                                       trusted=within_interval or abs(relative_error) <= tolerance))
+    return rows
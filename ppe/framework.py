@@ -1,5 +1,10 @@
+import copy
+import heapq
+import itertools
+import math
 import typing
 import enum
+import numpy
 import simpy
 
 
@@ -91,6 +96,12 @@ class StaffOptions(typing.NamedTuple):
 
 
 class HospitalState:
+    """
+    The get_* query methods return snapshots that the caller owns and may change. The *_view methods return read-only
+    views of the live state instead, without copying. A view reflects later changes to the state, so it must not be
+    iterated over while the state is being changed (e.g. while assigning, unassigning or ending shifts); take a snapshot
+    for that.
+    """
     def discharge_patient(self, patient: PatientInfo):
         raise NotImplementedError
 
@@ -109,6 +120,12 @@ class HospitalState:
     def get_active_staff(self) -> typing.Set[StaffInfo]:
         raise NotImplementedError
 
+    def patients_view(self, staff: StaffInfo) -> typing.AbstractSet[PatientInfo]:
+        raise NotImplementedError
+
+    def active_staff_view(self) -> typing.AbstractSet[StaffInfo]:
+        raise NotImplementedError
+
     def get_shift_end(self, staff: StaffInfo) -> int:
         raise NotImplementedError
 
@@ -133,6 +150,44 @@ class HospitalState:
     def add_patient(self, patient: PatientInfo, status: PatientStatus):
         raise NotImplementedError
 
+    def get_patient_status(self, patient: PatientInfo) -> PatientStatus:
+        raise NotImplementedError
+
+    def get_staff_status(self, staff: StaffInfo) -> StaffStatus:
+        raise NotImplementedError
+
+    def get_staff_options(self, staff: StaffInfo) -> StaffOptions:
+        raise NotImplementedError
+
+    def infect_patient(self, patient: PatientInfo):
+        raise NotImplementedError
+
+    def infect_staff(self, staff: StaffInfo):
+        raise NotImplementedError
+
+
+class InteractionBatch(typing.NamedTuple):
+    """
+    The staff-patient and staff-staff contact since the previous shift boundary. Row i of staff_patient_durations is
+    staff[i] and column j is patients[j]. The first num_on_shift staff were on shift for the whole interval, so each
+    pair of them was in contact for staff_staff_duration; the rest only ended contact with patients. Durations are in
+    simulation time units. Statuses are those at the time of the batch.
+    """
+    time: int
+    staff: typing.Tuple[StaffInfo, ...]
+    staff_statuses: typing.Tuple[StaffStatus, ...]
+    staff_ppe: typing.Tuple[typing.Optional[PPE], ...]
+    patients: typing.Tuple[PatientInfo, ...]
+    patient_statuses: typing.Tuple[PatientStatus, ...]
+    staff_patient_durations: numpy.ndarray
+    staff_staff_duration: float
+    num_on_shift: int
+
+
+class Transmissions(typing.NamedTuple):
+    infected_staff: typing.FrozenSet[StaffInfo] = frozenset()
+    infected_patients: typing.FrozenSet[PatientInfo] = frozenset()
+
 
 class HospitalModel:
 
@@ -148,8 +203,22 @@ class HospitalModel:
     def generate_stay_length(self, patient: PatientInfo, status: PatientStatus) -> int:
         raise NotImplementedError
 
-    def staff_to_patient_transmission(self, patient: PatientInfo, patient_status: PatientStatus,
-                                      staff_info: StaffInfo, staff_status: StaffStatus, interaction_duration: int):
+    def models_transmission(self) -> bool:
+        """
+        Whether the model can draw any transmissions. If not, simulations do not track contact at all.
+        """
+        return True
+
+    def staff_to_patient_transmission(self, batch: InteractionBatch) -> Transmissions:
+        """
+        Draws the infections caused by the staff-patient contact in a batch, in both directions.
+        """
+        raise NotImplementedError
+
+    def staff_to_staff_transmission(self, batch: InteractionBatch) -> typing.FrozenSet[StaffInfo]:
+        """
+        Draws the staff infected through the staff-staff contact in a batch.
+        """
         raise NotImplementedError
 
 
@@ -171,6 +240,10 @@ class ArrivalAssignment(typing.NamedTuple):
 
 
 class HospitalPolicy(typing.Generic[T]):
+    # A policy may set this to True if it admits patients based only on the current bed and ventilator counts, never
+    # assigns staff and never discharges early. The ICU is then a loss system, and run_icu uses run_loss_system
+    # instead of simpy. Read it with getattr, since NamedTuple policies do not inherit from this class.
+    loss_system_compatible: bool = False
 
     def arrival_assignment(self, arrival: PatientArrival, hospital: T) -> typing.Optional[ArrivalAssignment]:
         """
@@ -239,68 +312,520 @@ class HospitalLogger:
     def log_patient_freed_ventilator(self, time: int, patient: PatientInfo):
         pass
 
+    def log_patient_infected(self, time: int, patient: PatientInfo):
+        pass
 
-def handle_patient_exit(env: simpy.Environment, exit_time: int, patient: PatientInfo, outcome: Outcome,
-                        hospital: T, logger: HospitalLogger):
-    current_time = env.now
-    yield env.timeout(exit_time - current_time)
+    def log_staff_infected(self, time: int, staff: StaffInfo):
+        pass
+
+    def log_patient_transferred(self, time: int, patient: PatientInfo, site: int):
+        """
+        The patient arrived here but was sent to another site of a hospital network (see network.run_network), whose
+        logger records the rest of the stay.
+        """
+        pass
+
+
+class InteractionTracker:
+    """
+    Accumulates staff-patient and staff-staff contact time between shift boundaries, so that transmissions for all
+    pairs can be drawn in one vectorized step (see process_interactions) instead of simulating each interaction.
+
+    Staff only start and end shifts at shift boundaries, so every pair of staff on shift has been in contact for the
+    whole time since the previous boundary. Contact between a staff member and a patient starts when the patient is
+    assigned to them, and ends when the staff member goes off shift or the patient exits.
+    """
+    _last_boundary: float
+    _on_shift: typing.Dict[StaffInfo, None]  # used as an insertion-ordered set
+    _ppe: typing.Dict[StaffInfo, typing.Optional[PPE]]  # of the staff on shift
+    _staff_statuses: typing.Dict[StaffInfo, StaffStatus]  # of the staff on shift
+    _ended_ppe: typing.Dict[StaffInfo, typing.Optional[PPE]]  # of the staff who went off shift since the boundary
+    _open: typing.Dict[typing.Tuple[StaffInfo, PatientInfo], float]  # start of contact still going on
+    _closed: typing.Dict[typing.Tuple[StaffInfo, PatientInfo], float]  # contact time that ended since the boundary
+    # Open contacts. Dicts are used as sets because their order survives copying, which keeps the layout of the
+    # batches (and so the transmission draws) of a resumed snapshot the same as in the original run.
+    _by_staff: typing.Dict[StaffInfo, typing.Dict[PatientInfo, None]]
+    _by_patient: typing.Dict[PatientInfo, typing.Dict[StaffInfo, None]]
+    _patient_statuses: typing.Dict[PatientInfo, PatientStatus]
+
+    def __init__(self, time: float):
+        self._last_boundary = time
+        self._on_shift = {}
+        self._ppe = {}
+        self._staff_statuses = {}
+        self._ended_ppe = {}
+        self._open = {}
+        self._closed = {}
+        self._by_staff = {}
+        self._by_patient = {}
+        self._patient_statuses = {}
+
+    def start_shift(self, staff: StaffInfo, options: StaffOptions, status: StaffStatus):
+        self._on_shift[staff] = None
+        self._ppe[staff] = options.ppe
+        self._staff_statuses[staff] = status
+
+    def end_shift(self, staff: StaffInfo, time: float):
+        for patient in self._by_staff.pop(staff, ()):
+            self._close(staff, patient, time)
+            del self._by_patient[patient][staff]
+        if staff in self._on_shift:
+            del self._on_shift[staff]
+            del self._staff_statuses[staff]
+            self._ended_ppe[staff] = self._ppe.pop(staff)
+
+    def start_contact(self, staff: StaffInfo, patient: PatientInfo, status: PatientStatus, time: float):
+        if (staff, patient) in self._open:
+            return
+        self._open[(staff, patient)] = time
+        self._by_staff.setdefault(staff, {})[patient] = None
+        self._by_patient.setdefault(patient, {})[staff] = None
+        self._patient_statuses[patient] = status
+
+    def patient_exit(self, patient: PatientInfo, time: float):
+        for staff in self._by_patient.pop(patient, ()):
+            self._close(staff, patient, time)
+            del self._by_staff[staff][patient]
+
+    def _close(self, staff: StaffInfo, patient: PatientInfo, time: float):
+        duration = time - self._open.pop((staff, patient))
+        if duration > 0:
+            self._closed[(staff, patient)] = self._closed.get((staff, patient), 0) + duration
+
+    def record_infections(self, infected_patients: typing.Iterable[PatientInfo],
+                          infected_staff: typing.Iterable[StaffInfo] = ()):
+        for patient in infected_patients:
+            status = self._patient_statuses.get(patient)
+            if status is not None:
+                self._patient_statuses[patient] = status._replace(covid_status=InfectionStatus.INFECTED)
+        for staff in infected_staff:
+            status = self._staff_statuses.get(staff)
+            if status is not None:
+                self._staff_statuses[staff] = status._replace(covid_status=InfectionStatus.INFECTED)
+
+    def collect(self, time: int, hospital: HospitalState) -> typing.Optional[InteractionBatch]:
+        """
+        Builds the exposure matrix for the contact since the previous boundary and starts a new interval at time.
+
+        :return: the batch, or None if there was no contact
+        """
+        elapsed = time - self._last_boundary
+        self._last_boundary = time
+        pairs = list(self._closed.items())
+        pairs.extend(((staff, patient), time - start) for (staff, patient), start in self._open.items() if start < time)
+        self._closed = {}
+        for key in self._open:
+            self._open[key] = time
+
+        # Shift boundaries come once per shift per staff member, so the per-staff work here is kept to C-level copies
+        # and lookups; only the staff with patient contact are handled one at a time.
+        staff = list(self._on_shift)
+        num_on_shift = len(staff)
+        staff_index = dict(zip(staff, range(num_on_shift)))
+        patient_index = {}
+        rows = []
+        columns = []
+        durations = []
+        for (s, p), duration in pairs:
+            if s not in staff_index:
+                staff_index[s] = len(staff)
+                staff.append(s)
+            if p not in patient_index:
+                patient_index[p] = len(patient_index)
+            rows.append(staff_index[s])
+            columns.append(patient_index[p])
+            durations.append(duration)
+
+        patients = tuple(patient_index)
+        patient_statuses = tuple(self._patient_statuses[p] for p in patients)
+        for p in patients:
+            if p not in self._by_patient:
+                del self._patient_statuses[p]
+
+        ended_ppe = self._ended_ppe
+        self._ended_ppe = {}
+        if not durations and (elapsed <= 0 or num_on_shift < 2):
+            return None
+
+        staff_patient = numpy.zeros((len(staff), len(patients)))
+        numpy.add.at(staff_patient, (numpy.array(rows, dtype=int), numpy.array(columns, dtype=int)), durations)
+        ended = staff[num_on_shift:]
+        staff_statuses = list(map(self._staff_statuses.__getitem__, staff[:num_on_shift]))
+        staff_statuses.extend(hospital.get_staff_status(s) for s in ended)
+        staff_ppe = list(map(self._ppe.__getitem__, staff[:num_on_shift]))
+        staff_ppe.extend(ended_ppe.get(s) for s in ended)
+        return InteractionBatch(time=time, staff=tuple(staff), staff_statuses=tuple(staff_statuses),
+                                staff_ppe=tuple(staff_ppe), patients=patients,
+                                patient_statuses=patient_statuses, staff_patient_durations=staff_patient,
+                                staff_staff_duration=max(elapsed, 0), num_on_shift=num_on_shift)
+
+
+def process_interactions(time: int, hospital: T, logger: HospitalLogger, model: HospitalModel,
+                         interactions: InteractionTracker):
+    """
+    Draws the transmissions for all contact since the previous shift boundary in one step, and applies them.
+    """
+    batch = interactions.collect(time, hospital)
+    if batch is None:
+        return
+    transmissions = model.staff_to_patient_transmission(batch)
+    infected_staff = transmissions.infected_staff | model.staff_to_staff_transmission(batch)
+    infected_patients = [p for p in batch.patients if p in transmissions.infected_patients]
+    for patient in infected_patients:
+        hospital.infect_patient(patient)
+        logger.log_patient_infected(time=time, patient=patient)
+    infected_staff = [s for s in batch.staff if s in infected_staff]
+    for staff in infected_staff:
+        hospital.infect_staff(staff)
+        logger.log_staff_infected(time=time, staff=staff)
+    interactions.record_infections(infected_patients, infected_staff)
+
+
+def process_exit(exit_time: int, patient: PatientInfo, outcome: Outcome, hospital: T, logger: HospitalLogger,
+                 interactions: typing.Optional[InteractionTracker] = None):
     if not hospital.has_exited(patient):
         if outcome == Outcome.LIVES:
             logger.log_patient_discharge(time=exit_time, patient=patient)
         logger.log_patient_outcome(time=exit_time, patient=patient, outcome=outcome)
         hospital.discharge_patient(patient)
+        if interactions is not None:
+            interactions.patient_exit(patient, exit_time)
 
 
-def handle_staff_staff_interaction():
-    # TODO: implement this
-    yield
+class PendingExit(typing.NamedTuple):
+    exit_time: int
+    patient: PatientInfo
+    outcome: Outcome
 
 
-def handle_staff_patient_interaction():
-    # TODO: implement this
-    yield
+class PendingArrival(typing.NamedTuple):
+    arrival: PatientArrival
 
 
-def handle_patient_arrival(env: simpy.Environment, arrival: PatientArrival, hospital: T,
-                           policy: HospitalPolicy[T], logger: HospitalLogger, model: HospitalModel):
-    current_time = env.now
-    yield env.timeout(arrival.arrival_time - current_time)
+class PendingShiftEnd(typing.NamedTuple):
+    shift_end_time: int
+    staff: StaffInfo
+
+
+PendingEvent = typing.Union[PendingExit, PendingArrival, PendingShiftEnd]
+
+
+# Wraps a function so that its calls are timed: timer(component, name, function) returns the function to call instead.
+# See ppe.profiling.
+Timer = typing.Callable[[str, str, typing.Callable], typing.Callable]
 
+
+class FrameworkSteps(typing.NamedTuple):
+    """
+    The framework functions that the handlers call for each event, and the function that starts their simpy
+    processes. A run given a timer calls timed versions of them.
+    """
+    process_arrival: typing.Callable
+    apply_reassignment: typing.Callable
+    process_exit: typing.Callable
+    process_interactions: typing.Callable
+    start_process: typing.Callable[[simpy.Environment, typing.Generator], simpy.Process]
+
+
+def _start_process(env: simpy.Environment, generator: typing.Generator) -> simpy.Process:
+    return env.process(generator)
+
+
+def _timed_process(generator: typing.Generator, send: typing.Callable, throw: typing.Callable):
+    """
+    Runs a process generator through send and throw, so that each step of it can be timed.
+    """
+    value, error = None, None
+    while True:
+        try:
+            event = send(value) if error is None else throw(error)
+        except StopIteration:
+            return
+        value, error = None, None
+        try:
+            value = yield event
+        except Exception as e:  # e.g. simpy.Interrupt, which the generator may handle
+            error = e
+
+
+def framework_steps(timer: typing.Optional[Timer] = None) -> FrameworkSteps:
+    """
+    The framework steps, timed by timer if given: the framework functions as component 'framework', and the steps of
+    each handler process as component 'handler', named by the qualified name of its generator function.
+    """
+    steps = FrameworkSteps(process_arrival=process_arrival, apply_reassignment=apply_reassignment,
+                           process_exit=process_exit, process_interactions=process_interactions,
+                           start_process=_start_process)
+    if timer is None:
+        return steps
+
+    def start_timed_process(env: simpy.Environment, generator: typing.Generator) -> simpy.Process:
+        name = generator.__qualname__
+        return env.process(_timed_process(generator, timer('handler', name, generator.send),
+                                          timer('handler', name, generator.throw)))
+
+    return steps._replace(start_process=start_timed_process,
+                          **{name: timer('framework', name, getattr(steps, name))
+                             for name in ('process_arrival', 'apply_reassignment', 'process_exit',
+                                          'process_interactions')})
+
+
+class DischargeScheduler:
+    """
+    Keeps the pending exits of admitted patients in a single heap indexed by patient, served by one long-lived simpy
+    process that wakes at the next exit time. Pending exits can be cancelled, e.g. when a patient is discharged early.
+
+    Events at the same time are processed in the order they were scheduled, which is what simpy does when every exit
+    has its own process. To keep that order, other timed handlers (arrivals, shift ends) call reserve when they set
+    their timeout and release when it fires; release first processes any exits that were scheduled before them.
+    """
+    _env: simpy.Environment
+    _hospital: HospitalState
+    _logger: HospitalLogger
+    _exits: typing.List[list]  # heap of [exit_time, ticket, patient, outcome]; patient is None once cancelled
+    _index: typing.Dict[PatientInfo, list]
+    _reserved: typing.List[typing.Tuple[float, int]]  # heap of (time, ticket) of handlers that have not fired yet
+    _reserved_events: typing.Dict[int, PendingEvent]  # ticket -> what the handler will do, for snapshots
+    _sleeping_until: typing.Optional[float]
+    _interactions: typing.Optional[InteractionTracker]
+    _process_exit: typing.Callable
+
+    def __init__(self, env: simpy.Environment, hospital: HospitalState, logger: HospitalLogger,
+                 interactions: typing.Optional[InteractionTracker] = None,
+                 steps: typing.Optional[FrameworkSteps] = None):
+        """
+        :param steps: the framework steps to call; framework_steps() if not given
+        """
+        if steps is None:
+            steps = framework_steps()
+        self._env = env
+        self._hospital = hospital
+        self._logger = logger
+        self._interactions = interactions
+        self._process_exit = steps.process_exit
+        self._exits = []
+        self._index = {}
+        self._reserved = []
+        self._reserved_events = {}
+        self._tickets = itertools.count()
+        self._sleeping_until = None
+        self._process = steps.start_process(env, self._run())
+
+    def schedule(self, patient: PatientInfo, exit_time: int, outcome: Outcome):
+        entry = [exit_time, next(self._tickets), patient, outcome]
+        heapq.heappush(self._exits, entry)
+        self._index[patient] = entry
+        if self._sleeping_until is not None and exit_time < self._sleeping_until:
+            self._sleeping_until = exit_time
+            self._process.interrupt()
+
+    def cancel(self, patient: PatientInfo) -> typing.Optional[typing.Tuple[int, Outcome]]:
+        """
+        Removes the pending exit of a patient.
+
+        :return: the exit time and outcome that had been scheduled, or None if there was no pending exit
+        """
+        entry = self._index.pop(patient, None)
+        if entry is None:
+            return None
+        exit_time, _, _, outcome = entry
+        entry[2] = None
+        return exit_time, outcome
+
+    def get_exit_time(self, patient: PatientInfo) -> typing.Optional[int]:
+        entry = self._index.get(patient)
+        return None if entry is None else entry[0]
+
+    def num_pending(self) -> int:
+        return len(self._index)
+
+    def num_reserved(self) -> int:
+        """
+        The number of arrival and shift-end handlers waiting to fire.
+        """
+        return len(self._reserved)
+
+    def reserve(self, time: float, event: typing.Optional[PendingEvent] = None) -> int:
+        """
+        Registers a handler that will fire at the given time.
+
+        :param event: what the handler will do; needed to include it in snapshots
+        :return: the ticket to pass to release when it fires
+        """
+        ticket = next(self._tickets)
+        heapq.heappush(self._reserved, (time, ticket))
+        if event is not None:
+            self._reserved_events[ticket] = event
+        return ticket
+
+    def release(self, time: float, ticket: int):
+        """
+        Called when a reserved handler fires; processes the exits that were scheduled to happen before it.
+        """
+        if heapq.heappop(self._reserved) != (time, ticket):
+            raise RuntimeError("Timed handlers fired out of order.")
+        self._reserved_events.pop(ticket, None)
+        self._process_exits((time, ticket))
+
+    def pending(self) -> typing.List[PendingEvent]:
+        """
+        The exits and reserved handlers that have not happened yet, in the order they were scheduled.
+        """
+        events = [(entry[1], PendingExit(exit_time=entry[0], patient=entry[2], outcome=entry[3]))
+                  for entry in self._index.values()]
+        for _, ticket in self._reserved:
+            if ticket not in self._reserved_events:
+                raise RuntimeError("A pending handler was reserved without describing its event.")
+            events.append((ticket, self._reserved_events[ticket]))
+        events.sort(key=lambda e: e[0])
+        return [event for _, event in events]
+
+    def _process_exits(self, before: typing.Tuple[float, float]):
+        while self._exits:
+            entry = self._exits[0]
+            if entry[2] is not None and (entry[0], entry[1]) >= before:
+                return
+            heapq.heappop(self._exits)
+            exit_time, _, patient, outcome = entry
+            if patient is not None:
+                del self._index[patient]
+                self._process_exit(exit_time=exit_time, patient=patient, outcome=outcome, hospital=self._hospital,
+                                   logger=self._logger, interactions=self._interactions)
+
+    def _run(self):
+        while True:
+            while self._exits and self._exits[0][2] is None:
+                heapq.heappop(self._exits)
+            if self._exits:
+                self._sleeping_until = self._exits[0][0]
+                wakeup = self._env.timeout(self._sleeping_until - self._env.now)
+            else:
+                self._sleeping_until = math.inf
+                wakeup = self._env.event()
+            try:
+                yield wakeup
+            except simpy.Interrupt:
+                continue
+            finally:
+                self._sleeping_until = None
+
+            # Exits at this time that were scheduled after a handler that has not fired yet are left for that handler
+            # to release; otherwise the loop sleeps for zero time, which lets such handlers run first.
+            now = self._env.now
+            limit = (now, math.inf)
+            if self._reserved and self._reserved[0] < limit:
+                limit = self._reserved[0]
+            self._process_exits(limit)
+
+
+def discharge_patient_early(time: int, patient: PatientInfo, hospital: T, logger: HospitalLogger,
+                            discharges: DischargeScheduler, interactions: typing.Optional[InteractionTracker] = None):
+    """
+    Discharges an admitted patient before their scheduled exit and cancels the pending exit. The patient keeps the
+    outcome that was drawn on admission.
+    """
+    pending = discharges.cancel(patient)
+    if pending is None:
+        raise RuntimeError("Attempted to discharge early a patient with no pending exit.")
+    _, outcome = pending
+    if outcome == Outcome.LIVES:
+        logger.log_patient_discharge(time=time, patient=patient)
+    logger.log_patient_outcome(time=time, patient=patient, outcome=outcome)
+    hospital.discharge_early(patient)
+    if interactions is not None:
+        interactions.patient_exit(patient, time)
+
+
+def process_arrival(arrival: PatientArrival, hospital: T, policy: HospitalPolicy[T], logger: HospitalLogger,
+                    model: HospitalModel, interactions: typing.Optional[InteractionTracker] = None
+                    ) -> typing.Tuple[typing.Optional[ArrivalAssignment], int, Outcome]:
+    """
+    Applies the policy's admission decision for an arrival and draws the patient's outcome.
+
+    :return: the assignment (None if the patient was declined), the exit time and the outcome. Declined patients exit
+        at their arrival time; for admitted patients the exit still needs to be scheduled by the caller.
+    """
     arrival_assign = policy.arrival_assignment(arrival=arrival, hospital=hospital)
     logger.log_patient_arrived(time=arrival.arrival_time, patient=arrival.patient, status=arrival.status)
     if arrival_assign is None:
-        logger.log_patient_declined(time=arrival.arrival_time, patient=arrival.patient)
-        exit_outcome = model.generate_noicu_outcome(patient=arrival.patient, status=arrival.status)
-        logger.log_patient_outcome(time=arrival.arrival_time, patient=arrival.patient, outcome=exit_outcome)
-
-    else:
-        exit_time = arrival.arrival_time + model.generate_stay_length(patient=arrival.patient, status=arrival.status)
-        exit_outcome = model.generate_icu_outcome(patient=arrival.patient, status=arrival.status)
-        env.process(handle_patient_exit(env=env, exit_time=exit_time, outcome=exit_outcome, patient=arrival.patient,
-                                        hospital=hospital, logger=logger))
-        hospital.add_patient(patient=arrival.patient, status=arrival.status)
-        logger.log_patient_admitted(time=arrival.arrival_time, patient=arrival.patient)
-        if arrival_assign.given_bed:
-            hospital.give_bed(patient=arrival.patient)
-            logger.log_patient_given_bed(time=arrival.arrival_time, patient=arrival.patient)
-
-        if arrival_assign.given_ventilator:
-            hospital.give_ventilator(patient=arrival.patient)
-            logger.log_patient_given_ventilator(time=arrival.arrival_time, patient=arrival.patient)
-
-        if arrival_assign.staff is not None:
-            for staff in arrival_assign.staff:
-                env.process(handle_staff_patient_interaction())
-                logger.log_patient_staff_assignment(time=arrival.arrival_time, patient=arrival.patient, staff=staff)
-
-    env.process(handle_patient_arrival(env=env, arrival=model.generate_next_arrival(), hospital=hospital, policy=policy,
-                                       logger=logger, model=model))
+        return None, arrival.arrival_time, decline_arrival(arrival=arrival, logger=logger, model=model)
+    exit_time, exit_outcome = admit_arrival(arrival=arrival, arrival_assign=arrival_assign, hospital=hospital,
+                                            logger=logger, model=model, interactions=interactions)
+    return arrival_assign, exit_time, exit_outcome
+
+
+def decline_arrival(arrival: PatientArrival, logger: HospitalLogger, model: HospitalModel) -> Outcome:
+    """
+    The declined half of process_arrival, after the arrival has been logged.
+
+    :return: the outcome of the patient, who exits at their arrival time
+    """
+    logger.log_patient_declined(time=arrival.arrival_time, patient=arrival.patient)
+    exit_outcome = model.generate_noicu_outcome(patient=arrival.patient, status=arrival.status)
+    logger.log_patient_outcome(time=arrival.arrival_time, patient=arrival.patient, outcome=exit_outcome)
+    return exit_outcome
+
+
+def admit_arrival(arrival: PatientArrival, arrival_assign: ArrivalAssignment, hospital: T, logger: HospitalLogger,
+                  model: HospitalModel, interactions: typing.Optional[InteractionTracker] = None
+                  ) -> typing.Tuple[int, Outcome]:
+    """
+    The admitted half of process_arrival, after the arrival has been logged.
+
+    :return: the exit time and outcome, for the caller to schedule
+    """
+    exit_time = arrival.arrival_time + model.generate_stay_length(patient=arrival.patient, status=arrival.status)
+    exit_outcome = model.generate_icu_outcome(patient=arrival.patient, status=arrival.status)
+    hospital.add_patient(patient=arrival.patient, status=arrival.status)
+    logger.log_patient_admitted(time=arrival.arrival_time, patient=arrival.patient)
+    if arrival_assign.given_bed:
+        hospital.give_bed(patient=arrival.patient)
+        logger.log_patient_given_bed(time=arrival.arrival_time, patient=arrival.patient)
+
+    if arrival_assign.given_ventilator:
+        hospital.give_ventilator(patient=arrival.patient)
+        logger.log_patient_given_ventilator(time=arrival.arrival_time, patient=arrival.patient)
+
+    if arrival_assign.staff is not None:
+        for staff in arrival_assign.staff:
+            hospital.assign(staff, arrival.patient)
+            logger.log_patient_staff_assignment(time=arrival.arrival_time, patient=arrival.patient, staff=staff)
+            if interactions is not None:
+                interactions.start_contact(staff, arrival.patient, arrival.status, arrival.arrival_time)
+    return exit_time, exit_outcome
+
+
+def handle_patient_arrival(env: simpy.Environment, arrival: PatientArrival, hospital: T,
+                           policy: HospitalPolicy[T], logger: HospitalLogger, model: HospitalModel,
+                           discharges: DischargeScheduler, interactions: typing.Optional[InteractionTracker],
+                           ticket: typing.Optional[int] = None, steps: typing.Optional[FrameworkSteps] = None):
+    if steps is None:
+        steps = framework_steps()
+    current_time = env.now
+    if ticket is None:
+        ticket = discharges.reserve(arrival.arrival_time, PendingArrival(arrival=arrival))
+    yield env.timeout(arrival.arrival_time - current_time)
+    discharges.release(arrival.arrival_time, ticket)
+
+    arrival_assign, exit_time, exit_outcome = steps.process_arrival(arrival=arrival, hospital=hospital, policy=policy,
+                                                                    logger=logger, model=model,
+                                                                    interactions=interactions)
+    if arrival_assign is not None:
+        discharges.schedule(patient=arrival.patient, exit_time=exit_time, outcome=exit_outcome)
+
+    try:
+        next_arrival = model.generate_next_arrival()
+    except StopIteration:
+        return
+    steps.start_process(env, handle_patient_arrival(env=env, arrival=next_arrival, hospital=hospital, policy=policy,
+                                                    logger=logger, model=model, discharges=discharges,
+                                                    interactions=interactions, steps=steps))
     return
 
 
 def apply_reassignment(time: int, orphaned_patients: typing.Set[PatientInfo],
                        staff: StaffInfo, reassignment: EOSReassignment, hospital: T,
-                       logger: HospitalLogger):
+                       logger: HospitalLogger, interactions: typing.Optional[InteractionTracker] = None):
     """
     #TODO: This probably needs refactoring.
     This currently assumes that the reassignment only changes assignments for orphaned patients.
@@ -308,14 +833,19 @@ def apply_reassignment(time: int, orphaned_patients: typing.Set[PatientInfo],
     for new_staff, options in reassignment.added_staff.items():
         hospital.start_shift(new_staff, options)
         logger.log_start_shift(time=time, staff=new_staff, options=options)
+        if interactions is not None:
+            interactions.start_shift(new_staff, options, hospital.get_staff_status(new_staff))
 
-    for patient in orphaned_patients:
+    # In pid order rather than set order, which can differ between copies of the same state.
+    for patient in sorted(orphaned_patients):
         if patient in reassignment.new_assignments and reassignment.new_assignments[patient]:
             new_staff = reassignment.new_assignments[patient]
             if new_staff:
                 for s in new_staff:
                     hospital.assign(s, patient)
                     logger.log_patient_reassignment(time=time, old_staff=staff, new_staff=s, patient=patient)
+                    if interactions is not None:
+                        interactions.start_contact(s, patient, hospital.get_patient_status(patient), time)
         else:
             pass
             #TODO implement this
@@ -324,43 +854,250 @@ def apply_reassignment(time: int, orphaned_patients: typing.Set[PatientInfo],
 
 def handle_eos(env: simpy.Environment, shift_end_time: int, staff: StaffInfo, hospital: T,
                logger: HospitalLogger, policy: HospitalPolicy[T],
-               model: HospitalModel):
+               model: HospitalModel, discharges: DischargeScheduler,
+               interactions: typing.Optional[InteractionTracker], ticket: typing.Optional[int] = None,
+               steps: typing.Optional[FrameworkSteps] = None):
     # TODO: This probably needs refactoring.
+    if steps is None:
+        steps = framework_steps()
     current_time = env.now
+    if ticket is None:
+        ticket = discharges.reserve(shift_end_time, PendingShiftEnd(shift_end_time=shift_end_time, staff=staff))
     yield env.timeout(shift_end_time - current_time)
+    discharges.release(shift_end_time, ticket)
+    if interactions is not None:
+        steps.process_interactions(time=shift_end_time, hospital=hospital, logger=logger, model=model,
+                                   interactions=interactions)
     logger.log_shift_end(end_time=shift_end_time, staff=staff)
     orphaned_patients = hospital.get_patients(staff)
     hospital.end_shift(staff, end_time=shift_end_time)
+    if interactions is not None:
+        interactions.end_shift(staff, shift_end_time)
     reassignment = policy.eos_restaff(shift_end_time, orphaned_patients, hospital)
-    apply_reassignment(time=shift_end_time, orphaned_patients=orphaned_patients, staff=staff,
-                       reassignment=reassignment, hospital=hospital, logger=logger)
+    steps.apply_reassignment(time=shift_end_time, orphaned_patients=orphaned_patients, staff=staff,
+                             reassignment=reassignment, hospital=hospital, logger=logger, interactions=interactions)
 
     for new_staff in reassignment.added_staff:
-        for active_staff in hospital.get_active_staff():
-            if new_staff != active_staff:
-                env.process(handle_staff_staff_interaction())
-        env.process(handle_eos(env=env, shift_end_time=hospital.get_shift_end(new_staff), staff=new_staff,
-                               hospital=hospital, logger=logger, policy=policy, model=model))
+        steps.start_process(env, handle_eos(env=env, shift_end_time=hospital.get_shift_end(new_staff), staff=new_staff,
+                                            hospital=hospital, logger=logger, policy=policy, model=model,
+                                            discharges=discharges, interactions=interactions, steps=steps))
+
+
+class SimulationSnapshot(typing.NamedTuple):
+    """
+    The complete state of an ICUSimulation between two events: copies of the hospital state, the model (including its
+    random state, next_id and last_arrival_time) and the contact tracker, plus the pending exits, arrival and shift
+    ends in the order they were scheduled. The policy is not included, so that a snapshot can be resumed under a
+    different one. Snapshots can be pickled if the model, hospital state and logger can.
+    """
+    time: float
+    hospital_state: HospitalState
+    model: HospitalModel
+    interactions: typing.Optional[InteractionTracker]
+    pending: typing.Tuple[PendingEvent, ...]
+    logger: typing.Optional[HospitalLogger] = None
+
+
+class ICUSimulation:
+    """
+    Runs the same processes as icu_process, but keeps hold of them so that the run can be advanced in steps, saved
+    with snapshot, and continued from a snapshot with resume. Resuming gives exactly the events the original run would
+    have had from that point on (given the same policy and model draws), so what-if branches only need to simulate
+    the part after the snapshot.
+    """
+    env: simpy.Environment
+    hospital_state: HospitalState
+    logger: HospitalLogger
+    policy: HospitalPolicy
+    model: HospitalModel
+    interactions: typing.Optional[InteractionTracker]  # None if the model draws no transmissions
+    discharges: DischargeScheduler
+    steps: FrameworkSteps
+
+    def __init__(self, hospital_state: T, logger: HospitalLogger, policy: HospitalPolicy[T], model: HospitalModel,
+                 env: typing.Optional[simpy.Environment] = None,
+                 interactions: typing.Optional[InteractionTracker] = None, timer: typing.Optional[Timer] = None):
+        """
+        :param env: the simpy environment to run in; a new one starting at time 0 if not given
+        :param interactions: the contact tracker; a new one if not given and the model draws transmissions
+        :param timer: times the framework steps and handlers of the run, see framework_steps
+        """
+        self.env = simpy.Environment() if env is None else env
+        self.hospital_state = hospital_state
+        self.logger = logger
+        self.policy = policy
+        self.model = model
+        if interactions is None and model.models_transmission():
+            interactions = InteractionTracker(self.env.now)
+        self.interactions = interactions
+        self.steps = framework_steps(timer)
+        self.discharges = DischargeScheduler(env=self.env, hospital=hospital_state, logger=logger,
+                                             interactions=self.interactions, steps=self.steps)
+
+    def start(self):
+        """
+        Starts the shifts of the staff already on shift and the arrival process. Call this once on a new simulation,
+        but not on a resumed one.
+        """
+        now = self.env.now
+        for staff in self.hospital_state.get_active_staff():
+            if self.interactions is not None:
+                self.interactions.start_shift(staff, self.hospital_state.get_staff_options(staff),
+                                              self.hospital_state.get_staff_status(staff))
+                for patient in self.hospital_state.patients_view(staff):
+                    self.interactions.start_contact(staff, patient, self.hospital_state.get_patient_status(patient),
+                                                    now)
+            self.spawn_shift_end(self.hospital_state.get_shift_end(staff), staff)
+
+        try:
+            first_arrival = self.model.generate_next_arrival()
+        except StopIteration:
+            return
+        self.spawn_arrival(first_arrival)
+
+    def spawn_arrival(self, arrival: PatientArrival, ticket: typing.Optional[int] = None):
+        self.steps.start_process(self.env, handle_patient_arrival(
+            env=self.env, arrival=arrival, hospital=self.hospital_state, logger=self.logger, policy=self.policy,
+            model=self.model, discharges=self.discharges, interactions=self.interactions, ticket=ticket,
+            steps=self.steps))
+
+    def spawn_shift_end(self, shift_end_time: int, staff: StaffInfo, ticket: typing.Optional[int] = None):
+        self.steps.start_process(self.env, handle_eos(
+            env=self.env, shift_end_time=shift_end_time, staff=staff, hospital=self.hospital_state, logger=self.logger,
+            policy=self.policy, model=self.model, discharges=self.discharges, interactions=self.interactions,
+            ticket=ticket, steps=self.steps))
+
+    def run(self, until: float, on_step: typing.Optional[typing.Callable[[float], None]] = None):
+        """
+        Processes all events before until. This can be called repeatedly with increasing times.
+
+        :param on_step: called with the time of each event before it is processed
+        """
+        if on_step is not None:
+            while self.env.peek() < until:
+                on_step(self.env.peek())
+                self.env.step()
+        self.env.run(until)
+
+    def snapshot(self, include_logger: bool = False) -> SimulationSnapshot:
+        """
+        Copies the state of the run. The run itself is not changed and can be continued.
+
+        :param include_logger: also copy the logger, e.g. a SummaryLogger whose totals should carry over into every
+            continuation. Loggers that write to files cannot be copied.
+        """
+        hospital_state, model, interactions, logger = copy.deepcopy(
+            (self.hospital_state, self.model, self.interactions, self.logger if include_logger else None))
+        return SimulationSnapshot(time=self.env.now, hospital_state=hospital_state, model=model,
+                                  interactions=interactions, pending=tuple(self.discharges.pending()), logger=logger)
+
+    @classmethod
+    def resume(cls, snapshot: SimulationSnapshot, policy: HospitalPolicy,
+               logger: typing.Optional[HospitalLogger] = None, timer: typing.Optional[Timer] = None
+               ) -> 'ICUSimulation':
+        """
+        Creates a simulation that continues from a snapshot. The snapshot is copied, so it can be resumed any number of
+        times.
 
-    for new_staff, patients in reassignment.new_assignments.items():
-        for patient in patients:
-            env.process(handle_staff_patient_interaction())
+        :param policy: the policy for the continuation
+        :param logger: the logger for the continuation; a copy of the snapshot's logger if not given
+        :param timer: as for ICUSimulation
+        """
+        hospital_state, model, interactions, snapshot_logger = copy.deepcopy(
+            (snapshot.hospital_state, snapshot.model, snapshot.interactions, snapshot.logger))
+        if logger is None:
+            if snapshot_logger is None:
+                raise RuntimeError("A logger is required to resume a snapshot taken without one.")
+            logger = snapshot_logger
+        simulation = cls(hospital_state=hospital_state, logger=logger, policy=policy, model=model,
+                         env=simpy.Environment(initial_time=snapshot.time), interactions=interactions, timer=timer)
+        # Rescheduling in the original order gives the same tie-breaking between events at equal times.
+        for event in snapshot.pending:
+            if isinstance(event, PendingExit):
+                simulation.discharges.schedule(patient=event.patient, exit_time=event.exit_time,
+                                               outcome=event.outcome)
+            elif isinstance(event, PendingArrival):
+                ticket = simulation.discharges.reserve(event.arrival.arrival_time, event)
+                simulation.spawn_arrival(event.arrival, ticket=ticket)
+            else:
+                ticket = simulation.discharges.reserve(event.shift_end_time, event)
+                simulation.spawn_shift_end(event.shift_end_time, event.staff, ticket=ticket)
+        return simulation
 
 
 def icu_process(env: simpy.Environment,
                 hospital_state: T,
                 logger: HospitalLogger,
                 policy: HospitalPolicy[T],
-                model: HospitalModel):
-    for staff in hospital_state.get_active_staff():
-        env.process(handle_eos(env=env, shift_end_time=hospital_state.get_shift_end(staff),
-                               staff=staff,
-                               hospital=hospital_state, logger=logger, policy=policy,
-                               model=model))
+                model: HospitalModel,
+                timer: typing.Optional[Timer] = None):
+    ICUSimulation(hospital_state=hospital_state, logger=logger, policy=policy, model=model, env=env,
+                  timer=timer).start()
+    return
+    yield  # makes this a generator, so that it can be passed to env.process
+
+
+def run_loss_system(hospital_state: T,
+                    logger: HospitalLogger,
+                    policy: HospitalPolicy[T],
+                    model: HospitalModel,
+                    until: float,
+                    timer: typing.Optional[Timer] = None):
+    """
+    Runs the same arrival and exit logic as icu_process for an unstaffed ICU, but on a heapq event queue instead of a
+    simpy process per arrival and per exit. Events are processed in the same order as under simpy (by time, then by
+    the order in which they were scheduled), so the model draws and the logger output are identical to
+    env.run(until) on icu_process.
 
+    :param until: events at or after this time are not processed
+    :param timer: times process_arrival and process_exit, see framework_steps
+    """
+    steps = framework_steps(timer)
+    queue = []
+    counter = itertools.count()
     try:
         first_arrival = model.generate_next_arrival()
-        env.process(handle_patient_arrival(env=env, arrival=first_arrival, hospital=hospital_state, logger=logger,
-                                           policy=policy, model=model))
     except StopIteration:
-        yield
+        return
+    # Entries are (time, order scheduled, arrival, exiting patient, outcome); arrival is None for exits.
+    heapq.heappush(queue, (first_arrival.arrival_time, next(counter), first_arrival, None, None))
+
+    while queue and queue[0][0] < until:
+        time, _, arrival, patient, outcome = heapq.heappop(queue)
+        if arrival is None:
+            steps.process_exit(exit_time=time, patient=patient, outcome=outcome, hospital=hospital_state,
+                               logger=logger)
+            continue
+
+        arrival_assign, exit_time, exit_outcome = steps.process_arrival(arrival=arrival, hospital=hospital_state,
+                                                                        policy=policy, logger=logger, model=model)
+        if arrival_assign is not None:
+            heapq.heappush(queue, (exit_time, next(counter), None, arrival.patient, exit_outcome))
+        try:
+            next_arrival = model.generate_next_arrival()
+        except StopIteration:
+            continue
+        heapq.heappush(queue, (next_arrival.arrival_time, next(counter), next_arrival, None, None))
+
+
+def run_icu(hospital_state: T,
+            logger: HospitalLogger,
+            policy: HospitalPolicy[T],
+            model: HospitalModel,
+            until: float,
+            timer: typing.Optional[Timer] = None):
+    """
+    Runs the ICU until the given time. If the policy declares loss_system_compatible and no staff are on shift, this
+    uses run_loss_system; otherwise it runs icu_process on a new simpy Environment. Both give the same logger output.
+
+    :param timer: times the framework steps of the run, see framework_steps
+    """
+    if getattr(policy, 'loss_system_compatible', False) and not hospital_state.active_staff_view():
+        run_loss_system(hospital_state=hospital_state, logger=logger, policy=policy, model=model, until=until,
+                        timer=timer)
+        return
+
+    env = simpy.Environment()
+    env.process(icu_process(env=env, hospital_state=hospital_state, logger=logger, policy=policy, model=model,
+                            timer=timer))
+    env.run(until)
@@ -1,10 +1,16 @@
+import collections.abc
 import enum
+import functools
+import heapq
+import itertools
+import math
+import operator
 import typing
 import csv
 import warnings
 import numpy
-import scipy.stats
 from . import framework
+from . import sampling
 from .framework import PatientInfo
 
 
@@ -36,6 +42,10 @@ class EventType(enum.Enum):
     S_END = "ShiftEnd"
     S_START = "ShiftStart"
     INVALID = "INVALID"
+    # Added after INVALID so that the EVENT_TYPE_CODES of the other event types stay the same.
+    P_INFECTED = "PatientInfected"
+    S_INFECTED = "StaffInfected"
+    P_TRANSFER = "PatientTransfer"
 
 
 EVENT_CSV_FIELDS = ['event_id', 'time', 'event_type', 'patient', 'staff']
@@ -111,12 +121,425 @@ class CSVLogger(framework.HospitalLogger):
     def log_patient_declined(self, time: int, patient: framework.PatientInfo):
         self.log_event(time=time, event_type=EventType.P_DECLINED, patient=patient, staff=None)
 
+    def log_patient_infected(self, time: int, patient: framework.PatientInfo):
+        self.log_event(time=time, event_type=EventType.P_INFECTED, patient=patient, staff=None)
+
+    def log_staff_infected(self, time: int, staff: framework.StaffInfo):
+        self.log_event(time=time, event_type=EventType.S_INFECTED, patient=None, staff=staff)
+
+    def log_patient_transferred(self, time: int, patient: framework.PatientInfo, site: int):
+        self.log_event(time=time, event_type=EventType.P_TRANSFER, patient=patient, staff=None)
+
     def log_patient_arrived(self, time: int, patient: framework.PatientInfo, status: framework.PatientStatus):
         if self.patient_writer is not None:
             row = {'patient_id': patient.pid, 'arrival_time': time, 'severity': status.covid_severity.name}
             self.patient_writer.writerow(rowdict=row)
 
 
+EVENT_TYPE_CODES = {event_type: code for code, event_type in enumerate(EventType)}
+SEVERITY_CODES = {severity: code for code, severity in enumerate(framework.InfectionSeverity)}
+EVENT_COLUMN_TYPES = [('event_id', numpy.int64), ('time', numpy.int32), ('event_type', numpy.int8),
+                      ('patient', numpy.int64), ('staff', numpy.int32)]
+PATIENT_COLUMN_TYPES = [('patient_id', numpy.int64), ('severity', numpy.int8), ('arrival_time', numpy.int32)]
+
+
+class _ColumnBuffer:
+    """
+    Preallocated typed columns that are written to a binary file as consecutive .npy arrays (one per column) whenever
+    they fill up.
+    """
+    def __init__(self, out_file, column_types: typing.List[typing.Tuple[str, type]], chunk_size: int):
+        self.out_file = out_file
+        self.columns = [numpy.empty(chunk_size, dtype=dtype) for _, dtype in column_types]
+        self.size = 0
+
+    def flush(self):
+        if self.size > 0:
+            for column in self.columns:
+                numpy.save(self.out_file, column[:self.size], allow_pickle=False)
+            self.size = 0
+        self.out_file.flush()
+
+
+class ColumnarLogger(framework.HospitalLogger):
+    """
+    Logs the same events as CSVLogger into preallocated typed numpy columns. Event types and severities are stored as
+    integer codes (EVENT_TYPE_CODES, SEVERITY_CODES) and missing patient or staff ids as -1. Patient ids are stored
+    in 64 bits; times and staff ids must be integers that fit in 32 bits.
+    Full chunks are appended to binary files as consecutive .npy arrays; call flush() after the run to write the last
+    partial chunk. columnar_to_csv reproduces the CSVLogger files exactly.
+    """
+    next_event_id: int
+    _events: _ColumnBuffer
+    _patients: typing.Optional[_ColumnBuffer]
+
+    def __init__(self, event_file, patient_file=None, chunk_size: int = 65536):
+        """
+        :param event_file: binary file the event columns are written to
+        :param patient_file: binary file the patient columns are written to, if any
+        :param chunk_size: number of rows buffered before writing
+        """
+        self.next_event_id = 0
+        self._events = _ColumnBuffer(event_file, EVENT_COLUMN_TYPES, chunk_size)
+        if patient_file is not None:
+            self._patients = _ColumnBuffer(patient_file, PATIENT_COLUMN_TYPES, chunk_size)
+        else:
+            self._patients = None
+
+    def flush(self):
+        self._events.flush()
+        if self._patients is not None:
+            self._patients.flush()
+
+    def log_event(self, time: int, event_type: EventType, patient: typing.Optional[framework.PatientInfo],
+                  staff: typing.Optional[framework.StaffInfo]):
+        events = self._events
+        row = events.size
+        event_ids, times, event_types, patients, staffs = events.columns
+        event_ids[row] = self.next_event_id
+        times[row] = time
+        event_types[row] = EVENT_TYPE_CODES[event_type]
+        patients[row] = -1 if patient is None else patient.pid
+        staffs[row] = -1 if staff is None else staff.sid
+        self.next_event_id += 1
+        events.size += 1
+        if events.size == len(event_ids):
+            events.flush()
+
+    def log_patient_admitted(self, time: int, patient: framework.PatientInfo):
+        self.log_event(time=time, patient=patient, event_type=EventType.P_ADMIT, staff=None)
+
+    def log_patient_staff_assignment(self, time: int, patient: framework.PatientInfo, staff: framework.StaffInfo):
+        self.log_event(time=time, event_type=EventType.P_ASSIGN, patient=patient, staff=staff)
+
+    def log_patient_reassignment(self, time: int, old_staff: framework.StaffInfo, new_staff: framework.StaffInfo,
+                                 patient: framework.PatientInfo):
+        self.log_event(time=time, event_type=EventType.P_REASSIGN, patient=patient, staff=new_staff)
+
+    def log_patient_outcome(self, time: int, patient: framework.PatientInfo, outcome: framework.Outcome):
+        if outcome == framework.Outcome.DIES:
+            event = EventType.P_DEATH
+        elif outcome == framework.Outcome.LIVES:
+            event = EventType.P_LIVE
+        else:
+            event = EventType.INVALID
+            warnings.warn("Invalid event occurred: patient neither died nor lived")
+        self.log_event(time=time, event_type=event, patient=patient, staff=None)
+
+    def log_shift_end(self, end_time: int, staff: framework.StaffInfo):
+        self.log_event(time=end_time, event_type=EventType.S_END, patient=None, staff=staff)
+
+    def log_start_shift(self, time: int, staff: framework.StaffInfo, options: framework.StaffOptions):
+        self.log_event(time=time, event_type=EventType.S_START, patient=None, staff=staff)
+
+    def log_patient_discharge(self, time: int, patient: framework.PatientInfo):
+        self.log_event(time=time, event_type=EventType.P_DISCHARGE, patient=patient, staff=None)
+
+    def log_patient_given_bed(self, time: int, patient: framework.PatientInfo):
+        self.log_event(time=time, event_type=EventType.P_BED, patient=patient, staff=None)
+
+    def log_patient_given_ventilator(self, time: int, patient: framework.PatientInfo):
+        self.log_event(time=time, event_type=EventType.P_VENT, patient=patient, staff=None)
+
+    def log_patient_declined(self, time: int, patient: framework.PatientInfo):
+        self.log_event(time=time, event_type=EventType.P_DECLINED, patient=patient, staff=None)
+
+    def log_patient_infected(self, time: int, patient: framework.PatientInfo):
+        self.log_event(time=time, event_type=EventType.P_INFECTED, patient=patient, staff=None)
+
+    def log_staff_infected(self, time: int, staff: framework.StaffInfo):
+        self.log_event(time=time, event_type=EventType.S_INFECTED, patient=None, staff=staff)
+
+    def log_patient_transferred(self, time: int, patient: framework.PatientInfo, site: int):
+        self.log_event(time=time, event_type=EventType.P_TRANSFER, patient=patient, staff=None)
+
+    def log_patient_arrived(self, time: int, patient: framework.PatientInfo, status: framework.PatientStatus):
+        if self._patients is not None:
+            patients = self._patients
+            row = patients.size
+            patient_ids, severities, arrival_times = patients.columns
+            patient_ids[row] = patient.pid
+            severities[row] = SEVERITY_CODES.get(status.covid_severity, -1)
+            arrival_times[row] = time
+            patients.size += 1
+            if patients.size == len(patient_ids):
+                patients.flush()
+
+
+def read_columns(in_file, column_types: typing.List[typing.Tuple[str, type]]) -> typing.Dict[str, numpy.ndarray]:
+    """
+    Reads the chunks written by ColumnarLogger into one array per column.
+
+    :param in_file: binary file opened for reading
+    :param column_types: EVENT_COLUMN_TYPES or PATIENT_COLUMN_TYPES
+    """
+    chunks = {name: [] for name, _ in column_types}
+    start = in_file.tell()
+    end = in_file.seek(0, 2)
+    in_file.seek(start)
+    while in_file.tell() < end:
+        for name, _ in column_types:
+            chunks[name].append(numpy.load(in_file, allow_pickle=False))
+    return {name: (numpy.concatenate(parts) if parts else numpy.empty(0, dtype=dtype))
+            for (name, dtype), parts in zip(column_types, chunks.values())}
+
+
+def columnar_to_csv(event_in, event_out, patient_in=None, patient_out=None):
+    """
+    Converts ColumnarLogger output into the csv files CSVLogger would have written for the same run.
+
+    :param event_in: binary file with the event columns
+    :param event_out: text file the event csv is written to
+    :param patient_in: binary file with the patient columns, if any
+    :param patient_out: text file the patient csv is written to, if any
+    """
+    event_names = [event_type.value for event_type in EventType]
+    events = read_columns(event_in, EVENT_COLUMN_TYPES)
+    writer = csv.writer(event_out, lineterminator='\n')
+    writer.writerow(EVENT_CSV_FIELDS)
+    writer.writerows(zip(events['event_id'].tolist(), events['time'].tolist(),
+                         [event_names[code] for code in events['event_type'].tolist()],
+                         ['' if p < 0 else p for p in events['patient'].tolist()],
+                         ['' if s < 0 else s for s in events['staff'].tolist()]))
+
+    if patient_in is not None and patient_out is not None:
+        severity_names = [severity.name for severity in framework.InfectionSeverity]
+        patients = read_columns(patient_in, PATIENT_COLUMN_TYPES)
+        writer = csv.writer(patient_out, lineterminator='\n')
+        writer.writerow(PATIENT_CSV_FIELDS)
+        writer.writerows(zip(patients['patient_id'].tolist(),
+                             ['' if code < 0 else severity_names[code] for code in patients['severity'].tolist()],
+                             patients['arrival_time'].tolist()))
+
+
+class SummaryLogger(framework.HospitalLogger):
+    """
+    Keeps only run totals and peak census instead of an event log. Memory use is proportional to the number of
+    patients currently in the hospital.
+    """
+    arrivals: int
+    admissions: int
+    declines: int
+    deaths: int
+    discharges: int
+    transfers: int  # patients who arrived here and were sent to another site of a network
+    beds_used: int
+    ventilators_used: int
+    peak_beds: int
+    peak_ventilators: int
+    _admitted: typing.Dict[int, typing.List[bool]]  # pid -> [has bed, has ventilator]
+
+    def __init__(self):
+        self.arrivals = 0
+        self.admissions = 0
+        self.declines = 0
+        self.deaths = 0
+        self.discharges = 0
+        self.transfers = 0
+        self.beds_used = 0
+        self.ventilators_used = 0
+        self.peak_beds = 0
+        self.peak_ventilators = 0
+        self._admitted = {}
+
+    def log_patient_arrived(self, time: int, patient: framework.PatientInfo, status: framework.PatientStatus):
+        self.arrivals += 1
+
+    def log_patient_admitted(self, time: int, patient: framework.PatientInfo):
+        self.admissions += 1
+        self._admitted[patient.pid] = [False, False]
+
+    def log_patient_declined(self, time: int, patient: framework.PatientInfo):
+        self.declines += 1
+
+    def log_patient_given_bed(self, time: int, patient: framework.PatientInfo):
+        self._admitted[patient.pid][0] = True
+        self.beds_used += 1
+        if self.beds_used > self.peak_beds:
+            self.peak_beds = self.beds_used
+
+    def log_patient_given_ventilator(self, time: int, patient: framework.PatientInfo):
+        self._admitted[patient.pid][1] = True
+        self.ventilators_used += 1
+        if self.ventilators_used > self.peak_ventilators:
+            self.peak_ventilators = self.ventilators_used
+
+    def log_patient_discharge(self, time: int, patient: framework.PatientInfo):
+        self.discharges += 1
+
+    def log_patient_transferred(self, time: int, patient: framework.PatientInfo, site: int):
+        self.transfers += 1
+
+    def log_patient_outcome(self, time: int, patient: framework.PatientInfo, outcome: framework.Outcome):
+        if outcome == framework.Outcome.DIES:
+            self.deaths += 1
+        resources = self._admitted.pop(patient.pid, None)
+        if resources is not None:
+            has_bed, has_ventilator = resources
+            if has_bed:
+                self.beds_used -= 1
+            if has_ventilator:
+                self.ventilators_used -= 1
+
+
+class DailyMetricsLogger(SummaryLogger):
+    """
+    Extends SummaryLogger with per-day series held in fixed-size arrays: arrivals, admissions, declines, deaths,
+    discharges, peak bed and ventilator census, and the time integral of bed and ventilator census over each day
+    (divide by day_length for the mean census). The integrals are updated as events arrive, so memory use is
+    proportional to the number of days plus the current census rather than the number of events. Events after the last
+    day only update the run totals. Call advance_to(end of run) before reading the last day's integrals.
+    """
+    day_length: float
+    start_time: float
+    daily_arrivals: numpy.ndarray
+    daily_admissions: numpy.ndarray
+    daily_declines: numpy.ndarray
+    daily_deaths: numpy.ndarray
+    daily_discharges: numpy.ndarray
+    daily_peak_beds: numpy.ndarray
+    daily_peak_ventilators: numpy.ndarray
+    daily_bed_time: numpy.ndarray
+    daily_ventilator_time: numpy.ndarray
+    bed_time: float
+    ventilator_time: float
+    _last_time: float
+
+    def __init__(self, num_days: int, day_length: float = 1.0, start_time: float = 0.0):
+        """
+        :param num_days: number of days tracked
+        :param day_length: length of a day in simulation time units (e.g. minutes per day)
+        :param start_time: simulation time at which the first day begins
+        """
+        super().__init__()
+        self.day_length = day_length
+        self.start_time = start_time
+        self.daily_arrivals = numpy.zeros(num_days, dtype=numpy.int64)
+        self.daily_admissions = numpy.zeros(num_days, dtype=numpy.int64)
+        self.daily_declines = numpy.zeros(num_days, dtype=numpy.int64)
+        self.daily_deaths = numpy.zeros(num_days, dtype=numpy.int64)
+        self.daily_discharges = numpy.zeros(num_days, dtype=numpy.int64)
+        self.daily_peak_beds = numpy.zeros(num_days, dtype=numpy.int64)
+        self.daily_peak_ventilators = numpy.zeros(num_days, dtype=numpy.int64)
+        self.daily_bed_time = numpy.zeros(num_days, dtype=float)
+        self.daily_ventilator_time = numpy.zeros(num_days, dtype=float)
+        self.bed_time = 0.0
+        self.ventilator_time = 0.0
+        self._last_time = start_time
+
+    def _day(self, time: float) -> typing.Optional[int]:
+        day = int((time - self.start_time) // self.day_length)
+        if 0 <= day < len(self.daily_arrivals):
+            return day
+        return None
+
+    def advance_to(self, time: float):
+        """
+        Accumulates the occupancy integrals up to the given time, during which the census is unchanged.
+        """
+        if time <= self._last_time:
+            return
+        self.bed_time += self.beds_used * (time - self._last_time)
+        self.ventilator_time += self.ventilators_used * (time - self._last_time)
+
+        end = min(time, self.start_time + self.day_length * len(self.daily_arrivals))
+        current = self._last_time
+        while current < end:
+            day = int((current - self.start_time) // self.day_length)
+            next_day_start = self.start_time + (day + 1) * self.day_length
+            step_end = min(next_day_start, end)
+            self.daily_bed_time[day] += self.beds_used * (step_end - current)
+            self.daily_ventilator_time[day] += self.ventilators_used * (step_end - current)
+            if step_end == next_day_start and day + 1 < len(self.daily_arrivals):
+                # The census carried into a day counts toward that day's peak.
+                self.daily_peak_beds[day + 1] = max(self.daily_peak_beds[day + 1], self.beds_used)
+                self.daily_peak_ventilators[day + 1] = max(self.daily_peak_ventilators[day + 1],
+                                                           self.ventilators_used)
+            current = step_end
+        self._last_time = time
+
+    def daily_mean_beds(self) -> numpy.ndarray:
+        return self.daily_bed_time / self.day_length
+
+    def daily_mean_ventilators(self) -> numpy.ndarray:
+        return self.daily_ventilator_time / self.day_length
+
+    def log_patient_arrived(self, time: int, patient: framework.PatientInfo, status: framework.PatientStatus):
+        super().log_patient_arrived(time=time, patient=patient, status=status)
+        day = self._day(time)
+        if day is not None:
+            self.daily_arrivals[day] += 1
+
+    def log_patient_admitted(self, time: int, patient: framework.PatientInfo):
+        super().log_patient_admitted(time=time, patient=patient)
+        day = self._day(time)
+        if day is not None:
+            self.daily_admissions[day] += 1
+
+    def log_patient_declined(self, time: int, patient: framework.PatientInfo):
+        super().log_patient_declined(time=time, patient=patient)
+        day = self._day(time)
+        if day is not None:
+            self.daily_declines[day] += 1
+
+    def log_patient_given_bed(self, time: int, patient: framework.PatientInfo):
+        self.advance_to(time)
+        super().log_patient_given_bed(time=time, patient=patient)
+        day = self._day(time)
+        if day is not None and self.beds_used > self.daily_peak_beds[day]:
+            self.daily_peak_beds[day] = self.beds_used
+
+    def log_patient_given_ventilator(self, time: int, patient: framework.PatientInfo):
+        self.advance_to(time)
+        super().log_patient_given_ventilator(time=time, patient=patient)
+        day = self._day(time)
+        if day is not None and self.ventilators_used > self.daily_peak_ventilators[day]:
+            self.daily_peak_ventilators[day] = self.ventilators_used
+
+    def log_patient_discharge(self, time: int, patient: framework.PatientInfo):
+        super().log_patient_discharge(time=time, patient=patient)
+        day = self._day(time)
+        if day is not None:
+            self.daily_discharges[day] += 1
+
+    def log_patient_outcome(self, time: int, patient: framework.PatientInfo, outcome: framework.Outcome):
+        self.advance_to(time)
+        super().log_patient_outcome(time=time, patient=patient, outcome=outcome)
+        day = self._day(time)
+        if day is not None and outcome == framework.Outcome.DIES:
+            self.daily_deaths[day] += 1
+
+
+class SetView(collections.abc.Set):
+    """
+    A read-only view of a set, so callers can query it without copying. Set operations such as & and | return new
+    ordinary sets.
+    """
+    __slots__ = ('_items',)
+
+    def __init__(self, items: typing.AbstractSet):
+        self._items = items
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return set(iterable)
+
+    def __contains__(self, item) -> bool:
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __repr__(self) -> str:
+        return 'SetView({!r})'.format(self._items)
+
+
+_EMPTY_VIEW = frozenset()
+
+
 class HospitalStateImpl(framework.HospitalState):
 
 
@@ -134,6 +557,14 @@ class HospitalStateImpl(framework.HospitalState):
     _staff_assignments: typing.Optional[typing.Dict[framework.StaffInfo, typing.Set[framework.PatientInfo]]]
     _patient_assignments: typing.Optional[typing.Dict[framework.PatientInfo, typing.Set[framework.StaffInfo]]]
 
+    # Indexes for least_busy and most_rested. Each staff member gets a new sequence number when they start or end a
+    # shift, which breaks ties in the same order as iterating over _active_staff/_inactive_staff. Heap entries are
+    # (key, sequence number, staff) and are lazily discarded once they no longer match the staff member's state.
+    _active_seq: typing.Dict[framework.StaffInfo, int]
+    _inactive_seq: typing.Dict[framework.StaffInfo, int]
+    _least_busy_heap: typing.List[typing.Tuple[int, int, framework.StaffInfo]]
+    _most_rested_heap: typing.List[typing.Tuple[int, int, framework.StaffInfo]]
+
     def __init__(self,
                  existing_patients: typing.Dict[framework.PatientInfo, framework.PatientStatus],
                  ppe_level: typing.Optional[PPEStock] = None,
@@ -159,13 +590,45 @@ class HospitalStateImpl(framework.HospitalState):
             self._patient_assignments: typing.Dict[framework.PatientInfo, typing.Set[framework.StaffInfo]] = {}
             for staff, patients in self._staff_assignments.items():
                 for p in patients:
-                    if patients not in self._patient_assignments:
+                    if p not in self._patient_assignments:
                         self._patient_assignments[p] = set()
                     self._patient_assignments[p].add(staff)
         else:
             self._patient_assignments = None
+
+        self._staff_seq = itertools.count()
+        self._active_seq = {}
+        self._inactive_seq = {}
+        self._least_busy_heap = []
+        self._most_rested_heap = []
+        if active_staff is not None:
+            for staff in active_staff:
+                self._active_seq[staff] = next(self._staff_seq)
+                self._push_least_busy(staff)
+        if inactive_staff is not None:
+            for staff in inactive_staff:
+                self._inactive_seq[staff] = next(self._staff_seq)
+                self._push_most_rested(staff)
         return
 
+    def _push_least_busy(self, staff: framework.StaffInfo):
+        heap = self._least_busy_heap
+        if len(heap) > 4 * len(self._active_seq) + 64:
+            heap[:] = [entry for entry in heap if self._is_current_least_busy(entry)]
+            heapq.heapify(heap)
+        heapq.heappush(heap, (self.num_patients(staff), self._active_seq[staff], staff))
+
+    def _is_current_least_busy(self, entry: typing.Tuple[int, int, framework.StaffInfo]) -> bool:
+        count, seq, staff = entry
+        return self._active_seq.get(staff) == seq and self.num_patients(staff) == count
+
+    def _push_most_rested(self, staff: framework.StaffInfo):
+        heap = self._most_rested_heap
+        if len(heap) > 4 * len(self._inactive_seq) + 64:
+            heap[:] = [entry for entry in heap if self._inactive_seq.get(entry[2]) == entry[1]]
+            heapq.heapify(heap)
+        heapq.heappush(heap, (self.get_last_shift_end(staff), self._inactive_seq[staff], staff))
+
     def get_ppe_level(self) -> typing.Optional[PPEStock]:
         return self._ppe_level
 
@@ -179,6 +642,16 @@ class HospitalStateImpl(framework.HospitalState):
             return set()
         return set(self._active_staff.keys())
 
+    def inactive_staff_view(self) -> typing.AbstractSet[framework.StaffInfo]:
+        if self._inactive_staff is None:
+            return _EMPTY_VIEW
+        return self._inactive_staff.keys()
+
+    def active_staff_view(self) -> typing.AbstractSet[framework.StaffInfo]:
+        if self._active_staff is None:
+            return _EMPTY_VIEW
+        return self._active_staff.keys()
+
     def get_shift_end(self, staff: framework.StaffInfo) -> int:
         if self._active_staff is not None and staff in self._active_staff:
             return self._active_staff_options[staff].shift_end
@@ -205,6 +678,10 @@ class HospitalStateImpl(framework.HospitalState):
         else:
             raise RuntimeError("Attempted to discharge a patient that is not in the hospital.")
 
+    def discharge_early(self, patient: framework.PatientInfo):
+        self.discharge_patient(patient)
+        self._prev_patients.add(patient)
+
     def get_patients(self, staff: framework.StaffInfo):
         if self._staff_assignments is None or staff not in self._staff_assignments:
             return set()
@@ -215,6 +692,17 @@ class HospitalStateImpl(framework.HospitalState):
             return set()
         return set(self._patient_assignments[patient])
 
+    def patients_view(self, staff: framework.StaffInfo) -> typing.AbstractSet[framework.PatientInfo]:
+        if self._staff_assignments is None:
+            return _EMPTY_VIEW
+        # The set is created if needed, so that the view also shows patients assigned later.
+        return SetView(self._staff_assignments.setdefault(staff, set()))
+
+    def staff_view(self, patient: framework.PatientInfo) -> typing.AbstractSet[framework.StaffInfo]:
+        if self._patient_assignments is None or patient not in self._patients:
+            return _EMPTY_VIEW
+        return SetView(self._patient_assignments.setdefault(patient, set()))
+
     def unassign(self, staff: framework.StaffInfo, patient: framework.PatientInfo):
         try:
             self._staff_assignments[staff].remove(patient)
@@ -224,6 +712,8 @@ class HospitalStateImpl(framework.HospitalState):
             self._patient_assignments[patient].remove(staff)
         except KeyError:
             raise RuntimeError("Failed unassign: patient isn't assigned to staff.")
+        if staff in self._active_seq:
+            self._push_least_busy(staff)
         return
 
     def end_shift(self, staff: framework.StaffInfo, end_time: int):
@@ -232,6 +722,9 @@ class HospitalStateImpl(framework.HospitalState):
                 self.unassign(staff, patient)
         self._inactive_staff[staff] = self._active_staff[staff].set_last_shift_end(end_time)
         del self._active_staff[staff]
+        del self._active_seq[staff]
+        self._inactive_seq[staff] = next(self._staff_seq)
+        self._push_most_rested(staff)
 
     def assign(self, staff: framework.StaffInfo, patient: framework.PatientInfo):
         if staff not in self._staff_assignments:
@@ -242,6 +735,8 @@ class HospitalStateImpl(framework.HospitalState):
 
         self._staff_assignments[staff].add(patient)
         self._patient_assignments[patient].add(staff)
+        if staff in self._active_seq:
+            self._push_least_busy(staff)
         return
 
     def start_shift(self, staff: framework.StaffInfo, options: framework.StaffOptions):
@@ -249,23 +744,70 @@ class HospitalStateImpl(framework.HospitalState):
         del self._inactive_staff[staff]
         self._ppe_level.consume(options.ppe)
         self._active_staff_options[staff] = options
+        del self._inactive_seq[staff]
+        self._active_seq[staff] = next(self._staff_seq)
+        self._push_least_busy(staff)
 
     def num_patients(self, staff: framework.StaffInfo):
+        if self._staff_assignments is None or staff not in self._staff_assignments:
+            return 0
         return len(self._staff_assignments[staff])
 
     def least_busy(self) -> typing.Optional[framework.StaffInfo]:
-        if self._active_staff:
-            return min(self._active_staff, key=self.num_patients)
+        """
+        The active staff member with the fewest patients (earliest to come on shift among ties), in O(log n).
+        """
+        heap = self._least_busy_heap
+        while heap:
+            if self._is_current_least_busy(heap[0]):
+                return heap[0][2]
+            heapq.heappop(heap)
         return None
 
     def most_rested(self):
-        if self._inactive_staff:
-            return min(self._inactive_staff, key=self.get_last_shift_end)
+        """
+        The inactive staff member whose last shift ended earliest (earliest to go off shift among ties), in O(log n).
+        """
+        heap = self._most_rested_heap
+        while heap:
+            _, seq, staff = heap[0]
+            if self._inactive_seq.get(staff) == seq:
+                return staff
+            heapq.heappop(heap)
         return None
 
     def add_patient(self, patient: framework.PatientInfo, status: framework.PatientStatus):
         self._patients[patient] = status
 
+    def get_patient_status(self, patient: framework.PatientInfo) -> framework.PatientStatus:
+        if patient not in self._patients:
+            raise RuntimeError("Attempted to get the status of a patient that is not in the hospital.")
+        return self._patients[patient]
+
+    def get_staff_status(self, staff: framework.StaffInfo) -> framework.StaffStatus:
+        if self._active_staff is not None and staff in self._active_staff:
+            return self._active_staff[staff]
+        if self._inactive_staff is not None and staff in self._inactive_staff:
+            return self._inactive_staff[staff]
+        raise RuntimeError("Attempted to get the status of an unknown staff member.")
+
+    def get_staff_options(self, staff: framework.StaffInfo) -> framework.StaffOptions:
+        if self._active_staff is not None and staff in self._active_staff:
+            return self._active_staff_options[staff]
+        raise RuntimeError("Attempted to get the options of a staff member not currently working.")
+
+    def infect_patient(self, patient: framework.PatientInfo):
+        # Patients infected just before they exited are only logged.
+        if patient in self._patients:
+            self._patients[patient] = self._patients[patient]._replace(covid_status=framework.InfectionStatus.INFECTED)
+
+    def infect_staff(self, staff: framework.StaffInfo):
+        for staff_statuses in (self._active_staff, self._inactive_staff):
+            if staff_statuses is not None and staff in staff_statuses:
+                staff_statuses[staff] = staff_statuses[staff]._replace(covid_status=framework.InfectionStatus.INFECTED)
+                return
+        raise RuntimeError("Attempted to infect an unknown staff member.")
+
     def give_bed(self, patient):
         self._bedusers.add(patient)
 
@@ -296,6 +838,180 @@ class HospitalStateImpl(framework.HospitalState):
         return len(self._bedusers)
 
 
+class ArrayHospitalState(framework.HospitalState):
+    """
+    A compact HospitalState for large unstaffed runs (e.g. FirstComeFirstServedPolicy). Patients are stored in growable
+    byte arrays indexed by pid rather than in dicts and sets: one byte of flags (admitted, bed, ventilator, exited) and
+    one byte of severity code per patient, with the admitted, bed and ventilator counts kept as running totals. Pids
+    are expected to be dense nonnegative integers, as produced by HospitalModelImpl. Exit times are kept by the
+    framework's DischargeScheduler, so they are not stored here. Staff are not modelled.
+    """
+    ADMITTED = 1
+    BED = 2
+    VENTILATOR = 4
+    EXITED = 8
+
+    # bytearray rather than numpy arrays: single-element reads and writes on numpy arrays are several times slower,
+    # and these are touched on every arrival and exit. flag_array/severity_array give numpy copies for analysis.
+    _flags: bytearray
+    _severity: bytearray  # SEVERITY_CODES + 1, so that 0 means unknown
+    _num_admitted: int
+    _num_beds: int
+    _num_vented: int
+
+    def __init__(self, existing_patients: typing.Optional[typing.Dict[framework.PatientInfo,
+                                                                       framework.PatientStatus]] = None,
+                 bedusers: typing.Optional[typing.Set[framework.PatientInfo]] = None,
+                 ventusers: typing.Optional[typing.Set[framework.PatientInfo]] = None,
+                 initial_capacity: int = 1024):
+        self._flags = bytearray(initial_capacity)
+        self._severity = bytearray(initial_capacity)
+        self._num_admitted = 0
+        self._num_beds = 0
+        self._num_vented = 0
+        if existing_patients is not None:
+            for patient, status in existing_patients.items():
+                self.add_patient(patient, status)
+        if bedusers is not None:
+            for patient in bedusers:
+                self.give_bed(patient)
+        if ventusers is not None:
+            for patient in ventusers:
+                self.give_ventilator(patient)
+
+    def _ensure_capacity(self, pid: int):
+        if pid < 0:
+            raise RuntimeError("ArrayHospitalState requires nonnegative patient ids.")
+        if pid >= len(self._flags):
+            extra = max(len(self._flags), pid + 1 - len(self._flags))
+            self._flags.extend(bytes(extra))
+            self._severity.extend(bytes(extra))
+
+    def _get_flags(self, patient: framework.PatientInfo) -> int:
+        pid = patient.pid
+        if 0 <= pid < len(self._flags):
+            return self._flags[pid]
+        return 0
+
+    def add_patient(self, patient: framework.PatientInfo, status: framework.PatientStatus):
+        pid = patient.pid
+        self._ensure_capacity(pid)
+        if not self._flags[pid] & self.ADMITTED:
+            self._flags[pid] |= self.ADMITTED
+            self._num_admitted += 1
+        self._severity[pid] = SEVERITY_CODES.get(status.covid_severity, -1) + 1
+
+    def discharge_patient(self, patient: framework.PatientInfo):
+        if not self._get_flags(patient) & self.ADMITTED:
+            raise RuntimeError("Attempted to discharge a patient that is not in the hospital.")
+        self.free_bed(patient)
+        self.take_off_ventilator(patient)
+        self._flags[patient.pid] &= ~self.ADMITTED
+        self._num_admitted -= 1
+
+    def discharge_early(self, patient: framework.PatientInfo):
+        self.discharge_patient(patient)
+        self._flags[patient.pid] |= self.EXITED
+
+    def has_exited(self, patient: framework.PatientInfo) -> bool:
+        return bool(self._get_flags(patient) & self.EXITED)
+
+    def is_admitted(self, patient: framework.PatientInfo) -> bool:
+        return bool(self._get_flags(patient) & self.ADMITTED)
+
+    def get_severity(self, patient: framework.PatientInfo) -> typing.Optional[framework.InfectionSeverity]:
+        code = self._severity[patient.pid] if 0 <= patient.pid < len(self._severity) else 0
+        if code == 0:
+            return None
+        return list(framework.InfectionSeverity)[code - 1]
+
+    def flag_array(self) -> numpy.ndarray:
+        """
+        A copy of the per-pid flags as a uint8 array; test bits with ADMITTED, BED, VENTILATOR and EXITED.
+        """
+        return numpy.frombuffer(bytes(self._flags), dtype=numpy.uint8)
+
+    def severity_array(self) -> numpy.ndarray:
+        """
+        A copy of the per-pid severity codes (see SEVERITY_CODES) as an int8 array, with -1 where unknown.
+        """
+        return numpy.frombuffer(bytes(self._severity), dtype=numpy.uint8).astype(numpy.int8) - 1
+
+    def give_bed(self, patient: framework.PatientInfo):
+        pid = patient.pid
+        self._ensure_capacity(pid)
+        if not self._flags[pid] & self.BED:
+            self._flags[pid] |= self.BED
+            self._num_beds += 1
+
+    def give_ventilator(self, patient: framework.PatientInfo):
+        pid = patient.pid
+        self._ensure_capacity(pid)
+        if not self._flags[pid] & self.VENTILATOR:
+            self._flags[pid] |= self.VENTILATOR
+            self._num_vented += 1
+
+    def free_bed(self, patient: framework.PatientInfo):
+        if self._get_flags(patient) & self.BED:
+            self._flags[patient.pid] &= ~self.BED
+            self._num_beds -= 1
+
+    def take_off_ventilator(self, patient: framework.PatientInfo):
+        if self._get_flags(patient) & self.VENTILATOR:
+            self._flags[patient.pid] &= ~self.VENTILATOR
+            self._num_vented -= 1
+
+    def num_admitted(self) -> int:
+        return self._num_admitted
+
+    def num_beds_used(self) -> int:
+        return self._num_beds
+
+    def num_vented(self) -> int:
+        return self._num_vented
+
+    def get_patients(self, staff: framework.StaffInfo) -> typing.Set[framework.PatientInfo]:
+        return set()
+
+    def get_active_staff(self) -> typing.Set[framework.StaffInfo]:
+        return set()
+
+    def patients_view(self, staff: framework.StaffInfo) -> typing.AbstractSet[framework.PatientInfo]:
+        return _EMPTY_VIEW
+
+    def active_staff_view(self) -> typing.AbstractSet[framework.StaffInfo]:
+        return _EMPTY_VIEW
+
+    def get_shift_end(self, staff: framework.StaffInfo) -> int:
+        raise RuntimeError("ArrayHospitalState does not model staff.")
+
+    def start_shift(self, staff: framework.StaffInfo, options: framework.StaffOptions):
+        raise RuntimeError("ArrayHospitalState does not model staff.")
+
+    def end_shift(self, staff: framework.StaffInfo, end_time: int):
+        raise RuntimeError("ArrayHospitalState does not model staff.")
+
+    def assign(self, staff: framework.StaffInfo, patient: framework.PatientInfo):
+        raise RuntimeError("ArrayHospitalState does not model staff.")
+
+    def get_patient_status(self, patient: framework.PatientInfo) -> framework.PatientStatus:
+        if not self.is_admitted(patient):
+            raise RuntimeError("Attempted to get the status of a patient that is not in the hospital.")
+        return framework.PatientStatus(covid_severity=self.get_severity(patient))
+
+    def get_staff_status(self, staff: framework.StaffInfo) -> framework.StaffStatus:
+        raise RuntimeError("ArrayHospitalState does not model staff.")
+
+    def get_staff_options(self, staff: framework.StaffInfo) -> framework.StaffOptions:
+        raise RuntimeError("ArrayHospitalState does not model staff.")
+
+    def infect_patient(self, patient: framework.PatientInfo):
+        raise RuntimeError("ArrayHospitalState does not model infection status.")
+
+    def infect_staff(self, staff: framework.StaffInfo):
+        raise RuntimeError("ArrayHospitalState does not model staff.")
+
+
 class LeastBusyPolicy(framework.HospitalPolicy[HospitalStateImpl], typing.NamedTuple):
     max_patients: int
     shift_length: int
@@ -312,16 +1028,8 @@ class LeastBusyPolicy(framework.HospitalPolicy[HospitalStateImpl], typing.NamedT
                     hospital: HospitalStateImpl) -> framework.EOSReassignment:
         mosted_rested = hospital.most_rested()
         if mosted_rested is None:
-            new_assignments = {}
-            excess_capacity = {staff: hospital.num_patients(staff) - self.max_patients
-                               for staff in hospital.get_active_staff()
-                               if hospital.num_patients(staff) < self.max_patients}
-            while orphaned_patients and excess_capacity:
-                next_staff = max(excess_capacity.keys(), key=excess_capacity.get)
-                next_patient = orphaned_patients.pop()
-                new_assignments[next_patient] = next_staff
-                excess_capacity[next_staff] -= 1
-            return framework.EOSReassignment(added_staff={}, new_assignments=new_assignments)
+            return framework.EOSReassignment(added_staff={},
+                                             new_assignments=self.redistribute(orphaned_patients, hospital))
 
         if hospital.get_ppe_level().ppe_level > 0:
             staff_ppe = framework.PPE.FULL_PPE
@@ -330,25 +1038,143 @@ class LeastBusyPolicy(framework.HospitalPolicy[HospitalStateImpl], typing.NamedT
         shift_end = time + self.shift_length
         return framework.EOSReassignment(added_staff={mosted_rested: framework.StaffOptions(ppe=staff_ppe,
                                                                                             shift_end=shift_end)},
-                                         new_assignments={p: mosted_rested for p in orphaned_patients})
+                                         new_assignments={p: {mosted_rested} for p in orphaned_patients})
+
+    def redistribute(self, orphaned_patients: typing.AbstractSet[framework.PatientInfo],
+                     hospital: HospitalStateImpl
+                     ) -> typing.Dict[framework.PatientInfo, typing.Set[framework.StaffInfo]]:
+        """
+        Spreads orphaned patients over the active staff with spare capacity, always giving the next patient to the staff
+        member with the most spare capacity (earliest on shift among ties). Patients beyond the total spare capacity are
+        left unassigned. Takes O((patients + staff) log staff) and does not modify orphaned_patients.
+        """
+        spare = []  # heap of (-spare capacity, shift order, staff)
+        for order, staff in enumerate(hospital.active_staff_view()):
+            capacity = self.max_patients - hospital.num_patients(staff)
+            if capacity > 0:
+                spare.append((-capacity, order, staff))
+        heapq.heapify(spare)
+
+        new_assignments = {}
+        for patient in sorted(orphaned_patients):
+            if not spare:
+                break
+            negative_capacity, order, staff = spare[0]
+            new_assignments[patient] = {staff}
+            if negative_capacity < -1:
+                heapq.heapreplace(spare, (negative_capacity + 1, order, staff))
+            else:
+                heapq.heappop(spare)
+        return new_assignments
+
+
+class CapacityChange(typing.NamedTuple):
+    """
+    New capacity limits that apply to arrivals from time on.
+    """
+    time: float
+    max_beds: int
+    max_ventilators: int
 
 
 class FirstComeFirstServedPolicy(framework.HospitalPolicy[HospitalStateImpl], typing.NamedTuple):
     max_beds: int
     max_ventilators: int
+    # Changes of capacity over time, e.g. surge beds opening, in increasing order of time. Lowering capacity does not
+    # discharge anyone; it only stops admissions until the census falls below the new limit.
+    capacity_schedule: typing.Tuple[CapacityChange, ...] = ()
+
+    loss_system_compatible = True
+
+    def capacity_at(self, time: float) -> typing.Tuple[int, int]:
+        """
+        :return: the bed and ventilator limits for an arrival at time
+        """
+        max_beds, max_ventilators = self.max_beds, self.max_ventilators
+        for change in self.capacity_schedule:
+            if change.time > time:
+                break
+            max_beds, max_ventilators = change.max_beds, change.max_ventilators
+        return max_beds, max_ventilators
+
+    def change_times(self) -> typing.List[float]:
+        return [change.time for change in self.capacity_schedule]
+
+    def configuration_before(self, time: float) -> typing.Tuple[typing.Tuple[float, int, int], ...]:
+        """
+        The capacity limits in effect before time, as (start time, max beds, max ventilators) segments. Two policies
+        with equal configurations before time make the same decisions for every arrival before time.
+        """
+        segments = [(-math.inf, self.max_beds, self.max_ventilators)]
+        for change in self.capacity_schedule:
+            if change.time >= time:
+                break
+            if (change.max_beds, change.max_ventilators) != segments[-1][1:]:
+                segments.append((change.time, change.max_beds, change.max_ventilators))
+        return tuple(segments)
 
     def arrival_assignment(self, arrival: framework.PatientArrival,
                            hospital: HospitalStateImpl) -> typing.Optional[framework.ArrivalAssignment]:
-        if hospital.num_beds_used() >= self.max_beds:
+        if self.capacity_schedule:
+            max_beds, max_ventilators = self.capacity_at(arrival.arrival_time)
+        else:
+            max_beds, max_ventilators = self.max_beds, self.max_ventilators
+
+        if hospital.num_beds_used() >= max_beds:
             return None
 
         needs_ventilator = arrival.status.covid_severity == framework.InfectionSeverity.REQ_VENT
-        if needs_ventilator and hospital.num_vented() >= self.max_ventilators:
+        if needs_ventilator and hospital.num_vented() >= max_ventilators:
             return None
 
         return framework.ArrivalAssignment(given_bed=True, given_ventilator=needs_ventilator)
 
 
+def is_infectious(status: typing.Union[framework.PatientStatus, framework.StaffStatus]) -> bool:
+    """
+    Whether a patient or staff member can transmit covid. ICU patients whose infection status is unknown are taken to
+    be infectious if their severity says they are infected.
+    """
+    if status.covid_status is not None:
+        return status.covid_status == framework.InfectionStatus.INFECTED
+    return status.covid_severity not in (None, framework.InfectionSeverity.NOT_INFECTED)
+
+
+def is_susceptible(status: typing.Union[framework.PatientStatus, framework.StaffStatus]) -> bool:
+    if status.covid_status is not None:
+        return status.covid_status == framework.InfectionStatus.SUSCEPTIBLE
+    return status.covid_severity == framework.InfectionSeverity.NOT_INFECTED
+
+
+def _is(values: typing.Sequence, member) -> numpy.ndarray:
+    """
+    Boolean mask of the values that are member. Enum members hash and convert to arrays slowly, so whole batches of
+    them are compared by identity, element by element, in C.
+    """
+    return numpy.fromiter(map(operator.is_, values, itertools.repeat(member)), dtype=bool, count=len(values))
+
+
+def status_flags(statuses: typing.Sequence[typing.Union[framework.PatientStatus, framework.StaffStatus]]) \
+        -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    is_infectious and is_susceptible of many statuses at once.
+
+    :return: is_infectious as floats and is_susceptible as booleans, for each of the statuses
+    """
+    covid_status = list(map(operator.attrgetter('covid_status'), statuses))
+    severity = list(map(operator.attrgetter('covid_severity'), statuses))
+    known = ~_is(covid_status, None)
+    not_infected = _is(severity, framework.InfectionSeverity.NOT_INFECTED)
+    infectious = numpy.where(known, _is(covid_status, framework.InfectionStatus.INFECTED),
+                             ~_is(severity, None) & ~not_infected)
+    susceptible = numpy.where(known, _is(covid_status, framework.InfectionStatus.SUSCEPTIBLE), not_infected)
+    return infectious.astype(float), susceptible
+
+
+def _draw_rvs(dist, random_state: numpy.random.RandomState, size: int) -> numpy.ndarray:
+    return dist.rvs(size=size, random_state=random_state)
+
+
 class HospitalModelImpl(framework.HospitalModel):
     next_id: int
     last_arrival_time: float
@@ -359,40 +1185,165 @@ class HospitalModelImpl(framework.HospitalModel):
     _ordered_severity: typing.Tuple[
         framework.InfectionSeverity, ...]  # NOTE: severity order is arbitrary, not increasing
     _severity_pdf: typing.Tuple[float, ...]  # Same length as _ordered_severity
+    _severity_cdf: typing.Tuple[float, ...]  # Same length as _ordered_severity
     _stay_dists: typing.Dict
-    _interarrival_function: typing.Callable[[int], float]
+    _interarrival_function: typing.Optional[typing.Callable[[int], float]]
+    _arrival_times: typing.Optional[typing.Iterator[float]]
+    _sampling_mode: sampling.SamplingMode
+    _buffer_size: int
+    _buffers: typing.Optional[typing.Dict[str, sampling.VariateBuffer]]
+    _stay_buffers: typing.Dict[framework.InfectionSeverity, sampling.VariateBuffer]
+    _indexed: typing.Optional[typing.Dict[str, sampling.IndexedVariates]]
+    _stay_indexed: typing.Dict[framework.InfectionSeverity, sampling.IndexedVariates]
+    _patient_to_staff_rate: float
+    _staff_to_patient_rate: float
+    _staff_to_staff_rate: float
+    _ppe_effectiveness: float
+    _transmission_random: typing.Optional[numpy.random.RandomState]
 
     def __init__(self, icu_survivalprobs: typing.Dict[framework.InfectionSeverity, float],
                  noicu_survivalprobs: typing.Dict[framework.InfectionSeverity, float],
                  severity_dist: typing.Dict[framework.InfectionSeverity, float],
                  stay_dists: typing.Dict,
-                 interarrival_function: typing.Callable[[int], float],
+                 interarrival_function: typing.Optional[typing.Callable[[int], float]] = None,
                  seed=None, lowest_id: int = 0,
-                 start_time: int = 0):
+                 start_time: int = 0,
+                 sampling_mode: sampling.SamplingMode = sampling.SamplingMode.LEGACY,
+                 buffer_size: int = sampling.DEFAULT_BUFFER_SIZE,
+                 arrival_times: typing.Optional[typing.Iterable[float]] = None,
+                 patient_to_staff_rate: float = 0.0, staff_to_patient_rate: float = 0.0,
+                 staff_to_staff_rate: float = 0.0, ppe_effectiveness: float = 0.0):
         """
 
         :param icu_survivalprobs: dictionary maps severity to probability of surviving
         :param severity_dist: dictionary maps severity to probability that ICU patient has that severity
-        :param stay_dists: dictionary maps severity to distribution of stay for that patient
+        :param stay_dists: dictionary maps severity to distribution of stay for that patient, e.g. sampling.Poisson or a
+            frozen scipy.stats distribution
         :param seed:
         :param lowest_id:
         :param start_time:
+        :param sampling_mode: LEGACY reproduces the original one-draw-at-a-time sequence; BUFFERED draws each stream
+            in blocks of buffer_size, which is much faster but gives a different (still seed-reproducible) sequence;
+            COMMON_RANDOM_NUMBERS indexes the draws by patient id, for comparing policies (see sampling.SamplingMode).
+        :param buffer_size: number of variates drawn per refill in BUFFERED mode, or per block of patient ids in
+            COMMON_RANDOM_NUMBERS mode
+        :param arrival_times: increasing arrival times, e.g. an arrivals.PiecewiseRateArrivals. If given, this is used
+            instead of interarrival_function, and the model raises StopIteration once it is exhausted.
+        :param patient_to_staff_rate: infections per unit of contact time between an infectious patient and a
+            susceptible staff member
+        :param staff_to_patient_rate: the same, from an infectious staff member to a susceptible patient
+        :param staff_to_staff_rate: the same, between two staff members on shift together
+        :param ppe_effectiveness: fraction by which full PPE reduces the rate for each staff member wearing it
         """
         self.next_id = lowest_id
         self.last_arrival_time = start_time
-        self._random_generator = numpy.random.RandomState(seed=seed)
+        self._random_generator = sampling.make_random_state(seed)
         self._icu_surivivalprobs = icu_survivalprobs
         self._noicu_surivivalprobs= noicu_survivalprobs
         self._ordered_severity = tuple(severity_dist.keys())
         self._severity_pdf = tuple(severity_dist[k] for k in self._ordered_severity)
+        self._severity_cdf = tuple(numpy.cumsum(self._severity_pdf).tolist())
         self._stay_dists = stay_dists
 
         self._interarrival_function = interarrival_function
+        if arrival_times is not None:
+            self._arrival_times = iter(arrival_times)
+        elif interarrival_function is not None:
+            self._arrival_times = None
+        else:
+            raise RuntimeError("Either an interarrival function or arrival times must be given.")
+
+        self._sampling_mode = sampling_mode
+        self._buffer_size = buffer_size
+        self._buffers = None
+        self._stay_buffers = {}
+        self._indexed = None
+        self._stay_indexed = {}
+        if sampling_mode == sampling.SamplingMode.BUFFERED:
+            self._init_buffers(seed, buffer_size)
+        elif sampling_mode == sampling.SamplingMode.COMMON_RANDOM_NUMBERS:
+            self._init_indexed(seed, buffer_size)
+
+        self._patient_to_staff_rate = patient_to_staff_rate
+        self._staff_to_patient_rate = staff_to_patient_rate
+        self._staff_to_staff_rate = staff_to_staff_rate
+        self._ppe_effectiveness = ppe_effectiveness
+        # Transmissions have their own substream, so that turning them on does not change the other draws.
+        if max(patient_to_staff_rate, staff_to_patient_rate, staff_to_staff_rate) > 0:
+            self._transmission_random = sampling.substream_random_state(seed, sampling.TRANSMISSION_STREAM)
+        else:
+            self._transmission_random = None
+
+    def _init_buffers(self, seed, buffer_size: int):
+        stay_severities = tuple(self._stay_dists.keys())
+        states = sampling.spawn_random_states(seed, 4 + len(stay_severities))
+        severity_state, interarrival_state, icu_state, noicu_state = states[:4]
+        # Partials rather than bound methods or lambdas: copy.deepcopy copies bound methods of builtin types as they
+        # are, so copies of the model (see framework.SimulationSnapshot) would share the random states.
+        random_state = numpy.random.RandomState
+        self._buffers = {
+            'severity': sampling.VariateBuffer(functools.partial(random_state.random_sample, severity_state),
+                                               buffer_size),
+            'interarrival': sampling.VariateBuffer(
+                functools.partial(random_state.standard_exponential, interarrival_state), buffer_size),
+            'icu_outcome': sampling.VariateBuffer(functools.partial(random_state.random_sample, icu_state),
+                                                  buffer_size),
+            'noicu_outcome': sampling.VariateBuffer(functools.partial(random_state.random_sample, noicu_state),
+                                                    buffer_size),
+        }
+        self._stay_buffers = {}
+        for severity, state in zip(stay_severities, states[4:]):
+            self._stay_buffers[severity] = sampling.VariateBuffer(
+                functools.partial(self._stay_dists[severity].rvs, random_state=state), buffer_size)
+
+    def _init_indexed(self, seed, block_size: int):
+        if isinstance(seed, numpy.random.RandomState):
+            raise RuntimeError("Common random numbers need an int or SeedSequence seed, not a RandomState.")
+        if not isinstance(seed, numpy.random.SeedSequence):
+            seed = numpy.random.SeedSequence(seed)
+        key = (sampling.COMMON_RANDOM_NUMBERS_STREAM,)
+        random_state = numpy.random.RandomState
+        self._indexed = {
+            'severity': sampling.IndexedVariates(seed, key + (0,), random_state.random_sample, block_size),
+            'interarrival': sampling.IndexedVariates(seed, key + (1,), random_state.standard_exponential, block_size),
+            'icu_outcome': sampling.IndexedVariates(seed, key + (2,), random_state.random_sample, block_size),
+            'noicu_outcome': sampling.IndexedVariates(seed, key + (3,), random_state.random_sample, block_size),
+        }
+        # One stream per severity, so that patient k's stay is drawn from its own severity's distribution.
+        self._stay_indexed = {}
+        for i, severity in enumerate(self._stay_dists):
+            self._stay_indexed[severity] = sampling.IndexedVariates(
+                seed, key + (4 + i,), functools.partial(_draw_rvs, self._stay_dists[severity]), block_size)
+
+    def get_sampling_mode(self) -> sampling.SamplingMode:
+        return self._sampling_mode
+
+    def reseed(self, seed):
+        """
+        Replaces every random stream of the model with new ones derived from seed, keeping the rest of its state
+        (next_id, last_arrival_time, parameters). This gives forked continuations of a run independent futures.
+
+        :param seed: an int, None or numpy SeedSequence
+        """
+        self._random_generator = sampling.make_random_state(seed)
+        if self._buffers is not None:
+            self._init_buffers(seed, self._buffer_size)
+        if self._indexed is not None:
+            self._init_indexed(seed, self._buffer_size)
+        if self._transmission_random is not None:
+            self._transmission_random = sampling.substream_random_state(seed, sampling.TRANSMISSION_STREAM)
+        if hasattr(self._arrival_times, 'reseed'):
+            self._arrival_times.reseed(sampling.substream_random_state(seed, sampling.ARRIVAL_STREAM))
 
     def generate_icu_outcome(self, patient: framework.PatientInfo,
                              status: framework.PatientStatus) -> framework.Outcome:
         survivalprob = self._icu_surivivalprobs[status.covid_severity]
-        random_num = self._random_generator.random(size=1)[0]
+        if self._indexed is not None:
+            random_num = self._indexed['icu_outcome'].get(patient.pid)
+        elif self._buffers is None:
+            random_num = self._random_generator.random(size=1)[0]
+        else:
+            random_num = self._buffers['icu_outcome'].next()
         if random_num >= survivalprob:
             return framework.Outcome.DIES
         else:
@@ -401,26 +1352,52 @@ class HospitalModelImpl(framework.HospitalModel):
     def generate_noicu_outcome(self, patient: framework.PatientInfo,
                              status: framework.PatientStatus) -> framework.Outcome:
         survivalprob = self._noicu_surivivalprobs[status.covid_severity]
-        random_num = self._random_generator.random(size=1)[0]
+        if self._indexed is not None:
+            random_num = self._indexed['noicu_outcome'].get(patient.pid)
+        elif self._buffers is None:
+            random_num = self._random_generator.random(size=1)[0]
+        else:
+            random_num = self._buffers['noicu_outcome'].next()
         if random_num >= survivalprob:
             return framework.Outcome.DIES
         else:
             return framework.Outcome.LIVES
 
     def generate_severity(self) -> framework.InfectionSeverity:
-        random_num = self._random_generator.random(size=1)[0]
-        cdf = 0.0
-        for next_severity, next_prob in zip(self._ordered_severity, self._severity_pdf):
-            cdf += next_prob
-            if cdf > random_num:
-                return next_severity
+        if self._buffers is None and self._indexed is None:
+            random_num = self._random_generator.random(size=1)[0]
+            cdf = 0.0
+            for next_severity, next_prob in zip(self._ordered_severity, self._severity_pdf):
+                cdf += next_prob
+                if cdf > random_num:
+                    return next_severity
+        else:
+            if self._indexed is not None:
+                random_num = self._indexed['severity'].get(self.next_id)
+            else:
+                random_num = self._buffers['severity'].next()
+            for next_severity, cdf in zip(self._ordered_severity, self._severity_cdf):
+                if cdf > random_num:
+                    return next_severity
         raise RuntimeError("This code shouldn't be reached; random number generation failed.")
 
     def generate_next_arrival(self) -> framework.PatientArrival:
-        severity = self.generate_severity()
-        interarrival = float(scipy.stats.expon.rvs(scale=self._interarrival_function(self.last_arrival_time), size=1,
-                                                 random_state=self._random_generator)[0])
-        next_arrival_time = self.last_arrival_time + interarrival
+        if self._arrival_times is not None:
+            # The time comes first, so that an exhausted arrival stream raises StopIteration before a severity is drawn.
+            next_arrival_time = next(self._arrival_times)
+            severity = self.generate_severity()
+        else:
+            # The severity comes first, as in the original sequence of draws from one random state.
+            severity = self.generate_severity()
+            scale = self._interarrival_function(self.last_arrival_time)
+            if self._indexed is not None:
+                interarrival = scale * self._indexed['interarrival'].get(self.next_id)
+            elif self._buffers is None:
+                # The variate of scipy.stats.expon(scale=scale) from the same random state, without importing scipy.
+                interarrival = float(sampling.Exponential(scale).rvs(size=1, random_state=self._random_generator)[0])
+            else:
+                interarrival = scale * self._buffers['interarrival'].next()
+            next_arrival_time = self.last_arrival_time + interarrival
         next_patient = framework.PatientArrival(arrival_time=int(next_arrival_time),
                                                 patient=framework.PatientInfo(self.next_id),
                                                 status=framework.PatientStatus(covid_severity=severity))
@@ -429,4 +1406,62 @@ class HospitalModelImpl(framework.HospitalModel):
         return next_patient
 
     def generate_stay_length(self, patient: framework.PatientInfo, status: framework.PatientStatus) -> int:
-        return self._stay_dists[status.covid_severity].rvs(size=1, random_state=self._random_generator)[0]
+        if self._indexed is not None:
+            return self._stay_indexed[status.covid_severity].get(patient.pid)
+        if self._buffers is None:
+            return self._stay_dists[status.covid_severity].rvs(size=1, random_state=self._random_generator)[0]
+        return self._stay_buffers[status.covid_severity].next()
+
+    def _ppe_factors(self, staff_ppe: typing.Sequence[typing.Optional[framework.PPE]]) -> numpy.ndarray:
+        return numpy.where(_is(staff_ppe, framework.PPE.FULL_PPE), 1.0 - self._ppe_effectiveness, 1.0)
+
+    def _draw_infections(self, rate: float, exposure: numpy.ndarray, susceptible: numpy.ndarray) -> numpy.ndarray:
+        """
+        :param rate: infections per unit of exposure
+        :param exposure: infectious contact time of each individual, weighted for PPE
+        :param susceptible: boolean mask of the individuals who can be infected
+        :return: boolean mask of the individuals infected
+        """
+        infected = numpy.zeros(len(exposure), dtype=bool)
+        at_risk = susceptible & (exposure > 0)
+        if rate <= 0 or not at_risk.any():
+            return infected
+        probabilities = -numpy.expm1(-rate * exposure[at_risk])
+        infected[at_risk] = self._transmission_random.random_sample(size=probabilities.size) < probabilities
+        return infected
+
+    def models_transmission(self) -> bool:
+        return self._transmission_random is not None
+
+    def staff_to_patient_transmission(self, batch: framework.InteractionBatch) -> framework.Transmissions:
+        if batch.staff_patient_durations.size == 0:
+            return framework.Transmissions()
+        # Only the staff who saw patients are exposed or can expose anyone, and they are few of those on shift.
+        contact = numpy.flatnonzero(batch.staff_patient_durations.any(axis=1)).tolist()
+        durations = batch.staff_patient_durations[contact]
+        staff = [batch.staff[i] for i in contact]
+        ppe = self._ppe_factors([batch.staff_ppe[i] for i in contact])
+        infectious_patients, susceptible_patients = status_flags(batch.patient_statuses)
+        infectious_staff, susceptible_staff = status_flags([batch.staff_statuses[i] for i in contact])
+
+        patients_infected = self._draw_infections(self._staff_to_patient_rate,
+                                                  (ppe * infectious_staff) @ durations, susceptible_patients)
+        staff_infected = self._draw_infections(self._patient_to_staff_rate,
+                                               ppe * (durations @ infectious_patients), susceptible_staff)
+        return framework.Transmissions(
+            infected_staff=frozenset(s for s, i in zip(staff, staff_infected.tolist()) if i),
+            infected_patients=frozenset(p for p, i in zip(batch.patients, patients_infected.tolist()) if i))
+
+    def staff_to_staff_transmission(self, batch: framework.InteractionBatch) -> typing.FrozenSet[framework.StaffInfo]:
+        if batch.num_on_shift < 2 or batch.staff_staff_duration <= 0:
+            return frozenset()
+        ppe = self._ppe_factors(batch.staff_ppe)
+        infectious, susceptible = status_flags(batch.staff_statuses)
+        # Every pair on shift was in contact for the same time, so each one's exposure is to all the others' PPE
+        # weighted infectiousness: the total less their own. Staff who went off shift earlier have none.
+        weighted = ppe * infectious
+        weighted[batch.num_on_shift:] = 0
+        exposure = ppe * batch.staff_staff_duration * (weighted.sum() - weighted)
+        exposure[batch.num_on_shift:] = 0
+        infected = self._draw_infections(self._staff_to_staff_rate, exposure, susceptible)
+        return frozenset(s for s, i in zip(batch.staff, infected.tolist()) if i)
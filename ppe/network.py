@@ -0,0 +1,349 @@
+import dataclasses
+import heapq
+import itertools
+import math
+import typing
+import numpy
+from . import arrivals
+from . import framework
+from . import implement
+from . import sampling
+
+# Each site of a NetworkScenario gets a block of patient ids this many standard deviations above its expected number
+# of arrivals, so that ids stay dense across the network (see site_lowest_ids).
+ID_BLOCK_DEVIATIONS = 10
+
+
+def site_lowest_ids(site_rates: typing.Sequence[typing.Sequence[float]]) -> typing.List[int]:
+    """
+    The first patient id of every site, given its expected arrivals per period. The ids of a site run up to the first
+    id of the next one, which leaves room for its arrivals beyond any realistic Poisson fluctuation; run_network
+    raises an error if a site runs out of ids nonetheless.
+    """
+    lowest_ids = []
+    next_id = 0
+    for rates in site_rates:
+        lowest_ids.append(next_id)
+        expected = float(numpy.sum(rates))
+        next_id += int(math.ceil(expected + ID_BLOCK_DEVIATIONS * math.sqrt(expected))) + ID_BLOCK_DEVIATIONS ** 2
+    return lowest_ids
+
+
+class Site(typing.NamedTuple):
+    """
+    One hospital of a network. Patient ids must be unique across the sites of a network: the ids of each site increase,
+    and run_network requires them to stay below the first id of the site numbered next.
+    """
+    name: str
+    hospital_state: framework.HospitalState
+    policy: framework.HospitalPolicy
+    model: framework.HospitalModel
+    logger: framework.HospitalLogger
+
+
+class CapacityIndex:
+    """
+    Beds and ventilators in use at every site and the limits of the site policies, as arrays indexed by site. The
+    arrays are updated as events happen, so transfer policies find the sites with room in one vectorized lookup
+    rather than by querying every hospital.
+
+    The limits come from the policy's capacity_at(time) (e.g. FirstComeFirstServedPolicy with a capacity schedule) or
+    its max_beds and max_ventilators; policies without them get no limit here and only their own decision counts.
+    """
+    beds_used: numpy.ndarray
+    ventilators_used: numpy.ndarray
+    max_beds: numpy.ndarray
+    max_ventilators: numpy.ndarray
+    _policies: typing.List[framework.HospitalPolicy]
+    _change_times: typing.List[float]
+    _next_change: int  # index in _change_times of the first change not applied yet
+
+    def __init__(self, policies: typing.Sequence[framework.HospitalPolicy], start_time: float = 0):
+        self._policies = list(policies)
+        self.beds_used = numpy.zeros(len(self._policies), dtype=int)
+        self.ventilators_used = numpy.zeros(len(self._policies), dtype=int)
+        self.max_beds = numpy.full(len(self._policies), math.inf)
+        self.max_ventilators = numpy.full(len(self._policies), math.inf)
+        self._change_times = sorted({t for p in self._policies for t in getattr(p, 'change_times', list)()})
+        self._next_change = 0
+        self._set_limits(start_time)
+
+    def _set_limits(self, time: float):
+        for site, policy in enumerate(self._policies):
+            if hasattr(policy, 'capacity_at'):
+                self.max_beds[site], self.max_ventilators[site] = policy.capacity_at(time)
+            elif hasattr(policy, 'max_beds') and hasattr(policy, 'max_ventilators'):
+                self.max_beds[site], self.max_ventilators[site] = policy.max_beds, policy.max_ventilators
+        while self._next_change < len(self._change_times) and self._change_times[self._next_change] <= time:
+            self._next_change += 1
+
+    def advance(self, time: float):
+        """
+        Applies the capacity changes up to time.
+        """
+        if self._next_change < len(self._change_times) and self._change_times[self._next_change] <= time:
+            self._set_limits(time)
+
+    def update(self, site: int, hospital: framework.HospitalState):
+        self.beds_used[site] = hospital.num_beds_used()
+        self.ventilators_used[site] = hospital.num_vented()
+
+    def free_beds(self) -> numpy.ndarray:
+        return self.max_beds - self.beds_used
+
+    def free_ventilators(self) -> numpy.ndarray:
+        return self.max_ventilators - self.ventilators_used
+
+    def has_room(self, needs_ventilator: bool, reserve_beds: int = 0) -> numpy.ndarray:
+        """
+        :param reserve_beds: free beds a site keeps for its own arrivals
+        :return: boolean mask of the sites that can take a patient
+        """
+        room = self.beds_used < self.max_beds - reserve_beds
+        if needs_ventilator:
+            room &= self.ventilators_used < self.max_ventilators
+        return room
+
+
+class TransferPolicy:
+    """
+    Decides where a patient declined by the site they arrived at is sent. The policies here are frozen dataclasses, so
+    they can be compared, hashed and pickled with the scenarios that hold them.
+    """
+
+    def destinations(self, arrival: framework.PatientArrival, origin: int,
+                     capacity: CapacityIndex) -> typing.Iterable[int]:
+        """
+        :return: the sites to try, in order of preference. The first one whose policy admits the patient takes them;
+            if none does, the patient is declined at the origin.
+        """
+        raise NotImplementedError
+
+
+def _needs_ventilator(arrival: framework.PatientArrival) -> bool:
+    return arrival.status.covid_severity == framework.InfectionSeverity.REQ_VENT
+
+
+@dataclasses.dataclass(frozen=True)
+class MostAvailableTransferPolicy(TransferPolicy):
+    """
+    Sends declined patients to the site with the most free beds.
+    """
+    reserve_beds: int = 0
+
+    def destinations(self, arrival: framework.PatientArrival, origin: int,
+                     capacity: CapacityIndex) -> typing.Iterable[int]:
+        room = capacity.has_room(_needs_ventilator(arrival), self.reserve_beds)
+        room[origin] = False
+        if not room.any():
+            return ()
+        candidates = numpy.flatnonzero(room)
+        order = numpy.argsort(-capacity.free_beds()[candidates], kind='stable')
+        return candidates[order].tolist()
+
+
+@dataclasses.dataclass(frozen=True)
+class NearestAvailableTransferPolicy(TransferPolicy):
+    """
+    Sends declined patients to the nearest site with room, up to max_distance away.
+    """
+    distances: typing.Tuple[typing.Tuple[float, ...], ...]  # distances[origin][destination]
+    max_distance: float = math.inf
+    reserve_beds: int = 0
+
+    def destinations(self, arrival: framework.PatientArrival, origin: int,
+                     capacity: CapacityIndex) -> typing.Iterable[int]:
+        distances = numpy.asarray(self.distances[origin], dtype=float)
+        room = capacity.has_room(_needs_ventilator(arrival), self.reserve_beds) & (distances <= self.max_distance)
+        room[origin] = False
+        if not room.any():
+            return ()
+        candidates = numpy.flatnonzero(room)
+        order = numpy.argsort(distances[candidates], kind='stable')
+        return candidates[order].tolist()
+
+
+def _id_limits(first_arrivals: typing.Iterable[tuple], num_sites: int) -> typing.List[float]:
+    """
+    For queue entries of the first arrival at each site, the first patient id of the site numbered next above each
+    site, which the ids of that site must stay below.
+    """
+    firsts = sorted((entry[3].patient.pid, entry[2]) for entry in first_arrivals)
+    limits = [math.inf] * num_sites
+    for (_, site), (next_first, _) in zip(firsts, firsts[1:]):
+        limits[site] = next_first
+    return limits
+
+
+def run_network(sites: typing.Sequence[Site], until: float,
+                transfer_policy: typing.Optional[TransferPolicy] = None) -> numpy.ndarray:
+    """
+    Runs unstaffed ICUs under one clock, on one event queue as run_loss_system does for a single ICU. Each site has its
+    own arrivals, policy and logger. A patient declined by the site they arrive at is offered to the sites named by
+    transfer_policy and admitted by the first that accepts, at the same time; the origin logs the arrival and the
+    transfer, and the destination logs the patient as an arrival and everything after. The stay and outcome of a
+    patient are always drawn from the model of the site they arrived at, so each model draws for the patients of its
+    own demand, whichever site treats them.
+
+    With one site and no transfer policy, the run and the logger output are the same as run_icu.
+
+    :param sites: the hospitals; each policy must declare loss_system_compatible and no staff may be on shift
+    :param until: events at or after this time are not processed
+    :param transfer_policy: where declined patients are sent; without one, declined patients stay declined
+    :return: the number of transfers from each site (rows) to each site (columns)
+    """
+    for site in sites:
+        if not getattr(site.policy, 'loss_system_compatible', False) or site.hospital_state.active_staff_view():
+            raise RuntimeError("Site {} cannot be run in a network: networks need loss-system-compatible policies "
+                               "and no staff on shift.".format(site.name))
+
+    transfers = numpy.zeros((len(sites), len(sites)), dtype=int)
+    capacity = CapacityIndex([site.policy for site in sites])
+    for index, site in enumerate(sites):
+        capacity.update(index, site.hospital_state)
+
+    queue = []
+    counter = itertools.count()
+    # Entries are (time, order scheduled, site, arrival, exiting patient, outcome); arrival is None for exits.
+    for index, site in enumerate(sites):
+        try:
+            first_arrival = site.model.generate_next_arrival()
+        except StopIteration:
+            continue
+        heapq.heappush(queue, (first_arrival.arrival_time, next(counter), index, first_arrival, None, None))
+    id_limits = _id_limits(queue, len(sites))
+
+    while queue and queue[0][0] < until:
+        time, _, index, arrival, patient, outcome = heapq.heappop(queue)
+        site = sites[index]
+        if arrival is None:
+            framework.process_exit(exit_time=time, patient=patient, outcome=outcome, hospital=site.hospital_state,
+                                   logger=site.logger)
+            capacity.update(index, site.hospital_state)
+            continue
+
+        if arrival.patient.pid >= id_limits[index]:
+            raise RuntimeError("Site {} has run out of patient ids: its patient {} has the id of another site's "
+                               "patient.".format(site.name, arrival.patient.pid))
+        capacity.advance(time)
+        destination = index
+        arrival_assign = site.policy.arrival_assignment(arrival=arrival, hospital=site.hospital_state)
+        if arrival_assign is None and transfer_policy is not None:
+            for candidate in transfer_policy.destinations(arrival, index, capacity):
+                arrival_assign = sites[candidate].policy.arrival_assignment(
+                    arrival=arrival, hospital=sites[candidate].hospital_state)
+                if arrival_assign is not None:
+                    destination = candidate
+                    break
+
+        site.logger.log_patient_arrived(time=time, patient=arrival.patient, status=arrival.status)
+        if arrival_assign is None:
+            framework.decline_arrival(arrival=arrival, logger=site.logger, model=site.model)
+        else:
+            receiving = sites[destination]
+            if destination != index:
+                site.logger.log_patient_transferred(time=time, patient=arrival.patient, site=destination)
+                receiving.logger.log_patient_arrived(time=time, patient=arrival.patient, status=arrival.status)
+                transfers[index, destination] += 1
+            exit_time, exit_outcome = framework.admit_arrival(arrival=arrival, arrival_assign=arrival_assign,
+                                                              hospital=receiving.hospital_state,
+                                                              logger=receiving.logger, model=site.model)
+            heapq.heappush(queue, (exit_time, next(counter), destination, None, arrival.patient, exit_outcome))
+            capacity.update(destination, receiving.hospital_state)
+
+        try:
+            next_arrival = site.model.generate_next_arrival()
+        except StopIteration:
+            continue
+        heapq.heappush(queue, (next_arrival.arrival_time, next(counter), index, next_arrival, None, None))
+    return transfers
+
+
+def read_site_rates(path: str, columns: typing.Sequence[str],
+                    scale: float = 1.0) -> typing.Tuple[typing.Tuple[float, ...], ...]:
+    """
+    Reads one demand column per site, e.g. read_site_rates('resources/demands_3_24.csv', ['T_400', 'T_600']).
+
+    :param scale: multiplier applied to the demand columns to get arrival rates per period
+    """
+    return tuple(tuple((arrivals.read_demand_column(path, column) * scale).tolist()) for column in columns)
+
+
+class SiteSummary(typing.NamedTuple):
+    site: str
+    arrivals: int  # arrivals from the site's own demand
+    transfers_out: int
+    transfers_in: int
+    admissions: int  # including patients transferred in
+    declines: int
+    deaths: int  # of patients admitted or declined here
+    discharges: int
+    peak_beds: int
+    peak_ventilators: int
+
+
+class NetworkSummary(typing.NamedTuple):
+    sites: typing.Tuple[SiteSummary, ...]
+    transfers: numpy.ndarray  # transfers[origin, destination]
+
+    def total(self, field: str) -> int:
+        return sum(getattr(s, field) for s in self.sites)
+
+
+class NetworkScenario(typing.NamedTuple):
+    """
+    A picklable description of a network run: model parameters shared by all sites, one demand column and one
+    policy per site, and the transfer policy.
+    """
+    icu_survivalprobs: typing.Dict[framework.InfectionSeverity, float]
+    noicu_survivalprobs: typing.Dict[framework.InfectionSeverity, float]
+    severity_dist: typing.Dict[framework.InfectionSeverity, float]
+    stay_dists: typing.Dict
+    site_rates: typing.Tuple[typing.Tuple[float, ...], ...]
+    policies: typing.Tuple[framework.HospitalPolicy, ...]
+    transfer_policy: typing.Optional[TransferPolicy] = None
+    site_names: typing.Optional[typing.Tuple[str, ...]] = None
+    period_length: float = 1.0
+    sampling_mode: sampling.SamplingMode = sampling.SamplingMode.LEGACY
+
+    def build(self, seed) -> typing.List[Site]:
+        """
+        Creates the sites with SummaryLoggers. Every site gets independent model and arrival streams spawned from
+        seed, as ICUScenario.build does for one ICU.
+        """
+        if len(self.policies) != len(self.site_rates):
+            raise RuntimeError("A network scenario needs one policy per site.")
+        names = self.site_names if self.site_names is not None else tuple(str(i) for i in range(len(self.policies)))
+        if not isinstance(seed, numpy.random.SeedSequence):
+            seed = numpy.random.SeedSequence(seed)
+        sites = []
+        lowest_ids = site_lowest_ids(self.site_rates)
+        for index, (site_seed, rates, policy) in enumerate(zip(seed.spawn(len(self.policies)), self.site_rates,
+                                                               self.policies)):
+            model_seed, arrival_seed = site_seed.spawn(2)
+            arrival_times = arrivals.PiecewiseRateArrivals(rates, period_length=self.period_length,
+                                                           random_state=arrival_seed)
+            model = implement.HospitalModelImpl(icu_survivalprobs=self.icu_survivalprobs,
+                                                noicu_survivalprobs=self.noicu_survivalprobs,
+                                                severity_dist=self.severity_dist, stay_dists=self.stay_dists,
+                                                arrival_times=arrival_times, seed=model_seed,
+                                                lowest_id=lowest_ids[index], sampling_mode=self.sampling_mode)
+            hospital = implement.HospitalStateImpl(existing_patients={}, bedusers=set(), ventusers=set())
+            sites.append(Site(name=names[index], hospital_state=hospital, policy=policy, model=model,
+                              logger=implement.SummaryLogger()))
+        return sites
+
+
+def run_network_replication(scenario: NetworkScenario, horizon: float, seed) -> NetworkSummary:
+    sites = scenario.build(seed)
+    transfers = run_network(sites, until=horizon, transfer_policy=scenario.transfer_policy)
+    transfers_in = transfers.sum(axis=0)
+    summaries = []
+    for index, site in enumerate(sites):
+        logger = site.logger
+        summaries.append(SiteSummary(site=site.name, arrivals=logger.arrivals - int(transfers_in[index]),
+                                     transfers_out=logger.transfers, transfers_in=int(transfers_in[index]),
+                                     admissions=logger.admissions, declines=logger.declines, deaths=logger.deaths,
+                                     discharges=logger.discharges, peak_beds=logger.peak_beds,
+                                     peak_ventilators=logger.peak_ventilators))
+    return NetworkSummary(sites=tuple(summaries), transfers=transfers)
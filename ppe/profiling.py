@@ -0,0 +1,178 @@
+"""
+Opt-in profiling of ICU runs: where the time of a run goes, by handler, framework step, policy decision, model draw,
+hospital state mutation and logger hook.
+
+Nothing here is used by ordinary runs, so they pay nothing for it. profile_run wraps the policy, model, state and
+logger of one run in timing proxies and passes a timer for the framework steps and handlers to the simulation; the
+calls that are not timed are forwarded at the cost of one attribute lookup.
+"""
+import time
+import typing
+from . import framework
+from . import implement
+from . import replication
+
+# The order of the components in profile tables; each row's time includes the time of the calls it makes.
+COMPONENTS = ('handler', 'framework', 'policy', 'model', 'state', 'logger')
+
+POLICY_METHODS = frozenset({'arrival_assignment', 'eos_restaff'})
+TRANSMISSION_METHODS = frozenset({'staff_to_patient_transmission', 'staff_to_staff_transmission'})
+STATE_MUTATORS = frozenset({'discharge_patient', 'start_shift', 'end_shift', 'assign', 'discharge_early',
+                            'give_ventilator', 'take_off_ventilator', 'give_bed', 'free_bed', 'add_patient',
+                            'infect_patient', 'infect_staff'})
+
+
+class ProfileRow(typing.NamedTuple):
+    component: str
+    name: str
+    calls: int
+    seconds: float  # total, including the calls made from this one
+    mean_microseconds: float
+    share: float  # fraction of the wall time of the run
+
+
+class QueueSample(typing.NamedTuple):
+    time: float
+    waiting_handlers: int  # arrival and shift-end handlers waiting to fire
+    pending_exits: int  # exits held by the DischargeScheduler, which keeps only the next one in the simpy queue
+
+
+class Profile:
+    """
+    Call counts and timings of one run, and the queue depth over time.
+    """
+    calls: typing.Dict[typing.Tuple[str, str], int]
+    seconds: typing.Dict[typing.Tuple[str, str], float]
+    queue_depth: typing.List[QueueSample]
+    max_waiting_handlers: int
+    max_pending_exits: int
+    wall_seconds: float
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self.queue_depth = []
+        self.max_waiting_handlers = 0
+        self.max_pending_exits = 0
+        self.wall_seconds = 0.0
+
+    def add(self, key: typing.Tuple[str, str], seconds: float):
+        self.calls[key] = self.calls.get(key, 0) + 1
+        self.seconds[key] = self.seconds.get(key, 0.0) + seconds
+
+    def timed(self, key: typing.Tuple[str, str], function: typing.Callable) -> typing.Callable:
+        def timed_call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(key, time.perf_counter() - start)
+        return timed_call
+
+    def timer(self, component: str, name: str, function: typing.Callable) -> typing.Callable:
+        """
+        A framework.Timer that records into this profile.
+        """
+        return self.timed((component, name), function)
+
+    def table(self) -> typing.List[ProfileRow]:
+        """
+        One row per timed call, by component and then by decreasing total time.
+        """
+        rows = []
+        for (component, name), calls in self.calls.items():
+            seconds = self.seconds[(component, name)]
+            rows.append(ProfileRow(component=component, name=name, calls=calls, seconds=seconds,
+                                   mean_microseconds=1e6 * seconds / calls,
+                                   share=seconds / self.wall_seconds if self.wall_seconds > 0 else 0.0))
+        rows.sort(key=lambda r: (COMPONENTS.index(r.component), -r.seconds))
+        return rows
+
+    def format_table(self) -> str:
+        lines = ["{:<10}{:<34}{:>10}{:>11}{:>11}{:>8}".format('component', 'name', 'calls', 'seconds', 'mean us',
+                                                             'share')]
+        for r in self.table():
+            lines.append("{:<10}{:<34}{:>10}{:>11.3f}{:>11.2f}{:>8.1%}".format(r.component, r.name, r.calls,
+                                                                               r.seconds, r.mean_microseconds,
+                                                                               r.share))
+        lines.append("wall time {:.3f} s; max waiting handlers {}; max pending exits {}".format(
+            self.wall_seconds, self.max_waiting_handlers, self.max_pending_exits))
+        return '\n'.join(lines)
+
+
+class _TimingProxy:
+    """
+    Forwards attribute access to a target object, timing the calls of some of its methods. Methods are looked up on
+    the target once and then cached on the proxy, so later calls go straight to them.
+    """
+
+    def __init__(self, target, component: str, profile: Profile, is_timed: typing.Callable[[str], bool]):
+        self._target = target
+        self._component = component
+        self._profile = profile
+        self._is_timed = is_timed
+
+    def __getattr__(self, name: str):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value  # data attributes such as next_id can change, so they are never cached
+        if self._is_timed(name):
+            value = self._profile.timed((self._component, name), value)
+        self.__dict__[name] = value
+        return value
+
+
+def profile_run(hospital_state: framework.HospitalState, logger: framework.HospitalLogger,
+                policy: framework.HospitalPolicy, model: framework.HospitalModel, until: float,
+                sample_interval: typing.Optional[float] = None) -> Profile:
+    """
+    Runs icu_process until the given time, like run_icu, and profiles it. The run always uses simpy, even if run_icu
+    would use run_loss_system, and it is slower than an unprofiled one; the shares of the components are what matter.
+    The logger output is the same as without profiling.
+
+    Handlers are timed by their steps between simpy events, named by their generator functions; the DischargeScheduler
+    process that serves exits is DischargeScheduler._run.
+
+    :param sample_interval: the queue depth is recorded at the first event at or after every multiple of this
+        simulation time; by default at every event
+    """
+    profile = Profile()
+    simulation = framework.ICUSimulation(
+        hospital_state=_TimingProxy(hospital_state, 'state', profile, STATE_MUTATORS.__contains__),
+        logger=_TimingProxy(logger, 'logger', profile, lambda name: name.startswith('log_')),
+        policy=_TimingProxy(policy, 'policy', profile, POLICY_METHODS.__contains__),
+        model=_TimingProxy(model, 'model', profile,
+                           lambda name: name.startswith('generate_') or name in TRANSMISSION_METHODS),
+        timer=profile.timer)
+    discharges = simulation.discharges
+    next_sample = simulation.env.now
+
+    def sample(time: float):
+        nonlocal next_sample
+        waiting_handlers, pending_exits = discharges.num_reserved(), discharges.num_pending()
+        if time >= next_sample:
+            profile.queue_depth.append(QueueSample(time=time, waiting_handlers=waiting_handlers,
+                                                   pending_exits=pending_exits))
+            if sample_interval is not None:
+                next_sample = (time // sample_interval + 1) * sample_interval
+        profile.max_waiting_handlers = max(profile.max_waiting_handlers, waiting_handlers)
+        profile.max_pending_exits = max(profile.max_pending_exits, pending_exits)
+
+    start = time.perf_counter()
+    try:
+        profile.timed(('handler', 'start'), simulation.start)()
+        simulation.run(until, on_step=sample)
+    finally:
+        profile.wall_seconds = time.perf_counter() - start
+    return profile
+
+
+def profile_replication(build: typing.Callable[..., replication.SimulationSetup], horizon: float, seed,
+                        sample_interval: typing.Optional[float] = None) -> Profile:
+    """
+    Profiles one replication as run by run_replication, e.g. profile_replication(scenario.build, horizon, seed) for a
+    cell of a slow sweep.
+    """
+    setup = build(seed)
+    return profile_run(hospital_state=setup.hospital_state, logger=implement.SummaryLogger(), policy=setup.policy,
+                       model=setup.model, until=horizon, sample_interval=sample_interval)
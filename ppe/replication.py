@@ -0,0 +1,376 @@
+import concurrent.futures
+import itertools
+import math
+import os
+import time
+import typing
+import numpy
+from . import framework
+from . import implement
+from . import arrivals
+from . import sampling
+
+
+class SimulationSetup(typing.NamedTuple):
+    """
+    The objects needed to run icu_process once.
+    """
+    hospital_state: framework.HospitalState
+    policy: framework.HospitalPolicy
+    model: framework.HospitalModel
+
+
+class ReplicationSummary(typing.NamedTuple):
+    replication: int
+    arrivals: int
+    admissions: int
+    declines: int
+    deaths: int
+    discharges: int
+    peak_beds: int
+    peak_ventilators: int
+
+
+class ICUScenario(typing.NamedTuple):
+    """
+    A picklable description of an unstaffed ICU run: model parameters, one column of daily demand and a policy. Pass
+    ICUScenario.build to run_replications.
+    """
+    icu_survivalprobs: typing.Dict[framework.InfectionSeverity, float]
+    noicu_survivalprobs: typing.Dict[framework.InfectionSeverity, float]
+    severity_dist: typing.Dict[framework.InfectionSeverity, float]
+    stay_dists: typing.Dict
+    daily_rates: typing.Tuple[float, ...]
+    policy: framework.HospitalPolicy
+    period_length: float = 1.0
+    sampling_mode: sampling.SamplingMode = sampling.SamplingMode.LEGACY
+
+    def build(self, seed) -> SimulationSetup:
+        """
+        :param seed: an int or numpy SeedSequence. Arrivals and the model get independent streams spawned from it.
+        """
+        if not isinstance(seed, numpy.random.SeedSequence):
+            seed = numpy.random.SeedSequence(seed)
+        model_seed, arrival_seed = seed.spawn(2)
+        arrival_times = arrivals.PiecewiseRateArrivals(self.daily_rates, period_length=self.period_length,
+                                                       random_state=arrival_seed)
+        model = implement.HospitalModelImpl(icu_survivalprobs=self.icu_survivalprobs,
+                                            noicu_survivalprobs=self.noicu_survivalprobs,
+                                            severity_dist=self.severity_dist,
+                                            stay_dists=self.stay_dists,
+                                            arrival_times=arrival_times,
+                                            seed=model_seed,
+                                            sampling_mode=self.sampling_mode)
+        hospital = implement.HospitalStateImpl(existing_patients={}, bedusers=set(), ventusers=set())
+        return SimulationSetup(hospital_state=hospital, policy=self.policy, model=model)
+
+
+def run_replication(build: typing.Callable[[numpy.random.SeedSequence], SimulationSetup], horizon: float,
+                    replication: int, seed: numpy.random.SeedSequence) -> ReplicationSummary:
+    """
+    Runs icu_process once until horizon and summarizes the run.
+
+    :param build: creates a fresh hospital state, policy and model from a seed
+    :param horizon: simulation time at which the run stops
+    :param replication: index of this replication, recorded in the summary
+    :param seed: seed for this replication
+    """
+    setup = build(seed)
+    logger = implement.SummaryLogger()
+    framework.run_icu(hospital_state=setup.hospital_state, logger=logger, policy=setup.policy, model=setup.model,
+                      until=horizon)
+    return summarize(logger, replication)
+
+
+def summarize(logger: implement.SummaryLogger, replication: int) -> ReplicationSummary:
+    return ReplicationSummary(replication=replication, arrivals=logger.arrivals, admissions=logger.admissions,
+                              declines=logger.declines, deaths=logger.deaths, discharges=logger.discharges,
+                              peak_beds=logger.peak_beds, peak_ventilators=logger.peak_ventilators)
+
+
+def replication_seeds(seed, num_replications: int) -> typing.List[numpy.random.SeedSequence]:
+    """
+    Spawns one independent SeedSequence per replication. Replication i always gets the same stream for a given seed,
+    no matter how the replications are distributed across workers.
+    """
+    return numpy.random.SeedSequence(seed).spawn(num_replications)
+
+
+def run_replications(build: typing.Callable[[numpy.random.SeedSequence], SimulationSetup], horizon: float,
+                     num_replications: int, seed=None,
+                     max_workers: typing.Optional[int] = None) -> typing.List[ReplicationSummary]:
+    """
+    Runs independent replications of icu_process across a process pool.
+
+    Results are ordered by replication index and are identical for any number of workers, since each replication's
+    random streams depend only on seed and its index.
+
+    :param build: creates a fresh hospital state, policy and model from a SeedSequence. It must be picklable: a
+        module-level function, functools.partial of one, or a bound method such as ICUScenario.build.
+    :param horizon: simulation time at which each run stops
+    :param num_replications: number of replications
+    :param seed: root seed; replication streams are spawned from it
+    :param max_workers: number of worker processes. 1 runs everything in this process.
+    """
+    seeds = replication_seeds(seed, num_replications)
+    if max_workers == 1:
+        return [run_replication(build, horizon, i, s) for i, s in enumerate(seeds)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run_replication, itertools.repeat(build), itertools.repeat(horizon),
+                                 range(num_replications), seeds))
+
+
+class RunningStatistics:
+    """
+    Streaming mean and variance of a sequence of values (Welford's algorithm).
+    """
+    count: int
+    mean: float
+    _m2: float  # sum of squared deviations from the mean
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def variance(self) -> float:
+        """
+        The sample variance; nan with fewer than two values.
+        """
+        if self.count < 2:
+            return math.nan
+        return self._m2 / (self.count - 1)
+
+    def half_width(self, confidence: float = 0.95) -> float:
+        """
+        Half-width of the Student t confidence interval for the mean; nan with fewer than two values.
+        """
+        if self.count < 2:
+            return math.nan
+        quantile = t_quantile(0.5 + confidence / 2, self.count - 1)
+        return quantile * math.sqrt(self.variance() / self.count)
+
+
+def _beta_fraction(a: float, b: float, x: float) -> float:
+    """
+    The continued fraction of the regularized incomplete beta function (modified Lentz's method).
+    """
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    fraction = d
+    for m in range(1, 1000):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            fraction *= c * d
+        if abs(c * d - 1.0) < 1e-15:
+            break
+    return fraction
+
+
+def _incomplete_beta(a: float, b: float, x: float, y: float) -> float:
+    """
+    The regularized incomplete beta function I_x(a, b), given y = 1 - x computed without cancellation.
+    """
+    if x <= 0:
+        return 0.0
+    if y <= 0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(y))
+    if x < (a + 1) / (a + b + 2):
+        return front * _beta_fraction(a, b, x) / a
+    return 1.0 - front * _beta_fraction(b, a, y) / b
+
+
+def t_quantile(probability: float, df: float) -> float:
+    """
+    The quantile of Student's t distribution with df degrees of freedom for a probability in [0.5, 1), in place of
+    scipy.stats.t.ppf. It bisects on the upper tail P(T > t) = I_{df / (df + t^2)}(df / 2, 1 / 2) / 2.
+    """
+    if probability == 0.5:
+        return 0.0
+    if not 0.5 < probability < 1:
+        raise RuntimeError("t_quantile needs a probability in [0.5, 1), not {}.".format(probability))
+    tail = 1.0 - probability
+
+    def upper_tail(t: float) -> float:
+        return 0.5 * _incomplete_beta(df / 2, 0.5, df / (df + t * t), t * t / (df + t * t))
+
+    low, high = 0.0, 1.0
+    while upper_tail(high) > tail:
+        low, high = high, 2 * high
+    while high - low > 1e-13 * high:
+        middle = (low + high) / 2
+        if upper_tail(middle) > tail:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+class AdaptiveResult(typing.NamedTuple):
+    summaries: typing.List[ReplicationSummary]
+    means: typing.Dict[str, float]
+    half_widths: typing.Dict[str, float]
+    converged: bool  # False if the time budget or max_replications ran out first
+    elapsed: float  # seconds
+
+
+def run_adaptive_replications(build: typing.Callable[[numpy.random.SeedSequence], SimulationSetup], horizon: float,
+                              outputs: typing.Sequence[str] = ('deaths', 'declines', 'peak_beds'),
+                              relative_precision: float = 0.05, confidence: float = 0.95,
+                              min_replications: int = 10, max_replications: int = 1000,
+                              time_budget: typing.Optional[float] = None, batch_size: typing.Optional[int] = None,
+                              seed=None, max_workers: typing.Optional[int] = None) -> AdaptiveResult:
+    """
+    Runs replications in parallel batches until the confidence interval of the mean of every output is narrow enough,
+    instead of running a fixed number of them. After each batch the running mean and variance of each output are
+    updated, and the runner stops once every half-width is at most relative_precision times the absolute mean, or
+    once the time budget or max_replications is used up.
+
+    Replication i gets the same seed as in run_replications, so the replications run are the first ones
+    run_replications would run for the same seed.
+
+    :param build: as for run_replications
+    :param horizon: simulation time at which each run stops
+    :param outputs: fields of ReplicationSummary to estimate
+    :param relative_precision: target half-width relative to the mean
+    :param confidence: confidence level of the intervals
+    :param min_replications: replications to run before the stopping rule is checked; at least 2
+    :param max_replications: replications after which the runner stops regardless
+    :param time_budget: seconds after which no new batch is started
+    :param batch_size: replications per batch; by default the number of workers
+    :param seed: root seed; replication streams are spawned from it
+    :param max_workers: number of worker processes. 1 runs everything in this process.
+    """
+    for output in outputs:
+        if output not in ReplicationSummary._fields or output == 'replication':
+            raise RuntimeError("Unknown replication output {}.".format(output))
+    if batch_size is None:
+        batch_size = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    min_replications = max(min_replications, 2)
+    root_seed = numpy.random.SeedSequence(seed)
+    statistics = {output: RunningStatistics() for output in outputs}
+    summaries = []
+    start = time.monotonic()
+
+    def converged() -> bool:
+        if len(summaries) < min_replications:
+            return False
+        return all(s.half_width(confidence) <= relative_precision * abs(s.mean) for s in statistics.values())
+
+    def out_of_budget() -> bool:
+        return time_budget is not None and time.monotonic() - start >= time_budget
+
+    executor = None if max_workers == 1 else concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        while not converged() and len(summaries) < max_replications and not out_of_budget():
+            size = min(batch_size, max_replications - len(summaries))
+            if len(summaries) < min_replications:
+                size = max(size, min(min_replications, max_replications) - len(summaries))
+            # Spawning from the same root continues its sequence of children, as in replication_seeds.
+            seeds = root_seed.spawn(size)
+            indices = range(len(summaries), len(summaries) + size)
+            if executor is None:
+                batch = [run_replication(build, horizon, i, s) for i, s in zip(indices, seeds)]
+            else:
+                batch = list(executor.map(run_replication, itertools.repeat(build), itertools.repeat(horizon),
+                                          indices, seeds))
+            for summary in batch:
+                summaries.append(summary)
+                for output, s in statistics.items():
+                    s.add(getattr(summary, output))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return AdaptiveResult(summaries=summaries, means={o: s.mean for o, s in statistics.items()},
+                          half_widths={o: s.half_width(confidence) for o, s in statistics.items()},
+                          converged=converged(), elapsed=time.monotonic() - start)
+
+
+class Branch(typing.NamedTuple):
+    """
+    One continuation of a snapshot: the policy to continue under and, optionally, a seed that replaces the model's
+    random streams (see HospitalModelImpl.reseed). Without a seed, every branch continues from the random state in the
+    snapshot, so branches that differ only in policy are compared on common random numbers.
+    """
+    policy: framework.HospitalPolicy
+    seed: typing.Optional[typing.Union[int, numpy.random.SeedSequence]] = None
+
+
+def run_to_snapshot(setup: SimulationSetup, time: float) -> framework.SimulationSnapshot:
+    """
+    Runs a setup until time with a SummaryLogger and snapshots it. The logger is part of the snapshot, so the
+    summaries of its branches cover the whole run, not just the part after the snapshot.
+    """
+    simulation = framework.ICUSimulation(hospital_state=setup.hospital_state, logger=implement.SummaryLogger(),
+                                         policy=setup.policy, model=setup.model)
+    simulation.start()
+    simulation.run(time)
+    return simulation.snapshot(include_logger=True)
+
+
+def run_branch(snapshot: framework.SimulationSnapshot, branch: Branch, horizon: float,
+               index: int) -> ReplicationSummary:
+    """
+    Continues a snapshot under one branch until horizon and summarizes the run.
+
+    :param snapshot: a snapshot whose logger is a SummaryLogger, e.g. from run_to_snapshot
+    :param index: index of the branch, recorded as the replication of the summary
+    """
+    if not isinstance(snapshot.logger, implement.SummaryLogger):
+        raise RuntimeError("Branches can only be summarized from a snapshot that includes a SummaryLogger.")
+    simulation = framework.ICUSimulation.resume(snapshot, policy=branch.policy)
+    if branch.seed is not None:
+        if not hasattr(simulation.model, 'reseed'):
+            raise RuntimeError("The model of this snapshot cannot be reseeded.")
+        simulation.model.reseed(branch.seed)
+    simulation.run(horizon)
+    return summarize(simulation.logger, index)
+
+
+# The snapshot shared by the branches run in a worker process; set once per worker by _set_worker_snapshot.
+_worker_snapshot: typing.Optional[framework.SimulationSnapshot] = None
+
+
+def _set_worker_snapshot(snapshot: framework.SimulationSnapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def _run_worker_branch(branch: Branch, horizon: float, index: int) -> ReplicationSummary:
+    return run_branch(_worker_snapshot, branch, horizon, index)
+
+
+def run_branches(snapshot: framework.SimulationSnapshot, branches: typing.Sequence[Branch], horizon: float,
+                 max_workers: typing.Optional[int] = None) -> typing.List[ReplicationSummary]:
+    """
+    Runs every branch from the same snapshot across a process pool. The common prefix is simulated once, and the
+    snapshot is sent to each worker once rather than with every branch.
+
+    :param snapshot: a snapshot whose logger is a SummaryLogger, e.g. from run_to_snapshot. It must be picklable unless
+        max_workers is 1.
+    :param branches: the continuations to run
+    :param horizon: simulation time at which each branch stops
+    :param max_workers: number of worker processes. 1 runs everything in this process.
+    :return: one summary per branch, in the order of branches
+    """
+    if max_workers == 1:
+        return [run_branch(snapshot, b, horizon, i) for i, b in enumerate(branches)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_set_worker_snapshot,
+                                                initargs=(snapshot,)) as executor:
+        return list(executor.map(_run_worker_branch, branches, itertools.repeat(horizon), range(len(branches))))
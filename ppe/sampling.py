@@ -0,0 +1,234 @@
+import enum
+import math
+import typing
+import numpy
+
+
+@enum.unique
+class SamplingMode(enum.Enum):
+    """
+    Controls how HospitalModelImpl draws its random variates.
+
+    LEGACY draws every variate one at a time from a single RandomState, reproducing the original sequence exactly.
+    BUFFERED draws each stream (severity, interarrival, stay length, ICU outcome, non-ICU outcome) in vectorized
+    blocks from its own substream of the seed. BUFFERED runs are reproducible for a given seed, but they do not
+    reproduce the LEGACY sequence.
+    COMMON_RANDOM_NUMBERS also draws each stream in vectorized blocks, but indexes the variates by patient id: patient
+    k gets the same severity, interarrival time, stay length and outcome draws whatever happened to the other
+    patients. Runs with the same seed under different policies are then compared on common random numbers.
+    """
+    LEGACY = enum.auto()
+    BUFFERED = enum.auto()
+    COMMON_RANDOM_NUMBERS = enum.auto()
+
+
+DEFAULT_BUFFER_SIZE = 4096
+
+# Spawn keys of fixed substreams. They are far above the number of children spawn_random_states creates, so they
+# never coincide with those.
+TRANSMISSION_STREAM = 2 ** 31
+ARRIVAL_STREAM = 2 ** 31 + 1
+COMMON_RANDOM_NUMBERS_STREAM = 2 ** 31 + 2
+
+
+class VariateBuffer:
+    """
+    Serves variates one at a time from blocks produced by a vectorized draw function, refilling when the block is
+    exhausted.
+    """
+    _draw: typing.Callable[[int], numpy.ndarray]
+    _block_size: int
+    _block: typing.List
+    _position: int
+
+    def __init__(self, draw: typing.Callable[[int], numpy.ndarray], block_size: int = DEFAULT_BUFFER_SIZE):
+        """
+        :param draw: function taking a size and returning that many variates
+        :param block_size: number of variates drawn per refill
+        """
+        if block_size < 1:
+            raise RuntimeError("Buffer block size must be positive.")
+        self._draw = draw
+        self._block_size = block_size
+        self._block = []
+        self._position = 0
+
+    def next(self):
+        if self._position >= len(self._block):
+            # tolist() converts to python scalars, which are much cheaper to index and do arithmetic on.
+            self._block = self._draw(self._block_size).tolist()
+            self._position = 0
+        value = self._block[self._position]
+        self._position += 1
+        return value
+
+
+class IndexedVariates:
+    """
+    Variates addressed by a nonnegative index, such as a patient id. Variate k depends only on the seed, the stream
+    key and k, not on which other variates were used or in what order. Variates are drawn in vectorized blocks of
+    block_size consecutive indices, each block from its own substream of the seed.
+    """
+    _seed: numpy.random.SeedSequence
+    _key: typing.Tuple[int, ...]
+    _draw: typing.Callable[[numpy.random.RandomState, int], numpy.ndarray]
+    _block_size: int
+    _blocks: typing.Dict[int, typing.List]  # the most recently used blocks, least recently used first
+    _last_block: typing.Optional[int]
+
+    _MAX_BLOCKS = 4
+
+    def __init__(self, seed: numpy.random.SeedSequence, key: typing.Tuple[int, ...],
+                 draw: typing.Callable[[numpy.random.RandomState, int], numpy.ndarray],
+                 block_size: int = DEFAULT_BUFFER_SIZE):
+        """
+        :param seed: the seed shared by all streams
+        :param key: identifies this stream among the streams of the seed
+        :param draw: function taking a RandomState and a size and returning that many variates, e.g.
+            numpy.random.RandomState.random_sample
+        :param block_size: number of consecutive indices drawn at once
+        """
+        if block_size < 1:
+            raise RuntimeError("Block size must be positive.")
+        self._seed = seed
+        self._key = tuple(key)
+        self._draw = draw
+        self._block_size = block_size
+        self._blocks = {}
+        self._last_block = None
+
+    def get(self, index: int):
+        block, position = divmod(index, self._block_size)
+        values = self._blocks.get(block)
+        if values is None:
+            if index < 0:
+                raise RuntimeError("Indexed variates require a nonnegative index.")
+            seed = numpy.random.SeedSequence(self._seed.entropy, spawn_key=tuple(self._seed.spawn_key) + self._key
+                                             + (block,), pool_size=self._seed.pool_size)
+            values = self._draw(numpy.random.RandomState(numpy.random.MT19937(seed)), self._block_size).tolist()
+            if len(self._blocks) >= self._MAX_BLOCKS:
+                del self._blocks[next(iter(self._blocks))]
+            self._blocks[block] = values
+        elif block != self._last_block:
+            # Move the block to the end; most draws reuse the last block, which is already there.
+            del self._blocks[block]
+            self._blocks[block] = values
+        self._last_block = block
+        return values[position]
+
+
+def make_random_state(seed) -> numpy.random.RandomState:
+    """
+    Creates a RandomState from an int seed, None, a numpy SeedSequence, or returns an existing RandomState unchanged.
+    """
+    if isinstance(seed, numpy.random.RandomState):
+        return seed
+    if isinstance(seed, numpy.random.SeedSequence):
+        return numpy.random.RandomState(numpy.random.MT19937(seed))
+    return numpy.random.RandomState(seed=seed)
+
+
+def spawn_random_states(seed, n: int) -> typing.List[numpy.random.RandomState]:
+    """
+    Creates n statistically independent RandomState objects derived from a single seed.
+
+    :param seed: anything accepted by numpy.random.SeedSequence (including None or an existing SeedSequence)
+    :param n: number of random states
+    """
+    if not isinstance(seed, numpy.random.SeedSequence):
+        seed = numpy.random.SeedSequence(seed)
+    return [numpy.random.RandomState(numpy.random.MT19937(child)) for child in seed.spawn(n)]
+
+
+def substream_random_state(seed, stream: int) -> numpy.random.RandomState:
+    """
+    Creates a RandomState for a fixed, numbered substream of a seed, e.g. TRANSMISSION_STREAM. An existing RandomState
+    is returned unchanged, so the substream then shares its sequence.
+
+    :param seed: anything accepted by numpy.random.SeedSequence (including None or an existing SeedSequence), or a
+        RandomState
+    :param stream: the substream number
+    """
+    if isinstance(seed, numpy.random.RandomState):
+        return seed
+    if not isinstance(seed, numpy.random.SeedSequence):
+        seed = numpy.random.SeedSequence(seed)
+    child = numpy.random.SeedSequence(seed.entropy, spawn_key=tuple(seed.spawn_key) + (stream,),
+                                      pool_size=seed.pool_size)
+    return numpy.random.RandomState(numpy.random.MT19937(child))
+
+
+# Stay length distributions that need only numpy. They draw the same variates as the frozen scipy.stats distributions
+# they stand in for, given the same random state, and provide the rvs, cdf and ppf methods that HospitalModelImpl and
+# FluidModel use, so models built from them never import scipy.
+
+class Exponential(typing.NamedTuple):
+    """
+    The exponential distribution with the given mean, in place of scipy.stats.expon(scale=scale). rvs draws the same
+    variates as the scipy distribution from the same random state, and cdf and ppf agree with scipy's at every
+    argument: ppf(0) is 0, ppf(1) is inf, and arguments outside [0, 1] or nan give nan.
+    """
+    scale: float
+
+    def rvs(self, size=None, random_state=None) -> numpy.ndarray:
+        return self.scale * make_random_state(random_state).standard_exponential(size)
+
+    def cdf(self, x) -> numpy.ndarray:
+        x = numpy.asarray(x, dtype=float)
+        with numpy.errstate(invalid='ignore'):
+            cdf = numpy.where(x > 0, -numpy.expm1(-numpy.maximum(x, 0) / self.scale), 0.0)
+        return numpy.where(numpy.isnan(x), numpy.nan, cdf)[()]
+
+    def ppf(self, q) -> numpy.ndarray:
+        q = numpy.asarray(q, dtype=float)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            quantiles = -self.scale * numpy.log1p(-q)
+        return numpy.where((q >= 0) & (q <= 1), quantiles, numpy.nan)[()]
+
+
+class Poisson(typing.NamedTuple):
+    """
+    The Poisson distribution with mean mu, in place of scipy.stats.poisson(mu=mu). rvs draws the same variates as the
+    scipy distribution from the same random state. cdf and ppf agree with scipy's up to the rounding of summing the
+    pmf, including at the boundaries: cdf is 0 below 0 and 1 at inf, ppf(0) is -1, ppf(1) is inf, and arguments
+    outside [0, 1] or nan give nan.
+    """
+    mu: float
+
+    def rvs(self, size=None, random_state=None) -> numpy.ndarray:
+        return make_random_state(random_state).poisson(self.mu, size)
+
+    def _tail_bound(self) -> int:
+        """
+        A count far enough into the upper tail that the cdf there is 1 to double precision.
+        """
+        return int(math.ceil(self.mu + 40 * math.sqrt(self.mu) + 40))
+
+    def _cdf_table(self, k: int) -> numpy.ndarray:
+        """
+        The cdf at 0, 1, ..., k, summing the pmf computed in log space.
+        """
+        if self.mu <= 0:
+            return numpy.ones(k + 1)
+        counts = numpy.arange(k + 1, dtype=float)
+        log_factorials = numpy.concatenate(([0.0], numpy.cumsum(numpy.log(counts[1:]))))
+        log_pmf = counts * math.log(self.mu) - self.mu - log_factorials
+        return numpy.minimum(numpy.cumsum(numpy.exp(log_pmf)), 1.0)
+
+    def cdf(self, x) -> numpy.ndarray:
+        k = numpy.floor(numpy.asarray(x, dtype=float))
+        cdf = numpy.where(numpy.isnan(k), numpy.nan, numpy.where(k < 0, 0.0, 1.0))
+        # Beyond the tail bound the cdf stays 1, so the table never needs to be longer than it, however large x is.
+        counted = numpy.isfinite(k) & (k >= 0) & (k <= self._tail_bound())
+        if counted.any():
+            table = self._cdf_table(int(numpy.max(k[counted])))
+            cdf[counted] = table[k[counted].astype(int)]
+        return cdf[()]
+
+    def ppf(self, q) -> numpy.ndarray:
+        q = numpy.asarray(q, dtype=float)
+        # The table covers any quantile short of 1.
+        table = self._cdf_table(self._tail_bound())
+        quantiles = numpy.searchsorted(table, numpy.where(numpy.isnan(q), 0, q), side='left').astype(float)
+        quantiles = numpy.where(q >= 1, numpy.inf, numpy.where(q <= 0, -1.0, quantiles))
+        return numpy.where((q >= 0) & (q <= 1), quantiles, numpy.nan)[()]
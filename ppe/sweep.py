@@ -0,0 +1,218 @@
+import concurrent.futures
+import csv
+import functools
+import itertools
+import os
+import typing
+import numpy
+from . import arrivals
+from . import cache as result_cache
+from . import demand as demand_store
+from . import framework
+from . import replication
+
+
+class DemandColumn(typing.NamedTuple):
+    path: str
+    column: str
+
+
+class SweepCell(typing.NamedTuple):
+    """
+    One point of a sweep: a demand scenario, a policy (which carries its capacity parameters) and a seed.
+    """
+    demand: DemandColumn
+    policy: framework.HospitalPolicy
+    seed: int
+
+    def key(self, settings: str) -> str:
+        """
+        Identifies the cell in results tables: a hash of the values of its demand column, its policy's parameters
+        (see policy_parameters), its seed and the settings of the sweep it is run in. Cells with the same demand data
+        match wherever the file is, and results tables stay resumable when policies gain fields with defaults.
+
+        :param settings: the sweep_settings of the run_sweep call
+        """
+        return result_cache.content_hash('sweep cell', _demand_digest(self.demand.path, self.demand.column),
+                                         policy_parameters(self.policy), self.seed, settings)
+
+
+def sweep_settings(template: replication.ICUScenario, horizon: float, demand_scale: float = 1.0) -> str:
+    """
+    A hash of what run_sweep shares between cells: the model parameters and sampling mode of the template, the
+    horizon and the demand scale. A results table written with other settings has no rows for these cells.
+    """
+    return result_cache.content_hash('sweep settings', template._replace(daily_rates=(), policy=None), float(horizon),
+                                     float(demand_scale))
+
+
+def policy_parameters(policy: framework.HospitalPolicy):
+    """
+    The type of a policy and the fields it sets to other than their defaults, or the policy itself if it is not a
+    NamedTuple.
+    """
+    if not hasattr(policy, '_fields'):
+        return policy
+    defaults = getattr(policy, '_field_defaults', {})
+    return {'type': type(policy).__qualname__,
+            'fields': {f: getattr(policy, f) for f in policy._fields
+                       if f not in defaults or getattr(policy, f) != defaults[f]}}
+
+
+def _demand_digest(path: str, column: str) -> str:
+    status = os.stat(path)
+    return _column_digest(os.path.abspath(path), column, status.st_mtime_ns, status.st_size)
+
+
+@functools.lru_cache(maxsize=None)
+def _column_digest(path: str, column: str, modified: int, size: int) -> str:
+    # modified and size are part of the cache key only, so that a changed file is read again.
+    return result_cache.content_hash(arrivals.read_demand_column(path, column))
+
+
+SUMMARY_FIELDS = [f for f in replication.ReplicationSummary._fields if f != 'replication']
+
+
+def demand_columns(path: str, columns: typing.Optional[typing.Iterable[str]] = None) -> typing.List[DemandColumn]:
+    """
+    Lists the scenario columns of a demand file.
+
+    :param path: path to the demand csv
+    :param columns: if given, only these columns are used
+    """
+    if columns is None:
+        with open(path, newline='', encoding='utf-8-sig') as demand_file:
+            columns = next(csv.reader(demand_file))
+    return [DemandColumn(path=path, column=c) for c in columns]
+
+
+def policy_grid(policy_type: typing.Callable[..., framework.HospitalPolicy],
+                **parameter_values: typing.Iterable) -> typing.List[framework.HospitalPolicy]:
+    """
+    Creates one policy for every combination of parameter values, e.g.
+    policy_grid(FirstComeFirstServedPolicy, max_beds=[150, 180], max_ventilators=[100, 150]).
+    """
+    names = list(parameter_values.keys())
+    return [policy_type(**dict(zip(names, values)))
+            for values in itertools.product(*(parameter_values[n] for n in names))]
+
+
+def sweep_cells(demands: typing.Iterable[DemandColumn], policies: typing.Iterable[framework.HospitalPolicy],
+                seeds: typing.Iterable[int]) -> typing.List[SweepCell]:
+    return [SweepCell(demand=d, policy=p, seed=s) for d, p, s in itertools.product(demands, policies, seeds)]
+
+
+def completed_cells(results_path: str) -> typing.Set[str]:
+    """
+    Returns the keys of cells already recorded in a results table.
+    """
+    if not os.path.isfile(results_path):
+        return set()
+    with open(results_path, newline='') as results_file:
+        return {row['cell'] for row in csv.DictReader(results_file)}
+
+
+def _policy_fields(policies: typing.Iterable[framework.HospitalPolicy]) -> typing.List[str]:
+    fields = []
+    for policy in policies:
+        for f in getattr(policy, '_fields', ()):
+            if f not in fields:
+                fields.append(f)
+    return fields
+
+
+def _run_cell(template: replication.ICUScenario, daily_rates: typing.Tuple[float, ...], cell: SweepCell,
+              horizon: float,
+              cache: typing.Optional[result_cache.ResultCache] = None) -> replication.ReplicationSummary:
+    scenario = template._replace(daily_rates=daily_rates, policy=cell.policy)
+    return result_cache.cached_replication(cache, scenario, horizon, index=cell.seed,
+                                           seed=numpy.random.SeedSequence(cell.seed))
+
+
+def _cell_rates(store: demand_store.DemandStore, demand: DemandColumn,
+                demand_scale: float) -> typing.Tuple[float, ...]:
+    return tuple((store.column(demand.path, demand.column) * demand_scale).tolist())
+
+
+def _run_worker_cell(template: replication.ICUScenario, cell: SweepCell, horizon: float, demand_scale: float,
+                     cache: typing.Optional[result_cache.ResultCache] = None) -> replication.ReplicationSummary:
+    rates = _cell_rates(demand_store.worker_store(), cell.demand, demand_scale)
+    return _run_cell(template, rates, cell, horizon, cache)
+
+
+def run_sweep(template: replication.ICUScenario, cells: typing.Sequence[SweepCell], horizon: float,
+              results_path: str, demand_scale: float = 1.0, max_workers: typing.Optional[int] = None,
+              cache: typing.Optional[result_cache.ResultCache] = None,
+              demands: typing.Optional[demand_store.DemandStore] = None) -> int:
+    """
+    Runs every cell of a sweep and appends one row per cell to a tidy csv results table as cells finish.
+
+    Cells whose key is already in the results table are skipped, so an interrupted sweep resumes where it stopped.
+    Keys include the template, horizon and demand scale (see sweep_settings), so changing any of them reruns the
+    cells.
+    The same seed gives the same random streams in every cell. With the template's sampling_mode set to
+    COMMON_RANDOM_NUMBERS, the draws also stay matched patient by patient, so cells differing only in policy are
+    compared on common random numbers.
+
+    :param template: model parameters shared by all cells; its daily_rates and policy are replaced per cell
+    :param cells: the cells to run, e.g. from sweep_cells
+    :param horizon: simulation time at which each run stops
+    :param results_path: csv file that results are appended to
+    :param demand_scale: multiplier applied to the demand columns to get arrival rates per period
+    :param max_workers: number of worker processes. 1 runs everything in this process.
+    :param cache: if given, cells whose exact run (demand data, policy, model, seed, horizon and code version) is in
+        the cache are not simulated again, and new results are added to it
+    :param demands: a store holding the demand columns of the cells, e.g. one loaded from a saved store. By default
+        the demand files of the pending cells are parsed into a new one. Worker processes attach to a shared memory
+        copy of it instead of receiving the rates with every cell.
+    :return: the number of cells run (excluding skipped cells)
+    """
+    settings = sweep_settings(template, horizon, demand_scale)
+    done = completed_cells(results_path)
+    pending = [c for c in cells if c.key(settings) not in done]
+    if not pending:
+        return 0
+
+    policy_fields = _policy_fields(c.policy for c in cells)
+    fieldnames = ['cell', 'demand_file', 'demand_column', 'policy'] + policy_fields + ['seed'] + SUMMARY_FIELDS
+    if os.path.isfile(results_path):
+        with open(results_path, newline='') as results_file:
+            existing_fields = next(csv.reader(results_file), None)
+        if existing_fields is not None:
+            if not set(fieldnames).issubset(existing_fields):
+                raise RuntimeError("Results table {} has different columns than this sweep.".format(results_path))
+            fieldnames = existing_fields
+    write_header = not os.path.isfile(results_path) or os.path.getsize(results_path) == 0
+
+    if demands is None:
+        paths = list(dict.fromkeys(c.demand.path for c in pending))
+        demands = demand_store.DemandStore.from_files(paths, columns={c.demand.column for c in pending})
+
+    with open(results_path, 'a', newline='') as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=fieldnames, lineterminator='\n')
+        if write_header:
+            writer.writeheader()
+
+        def write_result(cell: SweepCell, summary: replication.ReplicationSummary):
+            row = {'cell': cell.key(settings), 'demand_file': os.path.basename(cell.demand.path),
+                   'demand_column': cell.demand.column, 'policy': type(cell.policy).__name__, 'seed': cell.seed}
+            row.update(getattr(cell.policy, '_asdict', dict)())
+            row.update({f: getattr(summary, f) for f in SUMMARY_FIELDS})
+            writer.writerow(row)
+            results_file.flush()
+
+        if max_workers == 1:
+            rates = {}
+            for cell in pending:
+                if cell.demand not in rates:
+                    rates[cell.demand] = _cell_rates(demands, cell.demand, demand_scale)
+                write_result(cell, _run_cell(template, rates[cell.demand], cell, horizon, cache))
+            return len(pending)
+
+        with demand_store.share_store(demands) as shared, concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers, initializer=demand_store.attach_worker_store, initargs=(shared,)) as executor:
+            futures = {executor.submit(_run_worker_cell, template, cell, horizon, demand_scale, cache): cell
+                       for cell in pending}
+            for future in concurrent.futures.as_completed(futures):
+                write_result(futures[future], future.result())
+    return len(pending)
@@ -0,0 +1,164 @@
+import concurrent.futures
+import itertools
+import typing
+from multiprocessing import shared_memory
+import numpy
+from . import framework
+from . import implement
+from . import replication
+
+# One record per patient. Severities are stored by their InfectionSeverity value. Stay lengths are floats, which hold
+# both continuous stays and integer stays (exactly, below 2 ** 53) as the model drew them.
+STREAM_DTYPE = numpy.dtype([('pid', numpy.int64), ('arrival_time', numpy.int64), ('severity', numpy.int8),
+                            ('stay_length', numpy.float64), ('icu_dies', numpy.bool_), ('noicu_dies', numpy.bool_)])
+
+
+class ExogenousStream(typing.NamedTuple):
+    """
+    Everything about the patients of a run that does not depend on the policy: arrival times, severities, stay
+    lengths, and the outcomes both with and without ICU care, drawn once for a seed.
+    """
+    records: numpy.ndarray  # of STREAM_DTYPE, in arrival order with consecutive pids
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+def generate_stream(scenario: replication.ICUScenario, horizon: float, seed) -> ExogenousStream:
+    """
+    Draws the exogenous stream of every patient arriving before horizon from the model of scenario.build(seed).
+
+    With the scenario's sampling_mode set to COMMON_RANDOM_NUMBERS, each patient's draws are the ones run_replication
+    would use for them under any policy, so evaluating a policy on the stream gives the same summary as
+    run_replication of the scenario with that policy. In the other modes the draws of a run depend on the order in
+    which its policy asks for them, so the stream is a sample of the same distribution but not those runs' draws.
+    """
+    model = scenario.build(seed).model
+    rows = []
+    while True:
+        try:
+            arrival = model.generate_next_arrival()
+        except StopIteration:
+            break
+        if arrival.arrival_time >= horizon:
+            break
+        patient, status = arrival.patient, arrival.status
+        rows.append((patient.pid, arrival.arrival_time, status.covid_severity.value,
+                     model.generate_stay_length(patient=patient, status=status),
+                     model.generate_icu_outcome(patient=patient, status=status) == framework.Outcome.DIES,
+                     model.generate_noicu_outcome(patient=patient, status=status) == framework.Outcome.DIES))
+    records = numpy.array(rows, dtype=STREAM_DTYPE)
+    if len(records) > 0 and numpy.any(numpy.diff(records['pid']) != 1):
+        raise RuntimeError("The model of this scenario does not number its patients consecutively.")
+    return ExogenousStream(records=records)
+
+
+class ReplayModel(framework.HospitalModel):
+    """
+    A model that replays an exogenous stream instead of drawing. The stream is only read, so any number of replays
+    can share it. Patients share their status object, which policies and states only read.
+    """
+    _arrivals: typing.Iterator[framework.PatientArrival]
+    _first_pid: int
+    _stay_lengths: typing.List[typing.Union[int, float]]
+    _icu_outcomes: typing.List[framework.Outcome]
+    _noicu_outcomes: typing.List[framework.Outcome]
+
+    def __init__(self, stream: ExogenousStream):
+        records = stream.records
+        # Indexing the structured array once per draw is slower than the draws themselves; python lists are not.
+        severities = {v: framework.PatientStatus(covid_severity=framework.InfectionSeverity(v))
+                      for v in numpy.unique(records['severity']).tolist()}
+        self._arrivals = iter([framework.PatientArrival(arrival_time=t, patient=framework.PatientInfo(pid),
+                                                        status=severities[v])
+                               for pid, t, v in zip(records['pid'].tolist(), records['arrival_time'].tolist(),
+                                                    records['severity'].tolist())])
+        self._first_pid = int(records['pid'][0]) if len(records) > 0 else 0
+        stays = records['stay_length']
+        # Integer stays, e.g. from a Poisson distribution, are replayed as the ints the model returned.
+        self._stay_lengths = (stays.astype(numpy.int64) if numpy.all(stays == numpy.floor(stays)) else stays).tolist()
+        outcomes = (framework.Outcome.LIVES, framework.Outcome.DIES)
+        self._icu_outcomes = [outcomes[d] for d in records['icu_dies'].tolist()]
+        self._noicu_outcomes = [outcomes[d] for d in records['noicu_dies'].tolist()]
+
+    def generate_next_arrival(self) -> framework.PatientArrival:
+        return next(self._arrivals)
+
+    def generate_stay_length(self, patient: framework.PatientInfo, status: framework.PatientStatus) -> int:
+        return self._stay_lengths[patient.pid - self._first_pid]
+
+    def generate_icu_outcome(self, patient: framework.PatientInfo,
+                             status: framework.PatientStatus) -> framework.Outcome:
+        return self._icu_outcomes[patient.pid - self._first_pid]
+
+    def generate_noicu_outcome(self, patient: framework.PatientInfo,
+                               status: framework.PatientStatus) -> framework.Outcome:
+        return self._noicu_outcomes[patient.pid - self._first_pid]
+
+    def models_transmission(self) -> bool:
+        return False
+
+
+def evaluate_policy(stream: ExogenousStream, policy: framework.HospitalPolicy, horizon: float,
+                    index: int = 0) -> replication.ReplicationSummary:
+    """
+    Runs an empty unstaffed ICU under policy on the patients of stream until horizon and summarizes the run.
+
+    :param index: recorded as the replication of the summary
+    """
+    logger = implement.SummaryLogger()
+    framework.run_icu(hospital_state=implement.HospitalStateImpl(existing_patients={}, bedusers=set(),
+                                                                 ventusers=set()),
+                      logger=logger, policy=policy, model=ReplayModel(stream), until=horizon)
+    return replication.summarize(logger, index)
+
+
+# The stream shared by the policies evaluated in a worker process; attached once per worker by _attach_worker_stream.
+_worker_memory: typing.Optional[shared_memory.SharedMemory] = None
+_worker_stream: typing.Optional[ExogenousStream] = None
+
+
+def _attach_worker_stream(name: str, length: int):
+    global _worker_memory, _worker_stream
+    _worker_memory = shared_memory.SharedMemory(name=name)
+    records = numpy.ndarray((length,), dtype=STREAM_DTYPE, buffer=_worker_memory.buf)
+    records.flags.writeable = False
+    _worker_stream = ExogenousStream(records=records)
+
+
+def _evaluate_worker_policy(policy: framework.HospitalPolicy, horizon: float,
+                            index: int) -> replication.ReplicationSummary:
+    return evaluate_policy(_worker_stream, policy, horizon, index)
+
+
+def evaluate_policies(stream: ExogenousStream, policies: typing.Sequence[framework.HospitalPolicy], horizon: float,
+                      max_workers: typing.Optional[int] = None) -> typing.List[replication.ReplicationSummary]:
+    """
+    Evaluates every policy on the same patients. The stream is drawn once; with several workers it is placed in one
+    shared memory block that every worker maps, instead of being pickled for each policy.
+
+    :param max_workers: number of worker processes. 1 evaluates the policies one after another in this process.
+    :return: one summary per policy, in the order of policies, with the policy's index as the replication
+    """
+    if max_workers == 1 or len(stream) == 0:
+        return [evaluate_policy(stream, p, horizon, i) for i, p in enumerate(policies)]
+
+    memory = shared_memory.SharedMemory(create=True, size=stream.records.nbytes)
+    try:
+        numpy.ndarray(stream.records.shape, dtype=STREAM_DTYPE, buffer=memory.buf)[:] = stream.records
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_attach_worker_stream,
+                                                    initargs=(memory.name, len(stream))) as executor:
+            return list(executor.map(_evaluate_worker_policy, policies, itertools.repeat(horizon),
+                                     range(len(policies))))
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def compare_policies(scenario: replication.ICUScenario, policies: typing.Sequence[framework.HospitalPolicy],
+                     horizon: float, seed,
+                     max_workers: typing.Optional[int] = None) -> typing.List[replication.ReplicationSummary]:
+    """
+    generate_stream for the scenario and seed, then evaluate_policies on it; the scenario's own policy is not used.
+    """
+    return evaluate_policies(generate_stream(scenario, horizon, seed), policies, horizon, max_workers=max_workers)
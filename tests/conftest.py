@@ -0,0 +1,37 @@
+import os
+import pytest
+from ppe import arrivals
+from ppe import framework
+from ppe import implement
+from ppe import replication
+from ppe import sampling
+
+MINUTES_PER_DAY = 60 * 24
+RESOURCE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'resources'))
+SEVERE = framework.InfectionSeverity.SEVERE
+REQ_VENT = framework.InfectionSeverity.REQ_VENT
+
+
+def demand_rates(column: str = 'T_600', days: int = 40, scale: float = 0.2):
+    rates = arrivals.read_demand_column(os.path.join(RESOURCE_DIR, 'demands_3_24.csv'), column)[:days] * scale
+    return tuple(rates.tolist())
+
+
+def icu_scenario(sampling_mode: sampling.SamplingMode = sampling.SamplingMode.LEGACY,
+                 policy: framework.HospitalPolicy = None) -> replication.ICUScenario:
+    """
+    A small ICU with two severities that fills up within a few weeks of the T_600 demand column.
+    """
+    return replication.ICUScenario(
+        icu_survivalprobs={SEVERE: 0.8, REQ_VENT: 0.5}, noicu_survivalprobs={SEVERE: 0.4, REQ_VENT: 0.05},
+        severity_dist={SEVERE: 0.4, REQ_VENT: 0.6},
+        stay_dists={SEVERE: sampling.Poisson(mu=5 * MINUTES_PER_DAY),
+                    REQ_VENT: sampling.Poisson(mu=8 * MINUTES_PER_DAY)},
+        daily_rates=demand_rates(),
+        policy=implement.FirstComeFirstServedPolicy(max_beds=30, max_ventilators=20) if policy is None else policy,
+        period_length=MINUTES_PER_DAY, sampling_mode=sampling_mode)
+
+
+@pytest.fixture(params=list(sampling.SamplingMode), ids=lambda mode: mode.name)
+def sampling_mode(request) -> sampling.SamplingMode:
+    return request.param
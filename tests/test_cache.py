@@ -0,0 +1,74 @@
+import os
+import time
+from ppe import cache
+
+
+def _age(path: str, seconds_ago: float):
+    stamp = time.time() - seconds_ago
+    os.utime(path, (stamp, stamp))
+
+
+def test_values_round_trip_and_are_only_computed_once(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    assert results.get('a') is None and results.get('a', 5) == 5 and 'a' not in results
+    results.put('a', {'beds': [1, 2, 3]})
+    assert 'a' in results and results.get('a') == {'beds': [1, 2, 3]}
+
+    runs = []
+    assert results.get_or_run('b', lambda: runs.append(1) or 'b') == 'b'
+    assert results.get_or_run('b', lambda: runs.append(1) or 'b') == 'b'
+    assert runs == [1] and len(results) == 2
+    results.clear()
+    assert len(results) == 0
+
+
+def test_least_recently_used_entries_are_evicted_by_count(tmp_path):
+    results = cache.ResultCache(str(tmp_path), max_entries=3, evict_interval=1000)
+    for i, key in enumerate('abcde'):
+        results.put(key, key)
+        _age(os.path.join(str(tmp_path), key + '.pkl'), 100 - i)
+    results.get('a')  # a becomes the most recently used
+    results.evict()
+    assert [key for key in 'abcde' if key in results] == ['a', 'd', 'e']
+
+
+def test_least_recently_used_entries_are_evicted_by_size(tmp_path):
+    results = cache.ResultCache(str(tmp_path), evict_interval=1000)
+    for i, key in enumerate('abcd'):
+        results.put(key, bytes(1000))
+        _age(os.path.join(str(tmp_path), key + '.pkl'), 100 - i)
+    entry_size = results.size() // 4
+    limited = cache.ResultCache(str(tmp_path), max_bytes=2 * entry_size + 100, evict_interval=2)
+    limited.put('e', bytes(1000))
+    limited.put('f', b'')  # the second put evicts
+    assert [key for key in 'abcdef' if key in limited] == ['d', 'e', 'f']
+    assert limited.size() <= 2 * entry_size + 100
+
+
+def test_damaged_entries_are_treated_as_missing(tmp_path):
+    results = cache.ResultCache(str(tmp_path))
+    results.put('truncated', list(range(1000)))
+    path = os.path.join(str(tmp_path), 'truncated.pkl')
+    with open(path, 'rb') as entry:
+        data = entry.read()
+    with open(path, 'wb') as entry:
+        entry.write(data[:len(data) // 2])
+    with open(os.path.join(str(tmp_path), 'garbage.pkl'), 'wb') as entry:
+        entry.write(b'\x80\x04not a pickle at all')
+    assert results.get('truncated', 'missing') == 'missing'
+    assert results.get('garbage', 'missing') == 'missing'
+    assert results.get_or_run('truncated', lambda: 'again') == 'again'
+    assert results.get('truncated') == 'again'
+
+
+def test_evict_removes_stale_temporary_files(tmp_path):
+    results = cache.ResultCache(str(tmp_path), temp_max_age=60)
+    results.put('kept', 1)
+    stale, fresh = os.path.join(str(tmp_path), 'stale.tmp'), os.path.join(str(tmp_path), 'fresh.tmp')
+    for path in (stale, fresh):
+        with open(path, 'wb') as temp:
+            temp.write(b'partial')
+    _age(stale, 120)
+    results.evict()
+    assert not os.path.exists(stale) and os.path.exists(fresh)
+    assert results.get('kept') == 1 and len(results) == 1
@@ -0,0 +1,32 @@
+from ppe import cache
+from ppe import checkpoint
+from ppe import implement
+from ppe import replication
+from conftest import MINUTES_PER_DAY, icu_scenario
+
+HORIZON = 35 * MINUTES_PER_DAY
+SEED = 5
+
+
+def test_resumed_runs_give_the_summaries_of_full_runs(tmp_path, sampling_mode):
+    results = cache.ResultCache(str(tmp_path))
+    base = icu_scenario(sampling_mode)
+    late_change = implement.CapacityChange(time=25 * MINUTES_PER_DAY, max_beds=15, max_ventilators=10)
+    changed = base._replace(policy=base.policy._replace(capacity_schedule=(late_change,)))
+    assert checkpoint.find_checkpoint(results, base, HORIZON, SEED) is None
+
+    full = replication.run_replication(base.build, HORIZON, 0, SEED)
+    checkpoint_times = [10 * MINUTES_PER_DAY, 20 * MINUTES_PER_DAY]
+    assert checkpoint.run_incremental(results, base, HORIZON, SEED, checkpoint_times) == full
+
+    # The changed policy behaves like the base one until day 25, so it continues from the day 20 checkpoint.
+    assert checkpoint.find_checkpoint(results, changed, HORIZON, SEED).time == 20 * MINUTES_PER_DAY
+    changed_full = replication.run_replication(changed.build, HORIZON, 0, SEED)
+    assert changed_full != full
+    assert checkpoint.run_incremental(results, changed, HORIZON, SEED) == changed_full
+    assert checkpoint.find_checkpoint(results, changed, HORIZON, SEED).time == HORIZON
+
+    assert checkpoint.find_checkpoint(results, base, HORIZON, SEED).time == HORIZON
+    assert checkpoint.run_incremental(results, base, HORIZON, SEED) == full
+    assert checkpoint.run_incremental(results, base, 15 * MINUTES_PER_DAY, SEED) == \
+        replication.run_replication(base.build, 15 * MINUTES_PER_DAY, 0, SEED)
@@ -0,0 +1,74 @@
+import concurrent.futures
+import csv
+import os
+import numpy
+from ppe import arrivals
+from ppe import demand
+from ppe import implement
+from ppe import sweep
+from conftest import MINUTES_PER_DAY, RESOURCE_DIR, icu_scenario
+
+DEMAND_FILES = [os.path.join(RESOURCE_DIR, name) for name in ('demands_3_24.csv', 'demands_3_25.csv')]
+
+
+def _assert_matches_files(store: demand.DemandStore):
+    assert store.files() == [os.path.basename(path) for path in DEMAND_FILES]
+    for path in DEMAND_FILES:
+        header, _ = arrivals.read_demand_table(path)
+        assert store.columns(path) == header
+        for column in header:
+            numpy.testing.assert_array_equal(store.column(path, column), arrivals.read_demand_column(path, column))
+
+
+def test_store_holds_the_columns_of_the_files():
+    store = demand.DemandStore.from_files(DEMAND_FILES)
+    _assert_matches_files(store)
+    assert not store.column(DEMAND_FILES[0], 'T_600').flags.writeable
+
+    selected = demand.DemandStore.from_files(DEMAND_FILES, columns=['T_600', 'T_1500'])
+    assert selected.columns(DEMAND_FILES[1]) == ['T_600', 'T_1500']
+    numpy.testing.assert_array_equal(selected.column(DEMAND_FILES[1], 'T_1500'),
+                                     store.column(DEMAND_FILES[1], 'T_1500'))
+
+
+def test_saved_store_is_memory_mapped_when_loaded(tmp_path):
+    path = str(tmp_path / 'demands')
+    demand.DemandStore.from_files(DEMAND_FILES).save(path)
+    loaded = demand.DemandStore.load(path)
+    assert isinstance(loaded.column(DEMAND_FILES[0], 'T_600').base, numpy.memmap)
+    _assert_matches_files(loaded)
+
+
+def _worker_column(file: str, column: str):
+    return demand.worker_store().column(file, column).tolist()
+
+
+def test_worker_processes_attach_to_a_shared_store():
+    store = demand.DemandStore.from_files(DEMAND_FILES)
+    with demand.share_store(store) as shared, concurrent.futures.ProcessPoolExecutor(
+            max_workers=2, initializer=demand.attach_worker_store, initargs=(shared,)) as executor:
+        columns = [(path, c) for path in DEMAND_FILES for c in store.columns(path)]
+        values = list(executor.map(_worker_column, *zip(*columns)))
+    assert values == [store.column(path, c).tolist() for path, c in columns]
+
+
+def _sweep_rows(results_path: str):
+    with open(results_path, newline='') as results_file:
+        return sorted(tuple(row.items()) for row in csv.DictReader(results_file))
+
+
+def test_sweep_gives_the_same_table_with_a_loaded_store(tmp_path):
+    policies = sweep.policy_grid(implement.FirstComeFirstServedPolicy, max_beds=[20, 30], max_ventilators=[15])
+    cells = sweep.sweep_cells([sweep.DemandColumn(path, 'T_600') for path in DEMAND_FILES], policies, [0, 1])
+    store_path = str(tmp_path / 'demands')
+    demand.DemandStore.from_files(DEMAND_FILES).save(store_path)
+
+    tables = []
+    for name, demands, max_workers in (('parsed', None, 1), ('loaded', demand.DemandStore.load(store_path), 1),
+                                       ('shared', demand.DemandStore.load(store_path), 2)):
+        results = str(tmp_path / (name + '.csv'))
+        assert sweep.run_sweep(icu_scenario(), cells, 20 * MINUTES_PER_DAY, results, demand_scale=0.2,
+                               max_workers=max_workers, demands=demands) == len(cells)
+        tables.append(_sweep_rows(results))
+    assert len(tables[0]) == len(cells)
+    assert tables[1] == tables[0] and tables[2] == tables[0]
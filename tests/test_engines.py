@@ -0,0 +1,142 @@
+"""
+The engines and loggers that replace one another must give identical event logs on the same seeded run.
+"""
+import io
+import pytest
+import simpy
+from ppe import framework
+from ppe import implement
+from ppe import sampling
+from conftest import MINUTES_PER_DAY, icu_scenario
+
+HORIZON = 30 * MINUTES_PER_DAY
+
+
+def _csv_run(setup, engine: str, until: float = HORIZON):
+    event_file, patient_file = io.StringIO(), io.StringIO()
+    logger = implement.CSVLogger(event_file=event_file, patient_file=patient_file)
+    if engine == 'simpy':
+        env = simpy.Environment()
+        env.process(framework.icu_process(env=env, hospital_state=setup.hospital_state, logger=logger,
+                                          policy=setup.policy, model=setup.model))
+        env.run(until)
+    else:
+        framework.run_loss_system(hospital_state=setup.hospital_state, logger=logger, policy=setup.policy,
+                                  model=setup.model, until=until)
+    return event_file.getvalue(), patient_file.getvalue()
+
+
+def test_heap_engine_matches_simpy(sampling_mode):
+    scenario = icu_scenario(sampling_mode)
+    simpy_log = _csv_run(scenario.build(11), 'simpy')
+    assert simpy_log[0].count('\n') > 500
+    assert _csv_run(scenario.build(11), 'heap') == simpy_log
+
+
+class ScriptedModel(framework.HospitalModel):
+    """
+    Arrivals at given times with given stays, all of whom live, so that exits and arrivals tie.
+    """
+
+    def __init__(self, arrivals, severity=framework.InfectionSeverity.SEVERE):
+        self._arrivals = iter(enumerate(arrivals))
+        self._stays = {}
+        self._severity = severity
+
+    def generate_next_arrival(self) -> framework.PatientArrival:
+        pid, (time, stay) = next(self._arrivals)
+        self._stays[pid] = stay
+        return framework.PatientArrival(arrival_time=time, patient=framework.PatientInfo(pid),
+                                        status=framework.PatientStatus(covid_severity=self._severity))
+
+    def generate_stay_length(self, patient, status) -> int:
+        return self._stays[patient.pid]
+
+    def generate_icu_outcome(self, patient, status) -> framework.Outcome:
+        return framework.Outcome.LIVES
+
+    def generate_noicu_outcome(self, patient, status) -> framework.Outcome:
+        return framework.Outcome.DIES
+
+    def models_transmission(self) -> bool:
+        return False
+
+
+def _scripted_events(engine: str):
+    setup = icu_scenario().build(0)._replace(
+        model=ScriptedModel([(0, 10), (5, 5), (10, 3), (10, 3), (13, 1)]),
+        hospital_state=implement.HospitalStateImpl(existing_patients={}, bedusers=set(), ventusers=set()),
+        policy=implement.FirstComeFirstServedPolicy(max_beds=2, max_ventilators=2))
+    events = _csv_run(setup, engine, until=100)[0].splitlines()[1:]
+    return [tuple(line.split(',')[1:4]) for line in events]
+
+
+def test_ties_are_broken_in_scheduling_order():
+    events = _scripted_events('simpy')
+    # At time 10 the exits of patients 0 and 1, scheduled at 0 and 5, come before the arrivals at 10, so patients 2
+    # and 3 find both beds free. At 13 their exits, scheduled at 10, come before the arrival of patient 4, which was
+    # scheduled when patient 3 was admitted.
+    assert [e for e in events if e[0] in ('10', '13')] == [
+        ('10', 'PatientDischarge', '0'), ('10', 'PatientLive', '0'),
+        ('10', 'PatientDischarge', '1'), ('10', 'PatientLive', '1'),
+        ('10', 'PatientAdmit', '2'), ('10', 'PatientGivenBed', '2'),
+        ('10', 'PatientAdmit', '3'), ('10', 'PatientGivenBed', '3'),
+        ('13', 'PatientDischarge', '2'), ('13', 'PatientLive', '2'),
+        ('13', 'PatientDischarge', '3'), ('13', 'PatientLive', '3'),
+        ('13', 'PatientAdmit', '4'), ('13', 'PatientGivenBed', '4')]
+    assert _scripted_events('heap') == events
+
+
+def test_columnar_logger_converts_to_the_csv_log():
+    scenario = icu_scenario(sampling.SamplingMode.BUFFERED)
+    csv_log = _csv_run(scenario.build(3), 'heap')
+
+    event_file, patient_file = io.BytesIO(), io.BytesIO()
+    logger = implement.ColumnarLogger(event_file, patient_file, chunk_size=500)
+    setup = scenario.build(3)
+    framework.run_icu(hospital_state=setup.hospital_state, logger=logger, policy=setup.policy, model=setup.model,
+                      until=HORIZON)
+    logger.flush()
+    event_file.seek(0)
+    patient_file.seek(0)
+    event_out, patient_out = io.StringIO(), io.StringIO()
+    implement.columnar_to_csv(event_file, event_out, patient_file, patient_out)
+    assert (event_out.getvalue(), patient_out.getvalue()) == csv_log
+
+
+def test_array_hospital_state_matches_hospital_state_impl(sampling_mode):
+    scenario = icu_scenario(sampling_mode)
+    expected = _csv_run(scenario.build(5), 'simpy')
+    for engine in ('simpy', 'heap'):
+        setup = scenario.build(5)._replace(hospital_state=implement.ArrayHospitalState())
+        assert _csv_run(setup, engine) == expected
+
+
+def test_early_discharge_cancels_the_scheduled_exit():
+    hospital = implement.HospitalStateImpl(existing_patients={}, bedusers=set(), ventusers=set())
+    event_file = io.StringIO()
+    # Patient 2 is declined while both beds are taken; patient 3 gets the bed that patient 0 leaves early.
+    simulation = framework.ICUSimulation(
+        hospital_state=hospital, logger=implement.CSVLogger(event_file),
+        policy=implement.FirstComeFirstServedPolicy(max_beds=2, max_ventilators=2),
+        model=ScriptedModel([(0, 100), (5, 50), (20, 10), (40, 100)], framework.InfectionSeverity.REQ_VENT))
+    simulation.start()
+    simulation.run(30)
+    assert (hospital.num_beds_used(), hospital.num_vented(), simulation.discharges.num_pending()) == (2, 2, 2)
+
+    patient = framework.PatientInfo(0)
+    framework.discharge_patient_early(time=30, patient=patient, hospital=hospital, logger=simulation.logger,
+                                      discharges=simulation.discharges, interactions=simulation.interactions)
+    assert simulation.discharges.get_exit_time(patient) is None
+    assert (hospital.num_beds_used(), hospital.num_vented(), simulation.discharges.num_pending()) == (1, 1, 1)
+    with pytest.raises(RuntimeError):
+        framework.discharge_patient_early(time=30, patient=patient, hospital=hospital, logger=simulation.logger,
+                                          discharges=simulation.discharges)
+
+    simulation.run(200)
+    events = [tuple(line.split(',')[1:4]) for line in event_file.getvalue().splitlines()[1:]]
+    assert [e for e in events if e[2] == '0'] == [
+        ('0', 'PatientAdmit', '0'), ('0', 'PatientGivenBed', '0'), ('0', 'PatientGivenVentilator', '0'),
+        ('30', 'PatientDischarge', '0'), ('30', 'PatientLive', '0')]
+    assert ('20', 'PatientDeclined', '2') in events and ('40', 'PatientAdmit', '3') in events
+    assert (hospital.num_beds_used(), hospital.num_vented(), simulation.discharges.num_pending()) == (0, 0, 0)
@@ -0,0 +1,66 @@
+import numpy
+from ppe import fluid
+from ppe import framework
+from ppe import implement
+from ppe import replication
+from conftest import MINUTES_PER_DAY, demand_rates, icu_scenario
+
+HORIZON = 40 * MINUTES_PER_DAY
+
+
+def test_fluid_model_follows_capacity_schedules():
+    scenario = icu_scenario()
+    model = fluid.FluidModel.from_scenario(scenario)
+    steps_per_day = int(MINUTES_PER_DAY / model.step_length())
+    cut = implement.CapacityChange(time=20 * MINUTES_PER_DAY, max_beds=10, max_ventilators=5)
+    scheduled = scenario.policy._replace(capacity_schedule=(cut,))
+
+    beds, ventilators = model.policy_capacity(scheduled, HORIZON)
+    assert beds.shape == ventilators.shape == (1, model.num_steps(HORIZON))
+    assert set(beds[0, :20 * steps_per_day]) == {30} and set(beds[0, 20 * steps_per_day:]) == {10}
+    assert set(ventilators[0, 20 * steps_per_day:]) == {5}
+
+    constant = model.run(scenario.daily_rates, scenario.policy.max_beds, scenario.policy.max_ventilators, HORIZON)
+    cut_run = model.run(scenario.daily_rates, beds, ventilators, HORIZON)
+    numpy.testing.assert_array_equal(cut_run.beds[:, :20 * steps_per_day], constant.beds[:, :20 * steps_per_day])
+    assert cut_run.admissions[0] < constant.admissions[0]
+    # Lowering capacity stops admissions until the census drains below it.
+    assert cut_run.beds[0, -1] <= 10 + 1e-9 < constant.beds[0, -1]
+
+    constant_beds, constant_ventilators = model.policy_capacity(scenario.policy, HORIZON)
+    both = model.run(scenario.daily_rates, numpy.concatenate((beds, constant_beds)),
+                     numpy.concatenate((ventilators, constant_ventilators)), HORIZON)
+    numpy.testing.assert_allclose(both.admissions, [cut_run.admissions[0], constant.admissions[0]])
+
+
+def test_fluid_model_tracks_the_mean_of_an_uncongested_run():
+    # With capacity that is never reached, the ICU is an infinite-server queue, whose mean census the fluid model
+    # computes exactly up to the time step.
+    horizon = 30 * MINUTES_PER_DAY
+    scenario = icu_scenario()._replace(daily_rates=demand_rates(days=30, scale=0.5),
+                                       policy=implement.FirstComeFirstServedPolicy(max_beds=10 ** 6,
+                                                                                   max_ventilators=10 ** 6))
+    model = fluid.FluidModel.from_scenario(scenario)
+    result = model.run(scenario.daily_rates, scenario.policy.max_beds, scenario.policy.max_ventilators, horizon)
+    steps_per_day = int(MINUTES_PER_DAY / model.step_length())
+
+    census = []
+    for seed in replication.replication_seeds(1, 20):
+        setup = scenario.build(seed)
+        logger = implement.DailyMetricsLogger(30, day_length=MINUTES_PER_DAY)
+        framework.run_icu(hospital_state=setup.hospital_state, logger=logger, policy=setup.policy, model=setup.model,
+                          until=horizon)
+        logger.advance_to(horizon)
+        census.append(numpy.stack((logger.daily_mean_beds(), logger.daily_mean_ventilators())))
+    census = numpy.array(census)
+    simulated, standard_error = census.mean(axis=0), census.std(axis=0, ddof=1) / numpy.sqrt(len(census))
+    predicted = numpy.stack((result.beds[0], result.ventilators[0])).reshape(2, 30, steps_per_day).mean(axis=2)
+    assert simulated[0, -1] > 300
+    assert numpy.all(numpy.abs(predicted - simulated) <= 4 * standard_error + 0.02 * simulated)
+
+    rows = fluid.calibration_report([scenario], horizon, num_replications=20,
+                                    outputs=('admissions', 'declines', 'deaths', 'discharges', 'peak_beds'), seed=1,
+                                    max_workers=1)
+    assert all(row.trusted for row in rows)
+    assert all(row.within_interval for row in rows if row.output != 'peak_beds')
+    assert [row.simulated_mean for row in rows if row.output == 'declines'] == [0.0]
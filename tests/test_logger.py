@@ -0,0 +1,98 @@
+import numpy
+from ppe import framework
+from ppe import implement
+from conftest import MINUTES_PER_DAY, icu_scenario
+
+NUM_DAYS = 30
+
+
+class CensusLogger(implement.SummaryLogger):
+    """
+    SummaryLogger that records the bed and ventilator census after every change.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.census = [(0, 0, 0)]
+
+    def _record(self, time: int):
+        self.census.append((time, self.beds_used, self.ventilators_used))
+
+    def log_patient_given_bed(self, time: int, patient: framework.PatientInfo):
+        super().log_patient_given_bed(time=time, patient=patient)
+        self._record(time)
+
+    def log_patient_given_ventilator(self, time: int, patient: framework.PatientInfo):
+        super().log_patient_given_ventilator(time=time, patient=patient)
+        self._record(time)
+
+    def log_patient_outcome(self, time: int, patient: framework.PatientInfo, outcome: framework.Outcome):
+        super().log_patient_outcome(time=time, patient=patient, outcome=outcome)
+        self._record(time)
+
+
+def _run(logger: implement.SummaryLogger, horizon: float):
+    setup = icu_scenario().build(6)
+    framework.run_icu(hospital_state=setup.hospital_state, logger=logger, policy=setup.policy, model=setup.model,
+                      until=horizon)
+
+
+def _daily_census(census, column: int, horizon: float):
+    """
+    The time integral and the peak of a census column over each day, by walking the day minute by minute.
+    """
+    times = numpy.array([c[0] for c in census])
+    values = numpy.array([c[column] for c in census])
+    minutes = numpy.arange(horizon)
+    # The census during minute t is the value after the last change at or before t.
+    during = values[numpy.searchsorted(times, minutes, side='right') - 1]
+    by_day = during.reshape(-1, MINUTES_PER_DAY)
+    peaks = by_day.max(axis=1)
+    # Changes within a minute can raise the census and lower it again before the minute is over.
+    for time, value in zip(times, values):
+        day = int(time // MINUTES_PER_DAY)
+        if day < len(peaks):
+            peaks[day] = max(peaks[day], value)
+    return by_day.sum(axis=1), peaks
+
+
+def test_daily_metrics_add_up_to_the_run_totals():
+    horizon = NUM_DAYS * MINUTES_PER_DAY
+    daily = implement.DailyMetricsLogger(NUM_DAYS, day_length=MINUTES_PER_DAY)
+    _run(daily, horizon)
+    daily.advance_to(horizon)
+    totals = CensusLogger()
+    _run(totals, horizon)
+
+    assert totals.arrivals > 100 and totals.declines > 0 and totals.deaths > 0 and totals.discharges > 0
+    assert daily.daily_arrivals.sum() == daily.arrivals == totals.arrivals
+    assert daily.daily_admissions.sum() == totals.admissions
+    assert daily.daily_declines.sum() == totals.declines
+    assert daily.daily_deaths.sum() == totals.deaths
+    assert daily.daily_discharges.sum() == totals.discharges
+    assert daily.daily_peak_beds.max() == totals.peak_beds
+    assert daily.daily_peak_ventilators.max() == totals.peak_ventilators
+
+    for column, integrals, peaks in ((1, daily.daily_bed_time, daily.daily_peak_beds),
+                                     (2, daily.daily_ventilator_time, daily.daily_peak_ventilators)):
+        expected_integrals, expected_peaks = _daily_census(totals.census, column, horizon)
+        numpy.testing.assert_array_equal(integrals, expected_integrals)
+        numpy.testing.assert_array_equal(peaks, expected_peaks)
+    assert daily.bed_time == daily.daily_bed_time.sum()
+    numpy.testing.assert_allclose(daily.daily_mean_beds(), daily.daily_bed_time / MINUTES_PER_DAY)
+
+
+def test_events_after_the_last_day_only_update_the_totals():
+    daily = implement.DailyMetricsLogger(10, day_length=MINUTES_PER_DAY)
+    _run(daily, 20 * MINUTES_PER_DAY)
+    totals = implement.SummaryLogger()
+    _run(totals, 20 * MINUTES_PER_DAY)
+    shorter = implement.DailyMetricsLogger(10, day_length=MINUTES_PER_DAY)
+    _run(shorter, 10 * MINUTES_PER_DAY)
+
+    assert daily.arrivals == totals.arrivals > shorter.arrivals
+    numpy.testing.assert_array_equal(daily.daily_arrivals, shorter.daily_arrivals)
+    numpy.testing.assert_array_equal(daily.daily_deaths, shorter.daily_deaths)
+    shorter.advance_to(10 * MINUTES_PER_DAY)
+    daily.advance_to(20 * MINUTES_PER_DAY)
+    numpy.testing.assert_array_equal(daily.daily_bed_time, shorter.daily_bed_time)
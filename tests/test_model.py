@@ -0,0 +1,149 @@
+import numpy
+import pytest
+from ppe import framework
+from ppe import implement
+from ppe import sampling
+from conftest import MINUTES_PER_DAY, REQ_VENT, SEVERE, icu_scenario
+
+
+def _model(arrival_times, sampling_mode=sampling.SamplingMode.LEGACY) -> implement.HospitalModelImpl:
+    return implement.HospitalModelImpl(icu_survivalprobs={SEVERE: 0.5, REQ_VENT: 0.5},
+                                       noicu_survivalprobs={SEVERE: 0.5, REQ_VENT: 0.5},
+                                       severity_dist={SEVERE: 0.5, REQ_VENT: 0.5},
+                                       stay_dists={SEVERE: sampling.Poisson(mu=100),
+                                                   REQ_VENT: sampling.Poisson(mu=100)},
+                                       arrival_times=arrival_times, seed=3, sampling_mode=sampling_mode)
+
+
+@pytest.mark.parametrize('sampling_mode', [sampling.SamplingMode.LEGACY, sampling.SamplingMode.BUFFERED])
+def test_exhausted_arrival_stream_draws_no_severity(sampling_mode):
+    exhausted, reference = _model([1, 2, 3], sampling_mode), _model([1, 2, 3, 4], sampling_mode)
+    arrivals = [exhausted.generate_next_arrival() for _ in range(3)]
+    with pytest.raises(StopIteration):
+        exhausted.generate_next_arrival()
+    assert [reference.generate_next_arrival() for _ in range(3)] == arrivals
+
+    patient, status = arrivals[-1].patient, arrivals[-1].status
+    draws = [(m.generate_icu_outcome(patient, status), m.generate_severity()) for m in (exhausted, reference)
+             for _ in range(20)]
+    assert draws[:20] == draws[20:]
+
+
+def test_common_random_numbers_do_not_depend_on_the_order_of_draws():
+    def crn_model():
+        return implement.HospitalModelImpl(icu_survivalprobs={SEVERE: 0.5, REQ_VENT: 0.5},
+                                           noicu_survivalprobs={SEVERE: 0.3, REQ_VENT: 0.1},
+                                           severity_dist={SEVERE: 0.5, REQ_VENT: 0.5},
+                                           stay_dists={SEVERE: sampling.Poisson(mu=100),
+                                                       REQ_VENT: sampling.Poisson(mu=300)},
+                                           interarrival_function=lambda time: 10.0, seed=4, buffer_size=16,
+                                           sampling_mode=sampling.SamplingMode.COMMON_RANDOM_NUMBERS)
+
+    def draws(model, arrival):
+        return (model.generate_stay_length(arrival.patient, arrival.status),
+                model.generate_icu_outcome(arrival.patient, arrival.status),
+                model.generate_noicu_outcome(arrival.patient, arrival.status))
+
+    in_order, shuffled = crn_model(), crn_model()
+    arrivals = [in_order.generate_next_arrival() for _ in range(100)]
+    expected = {a.patient: draws(in_order, a) for a in arrivals}
+    assert [shuffled.generate_next_arrival() for _ in range(100)] == arrivals
+    for arrival in arrivals[::-3]:
+        assert draws(shuffled, arrival) == expected[arrival.patient]
+
+
+def test_common_random_numbers_give_patients_the_same_stays_under_every_policy():
+    def stays(policy):
+        setup = icu_scenario(sampling.SamplingMode.COMMON_RANDOM_NUMBERS, policy).build(2)
+        logger = StayLogger()
+        framework.run_icu(hospital_state=setup.hospital_state, logger=logger, policy=setup.policy,
+                          model=setup.model, until=40 * MINUTES_PER_DAY)
+        return logger
+
+    small = stays(implement.FirstComeFirstServedPolicy(max_beds=20, max_ventilators=10))
+    large = stays(implement.FirstComeFirstServedPolicy(max_beds=40, max_ventilators=30))
+    assert small.arrivals == large.arrivals
+    common = set(small.stays) & set(large.stays)
+    assert len(common) > 50 and len(large.stays) > len(small.stays)
+    assert {p: small.stays[p] for p in common} == {p: large.stays[p] for p in common}
+    assert {p: small.outcomes[p] for p in common} == {p: large.outcomes[p] for p in common}
+
+
+class StayLogger(framework.HospitalLogger):
+    """
+    Records the arrivals, and the stay and outcome of every patient who leaves.
+    """
+
+    def __init__(self):
+        self.arrivals = []
+        self.admitted = {}
+        self.stays = {}
+        self.outcomes = {}
+
+    def log_patient_arrived(self, time, patient, status):
+        self.arrivals.append((time, patient, status))
+
+    def log_patient_admitted(self, time, patient):
+        self.admitted[patient] = time
+
+    def log_patient_outcome(self, time, patient, outcome):
+        self.outcomes[patient] = outcome
+        if patient in self.admitted:
+            self.stays[patient] = time - self.admitted[patient]
+
+
+def test_staff_exposure_is_to_every_other_staff_member_on_shift():
+    model = implement.HospitalModelImpl(icu_survivalprobs={SEVERE: 0.5}, noicu_survivalprobs={SEVERE: 0.5},
+                                        severity_dist={SEVERE: 1.0}, stay_dists={SEVERE: sampling.Poisson(mu=100)},
+                                        interarrival_function=lambda time: 10.0, seed=1, staff_to_staff_rate=0.01,
+                                        ppe_effectiveness=0.75)
+    infected, susceptible = framework.InfectionStatus.INFECTED, framework.InfectionStatus.SUSCEPTIBLE
+    statuses = [infected, susceptible, infected, susceptible, susceptible, infected, susceptible]
+    ppe = [framework.PPE.FULL_PPE, None, framework.PPE.NO_PPE, framework.PPE.FULL_PPE, framework.PPE.NO_PPE,
+           framework.PPE.FULL_PPE, None]
+    batch = framework.InteractionBatch(
+        time=100, staff=tuple(framework.StaffInfo(i) for i in range(len(statuses))),
+        staff_statuses=tuple(framework.StaffStatus(covid_status=s, covid_severity=None, test_status=None,
+                                                   last_shift_end=0) for s in statuses),
+        staff_ppe=tuple(ppe), patients=(), patient_statuses=(), staff_patient_durations=numpy.zeros((7, 0)),
+        staff_staff_duration=30.0, num_on_shift=5)
+
+    exposures = []
+    draw_infections = model._draw_infections
+    model._draw_infections = lambda rate, exposure, at_risk: exposures.append(exposure) or draw_infections(
+        rate, exposure, at_risk)
+    model.staff_to_staff_transmission(batch)
+
+    factors = numpy.array([0.25 if p == framework.PPE.FULL_PPE else 1.0 for p in ppe])
+    infectious = numpy.array([s == infected for s in statuses], dtype=float)
+    durations = numpy.zeros((7, 7))
+    durations[:5, :5] = 30.0
+    numpy.fill_diagonal(durations, 0)
+    numpy.testing.assert_allclose(exposures[0], factors * (durations @ (factors * infectious)), rtol=1e-12)
+
+
+def test_status_flags_match_is_infectious_and_is_susceptible():
+    statuses = [framework.PatientStatus(covid_status=status, covid_severity=severity)
+                for status in (None,) + tuple(framework.InfectionStatus)
+                for severity in (None,) + tuple(framework.InfectionSeverity)]
+    infectious, susceptible = implement.status_flags(statuses)
+    assert infectious.tolist() == [float(implement.is_infectious(s)) for s in statuses]
+    assert susceptible.tolist() == [implement.is_susceptible(s) for s in statuses]
+
+
+def test_indexed_variates_keep_the_most_recently_used_blocks():
+    drawn = []
+
+    def draw(random_state: numpy.random.RandomState, size: int) -> numpy.ndarray:
+        drawn.append(size)
+        return random_state.random_sample(size)
+
+    variates = sampling.IndexedVariates(numpy.random.SeedSequence(1), (0,), draw, block_size=10)
+    reference = sampling.IndexedVariates(numpy.random.SeedSequence(1), (0,), numpy.random.RandomState.random_sample,
+                                         block_size=10)
+    # Blocks 0 to 3 fill the cache; block 0 is used again, so block 4 evicts block 1, the least recently used.
+    for index in (5, 15, 25, 35, 7, 45, 8, 29, 39, 48):
+        assert variates.get(index) == reference.get(index)
+    assert len(drawn) == 5
+    variates.get(17)
+    assert len(drawn) == 6
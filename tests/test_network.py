@@ -0,0 +1,57 @@
+import io
+import pytest
+from ppe import framework
+from ppe import implement
+from ppe import network
+from conftest import MINUTES_PER_DAY, icu_scenario, demand_rates
+
+HORIZON = 40 * MINUTES_PER_DAY
+
+
+def _network_scenario(num_sites: int, transfer_policy=None) -> network.NetworkScenario:
+    scenario = icu_scenario()
+    return network.NetworkScenario(
+        icu_survivalprobs=scenario.icu_survivalprobs, noicu_survivalprobs=scenario.noicu_survivalprobs,
+        severity_dist=scenario.severity_dist, stay_dists=scenario.stay_dists,
+        site_rates=(demand_rates(),) * num_sites,
+        policies=tuple(implement.FirstComeFirstServedPolicy(max_beds=10 + i, max_ventilators=8)
+                       for i in range(num_sites)),
+        transfer_policy=transfer_policy, period_length=MINUTES_PER_DAY)
+
+
+def test_patient_ids_are_dense_across_sites():
+    scenario = _network_scenario(40, network.MostAvailableTransferPolicy())
+    sites = scenario.build(0)
+    network.run_network(sites, HORIZON, scenario.transfer_policy)
+    lowest_ids = network.site_lowest_ids(scenario.site_rates)
+    assert lowest_ids == sorted(lowest_ids)
+    assert lowest_ids[-1] + 2 * sum(scenario.site_rates[-1]) < 2 ** 31
+    for site, lowest, limit in zip(sites, lowest_ids, lowest_ids[1:]):
+        assert lowest <= site.model.next_id <= limit
+
+
+def test_sites_with_overlapping_ids_are_rejected():
+    sites = _network_scenario(2).build(0)
+    sites[1].model.next_id = sites[0].model.next_id + 5
+    with pytest.raises(RuntimeError):
+        network.run_network(sites, HORIZON)
+
+
+def test_columnar_logger_keeps_large_patient_ids():
+    event_file, patient_file = io.BytesIO(), io.BytesIO()
+    logger = implement.ColumnarLogger(event_file, patient_file)
+    patient = framework.PatientInfo(3 * 10 ** 9)
+    logger.log_patient_arrived(time=1, patient=patient,
+                               status=framework.PatientStatus(covid_severity=framework.InfectionSeverity.SEVERE))
+    logger.log_patient_declined(time=1, patient=patient)
+    logger.flush()
+    event_file.seek(0)
+    patient_file.seek(0)
+    assert implement.read_columns(event_file, implement.EVENT_COLUMN_TYPES)['patient'].tolist() == [3 * 10 ** 9]
+    assert implement.read_columns(patient_file, implement.PATIENT_COLUMN_TYPES)['patient_id'].tolist() == [3 * 10 ** 9]
+
+
+def test_transfer_policies_are_transfer_policies():
+    for policy in (network.MostAvailableTransferPolicy(), network.NearestAvailableTransferPolicy(((0.0,),))):
+        assert isinstance(policy, network.TransferPolicy)
+        assert policy == type(policy)(**vars(policy))
@@ -0,0 +1,93 @@
+import collections
+import io
+import typing
+import simpy
+from ppe import framework
+from ppe import implement
+from ppe import profiling
+from conftest import MINUTES_PER_DAY, icu_scenario
+
+HORIZON = 20 * MINUTES_PER_DAY
+SHIFT_LENGTH = 12 * 60
+
+
+def _staffed_setup(seed: int):
+    """
+    The test ICU run by 20 staff, half of them on shift, under LeastBusyPolicy.
+    """
+    scenario = icu_scenario(policy=implement.LeastBusyPolicy(max_patients=3, shift_length=SHIFT_LENGTH))
+    status = framework.StaffStatus(covid_status=framework.InfectionStatus.SUSCEPTIBLE,
+                                   covid_severity=framework.InfectionSeverity.NOT_INFECTED,
+                                   test_status=framework.TestStatus.NOT_SUSPECTED, last_shift_end=0)
+    active = {framework.StaffInfo(i): status for i in range(10)}
+    options = {s: framework.StaffOptions(ppe=framework.PPE.FULL_PPE, shift_end=1 + s.sid * SHIFT_LENGTH // 10)
+               for s in active}
+    hospital = implement.HospitalStateImpl(
+        existing_patients={}, ppe_level=implement.PPEStock(10 ** 9),
+        inactive_staff={framework.StaffInfo(10 + i): status for i in range(10)}, active_staff=active,
+        active_staff_options=options, existing_assignments={s: set() for s in active}, bedusers=set(), ventusers=set())
+    return scenario.build(seed)._replace(hospital_state=hospital)
+
+
+def _unprofiled_events(setup) -> str:
+    event_file = io.StringIO()
+    env = simpy.Environment()
+    env.process(framework.icu_process(env=env, hospital_state=setup.hospital_state,
+                                      logger=implement.CSVLogger(event_file), policy=setup.policy, model=setup.model))
+    env.run(HORIZON)
+    return event_file.getvalue()
+
+
+def test_profiled_run_logs_the_same_events_and_times_every_step():
+    expected = _unprofiled_events(_staffed_setup(8))
+    setup = _staffed_setup(8)
+    event_file = io.StringIO()
+    profile = profiling.profile_run(hospital_state=setup.hospital_state, logger=implement.CSVLogger(event_file),
+                                    policy=setup.policy, model=setup.model, until=HORIZON,
+                                    sample_interval=MINUTES_PER_DAY)
+    assert event_file.getvalue() == expected
+    # The framework is timed through the timer of the run, not by replacing its module functions.
+    assert framework.process_exit.__module__ == 'ppe.framework' and framework.process_exit.__name__ == 'process_exit'
+
+    calls = {name: count for (_, name), count in profile.calls.items()}
+    assert calls['start'] == 1 and calls['arrival_assignment'] == calls['process_arrival'] > 40
+    assert calls['apply_reassignment'] == calls['eos_restaff'] > 20 and 'process_interactions' not in calls
+    # A handler step runs until its timeout and another after it; the next arrival and shift ends are still waiting.
+    assert calls['handle_patient_arrival'] == 2 * calls['process_arrival'] + 1
+    assert calls['handle_eos'] == 2 * calls['apply_reassignment'] + 10
+    assert calls['DischargeScheduler._run'] > calls['process_exit'] > 0
+
+    assert 15 <= len(profile.queue_depth) <= 21
+    assert all(b.time - a.time >= MINUTES_PER_DAY // 2 for a, b in zip(profile.queue_depth, profile.queue_depth[1:]))
+    assert profile.max_waiting_handlers >= 11  # the next arrival and the shift ends of the staff on shift
+    assert profile.max_pending_exits >= max(s.pending_exits for s in profile.queue_depth) > 0
+    assert 'wall time' in profile.format_table()
+
+
+def _counted_framework_steps(engine: str) -> typing.Dict[str, int]:
+    calls = collections.Counter()
+
+    def timer(component, name, function):
+        def counted(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+        return counted if component == 'framework' else function
+
+    setup = icu_scenario().build(3)
+    logger = implement.SummaryLogger()
+    if engine == 'simpy':
+        env = simpy.Environment()
+        env.process(framework.icu_process(env=env, hospital_state=setup.hospital_state, logger=logger,
+                                          policy=setup.policy, model=setup.model, timer=timer))
+        env.run(HORIZON)
+    else:
+        framework.run_loss_system(hospital_state=setup.hospital_state, logger=logger, policy=setup.policy,
+                                  model=setup.model, until=HORIZON, timer=timer)
+    assert calls['process_arrival'] == logger.arrivals
+    return calls
+
+
+def test_timer_sees_the_same_framework_steps_in_both_engines():
+    calls = _counted_framework_steps('heap')
+    assert calls['process_arrival'] > 40 and calls['process_exit'] > 10
+    assert _counted_framework_steps('simpy') == calls
@@ -0,0 +1,87 @@
+import math
+import numpy
+import pytest
+from ppe import replication
+from conftest import MINUTES_PER_DAY, icu_scenario
+
+HORIZON = 30 * MINUTES_PER_DAY
+
+
+def test_results_do_not_depend_on_the_number_of_workers():
+    scenario = icu_scenario()
+    serial = replication.run_replications(scenario.build, HORIZON, 5, seed=3, max_workers=1)
+    assert [s.replication for s in serial] == list(range(5))
+    assert len(set(serial)) == 5  # every replication gets its own stream
+    for max_workers in (2, 3):
+        assert replication.run_replications(scenario.build, HORIZON, 5, seed=3, max_workers=max_workers) == serial
+
+
+def test_t_quantile_matches_closed_forms():
+    for probability in (0.5, 0.6, 0.9, 0.975, 0.9995, 0.999995):
+        # One degree of freedom is the Cauchy distribution, and two have a closed-form quantile.
+        assert math.isclose(replication.t_quantile(probability, 1), math.tan(math.pi * (probability - 0.5)),
+                            rel_tol=1e-10, abs_tol=1e-12)
+        a = 2 * probability - 1
+        assert math.isclose(replication.t_quantile(probability, 2), a * math.sqrt(2 / (1 - a * a)),
+                            rel_tol=1e-10, abs_tol=1e-12)
+    with pytest.raises(RuntimeError):
+        replication.t_quantile(0.4, 3)
+
+
+def test_t_quantile_matches_scipy():
+    stats = pytest.importorskip('scipy.stats')
+    for df in (1, 3, 9, 29, 99, 999, 10 ** 5):
+        for probability in (0.55, 0.8, 0.95, 0.975, 0.995, 0.9999):
+            assert math.isclose(replication.t_quantile(probability, df), stats.t.ppf(probability, df), rel_tol=1e-8)
+
+
+def test_running_statistics_match_numpy():
+    values = numpy.random.default_rng(2).normal(1e6, 3.0, size=1000)  # a large mean relative to the spread
+    statistics = replication.RunningStatistics()
+    assert math.isnan(statistics.variance()) and math.isnan(statistics.half_width())
+    for value in values:
+        statistics.add(value)
+    assert statistics.count == 1000
+    assert math.isclose(statistics.mean, values.mean(), rel_tol=1e-14)
+    assert math.isclose(statistics.variance(), values.var(ddof=1), rel_tol=1e-9)
+    assert math.isclose(statistics.half_width(0.95),
+                        replication.t_quantile(0.975, 999) * values.std(ddof=1) / math.sqrt(1000), rel_tol=1e-9)
+
+
+def _prefix_converged(summaries, outputs, relative_precision: float) -> bool:
+    statistics = {output: replication.RunningStatistics() for output in outputs}
+    for summary in summaries:
+        for output, s in statistics.items():
+            s.add(getattr(summary, output))
+    return all(s.half_width() <= relative_precision * abs(s.mean) for s in statistics.values())
+
+
+def test_adaptive_runner_stops_at_the_first_batch_that_is_precise_enough():
+    scenario = icu_scenario()
+    outputs = ('deaths', 'declines')
+    result = replication.run_adaptive_replications(scenario.build, HORIZON, outputs=outputs, relative_precision=0.03,
+                                                   min_replications=3, batch_size=1, seed=4, max_workers=1)
+    count = len(result.summaries)
+    assert result.converged and 3 < count < 1000
+    # The replications are the first ones run_replications would run, and the rule held first after the last one.
+    assert result.summaries == replication.run_replications(scenario.build, HORIZON, count, seed=4, max_workers=1)
+    assert _prefix_converged(result.summaries, outputs, 0.03)
+    assert not any(_prefix_converged(result.summaries[:n], outputs, 0.03) for n in range(3, count))
+    for output in outputs:
+        values = numpy.array([getattr(s, output) for s in result.summaries], dtype=float)
+        assert math.isclose(result.means[output], values.mean())
+        assert result.half_widths[output] <= 0.03 * values.mean()
+
+    parallel = replication.run_adaptive_replications(scenario.build, HORIZON, outputs=outputs, relative_precision=0.03,
+                                                     min_replications=3, batch_size=1, seed=4, max_workers=2)
+    assert parallel.summaries == result.summaries
+
+
+def test_adaptive_runner_stops_at_max_replications():
+    scenario = icu_scenario()
+    result = replication.run_adaptive_replications(scenario.build, HORIZON, relative_precision=1e-6,
+                                                   min_replications=2, max_replications=7, batch_size=3, seed=4,
+                                                   max_workers=1)
+    assert not result.converged and len(result.summaries) == 7
+    with pytest.raises(RuntimeError):
+        replication.run_adaptive_replications(scenario.build, HORIZON, outputs=('replication',), max_workers=1)
@@ -0,0 +1,35 @@
+import numpy
+import pytest
+from ppe import sampling
+
+scipy_stats = pytest.importorskip('scipy.stats')
+
+QUANTILES = [-0.5, 0.0, 1e-9, 1e-6, 0.3, 0.5, 0.9, 1 - 1e-6, 1.0, 1.5, numpy.nan]
+
+
+@pytest.mark.parametrize('mu', [0.0, 0.5, 30.0, 14400.0])
+def test_poisson_matches_scipy(mu):
+    native, reference = sampling.Poisson(mu), scipy_stats.poisson(mu=mu)
+    x = numpy.concatenate((numpy.linspace(-3, 1.3 * mu + 5, 41), [-numpy.inf, numpy.inf, numpy.nan]))
+    numpy.testing.assert_allclose(native.cdf(x), reference.cdf(x), rtol=0, atol=1e-9)
+    numpy.testing.assert_array_equal(native.ppf(QUANTILES), reference.ppf(QUANTILES))
+    assert native.ppf(0.5) == reference.ppf(0.5) and native.cdf(mu) == pytest.approx(reference.cdf(mu), abs=1e-9)
+    numpy.testing.assert_array_equal(native.rvs(size=100, random_state=numpy.random.RandomState(3)),
+                                     reference.rvs(size=100, random_state=numpy.random.RandomState(3)))
+
+
+def test_poisson_cdf_of_huge_counts_is_one():
+    native = sampling.Poisson(14400.0)
+    x = [14400 + 40 * 120 + 39, 14400 + 40 * 120 + 41, 1e15, 2.0 ** 62]  # on either side of the tail bound
+    numpy.testing.assert_array_equal(native.cdf(x), [1.0] * 4)
+    numpy.testing.assert_allclose(native.cdf(x[:1]), scipy_stats.poisson(mu=14400.0).cdf(x[:1]), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('scale', [0.25, 7.5, 14400.0])
+def test_exponential_matches_scipy(scale):
+    native, reference = sampling.Exponential(scale), scipy_stats.expon(scale=scale)
+    x = numpy.concatenate((numpy.linspace(-1, 8 * scale, 41), [-numpy.inf, numpy.inf, numpy.nan]))
+    numpy.testing.assert_allclose(native.cdf(x), reference.cdf(x), rtol=1e-12, atol=0)
+    numpy.testing.assert_allclose(native.ppf(QUANTILES), reference.ppf(QUANTILES), rtol=1e-12, atol=0)
+    numpy.testing.assert_array_equal(native.rvs(size=100, random_state=numpy.random.RandomState(3)),
+                                     reference.rvs(size=100, random_state=numpy.random.RandomState(3)))
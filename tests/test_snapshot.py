@@ -0,0 +1,56 @@
+import io
+import numpy
+from ppe import framework
+from ppe import implement
+from ppe import replication
+from conftest import MINUTES_PER_DAY, icu_scenario
+
+HORIZON = 40 * MINUTES_PER_DAY
+
+
+def test_identical_branches_continue_the_run_exactly(sampling_mode):
+    scenario = icu_scenario(sampling_mode)
+    full = replication.run_replication(scenario.build, HORIZON, 0, numpy.random.SeedSequence(5))
+    snapshot = replication.run_to_snapshot(scenario.build(numpy.random.SeedSequence(5)), 15 * MINUTES_PER_DAY)
+    branches = [replication.Branch(scenario.policy)] * 3
+    for max_workers in (1, 2):
+        summaries = replication.run_branches(snapshot, branches, HORIZON, max_workers=max_workers)
+        assert [s._replace(replication=0) for s in summaries] == [full] * 3
+
+
+def test_snapshot_is_not_changed_by_its_branches(sampling_mode):
+    scenario = icu_scenario(sampling_mode)
+    snapshot = replication.run_to_snapshot(scenario.build(numpy.random.SeedSequence(7)), 15 * MINUTES_PER_DAY)
+    first = replication.run_branch(snapshot, replication.Branch(scenario.policy), HORIZON, 0)
+    assert replication.run_branch(snapshot, replication.Branch(scenario.policy), HORIZON, 0) == first
+
+
+def _events(event_file: io.StringIO):
+    # Event ids restart in a new logger, so only time, type, patient and staff are compared.
+    return [line.split(',', 1)[1] for line in event_file.getvalue().splitlines()[1:]]
+
+
+def test_resumed_run_logs_the_same_events(sampling_mode):
+    scenario = icu_scenario(sampling_mode)
+    snapshot_time = 15 * MINUTES_PER_DAY + 17
+
+    setup = scenario.build(9)
+    full = io.StringIO()
+    simulation = framework.ICUSimulation(hospital_state=setup.hospital_state, logger=implement.CSVLogger(full),
+                                         policy=setup.policy, model=setup.model)
+    simulation.start()
+    simulation.run(HORIZON)
+
+    setup = scenario.build(9)
+    prefix = io.StringIO()
+    simulation = framework.ICUSimulation(hospital_state=setup.hospital_state, logger=implement.CSVLogger(prefix),
+                                         policy=setup.policy, model=setup.model)
+    simulation.start()
+    simulation.run(snapshot_time)
+    snapshot = simulation.snapshot()
+    continuation = io.StringIO()
+    resumed = framework.ICUSimulation.resume(snapshot, setup.policy, implement.CSVLogger(continuation))
+    resumed.run(HORIZON)
+
+    assert len(_events(continuation)) > 100
+    assert _events(prefix) + _events(continuation) == _events(full)
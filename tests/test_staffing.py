@@ -0,0 +1,150 @@
+import io
+import random
+import simpy
+from ppe import framework
+from ppe import implement
+from conftest import MINUTES_PER_DAY, icu_scenario
+
+SHIFT_LENGTH = 12 * 60
+
+
+def _status(last_shift_end: int) -> framework.StaffStatus:
+    return framework.StaffStatus(covid_status=framework.InfectionStatus.SUSCEPTIBLE,
+                                 covid_severity=framework.InfectionSeverity.NOT_INFECTED,
+                                 test_status=framework.TestStatus.NOT_SUSPECTED, last_shift_end=last_shift_end)
+
+
+def _roster(num_active: int, num_inactive: int, state_type=implement.HospitalStateImpl) -> implement.HospitalStateImpl:
+    """
+    A hospital whose active staff have staggered shift ends, and whose inactive staff went off shift at times that tie.
+    """
+    active = {framework.StaffInfo(i): _status(0) for i in range(num_active)}
+    inactive = {framework.StaffInfo(num_active + i): _status(-(i // 3)) for i in range(num_inactive)}
+    options = {s: framework.StaffOptions(ppe=framework.PPE.FULL_PPE, shift_end=1 + s.sid * SHIFT_LENGTH // num_active)
+               for s in active}
+    return state_type(existing_patients={}, ppe_level=implement.PPEStock(10 ** 9), inactive_staff=inactive,
+                      active_staff=active, active_staff_options=options,
+                      existing_assignments={s: set() for s in active}, bedusers=set(), ventusers=set())
+
+
+class BruteForceState(implement.HospitalStateImpl):
+    """
+    HospitalStateImpl with least_busy and most_rested found by scanning the staff, as before they were indexed.
+    """
+
+    def least_busy(self):
+        return min(self.active_staff_view(), key=self.num_patients, default=None)
+
+    def most_rested(self):
+        return min(self.inactive_staff_view(), key=self.get_last_shift_end, default=None)
+
+
+def test_staff_indexes_match_a_scan_of_the_staff():
+    hospital = _roster(12, 8)
+    scan = BruteForceState.least_busy, BruteForceState.most_rested
+    rng = random.Random(4)
+    next_patient = 0
+    for time in range(1, 3000):
+        operation = rng.random()
+        active = sorted(hospital.active_staff_view())
+        patients = sorted(p for s in active for p in hospital.patients_view(s))
+        if operation < 0.4 and active:
+            patient = framework.PatientInfo(next_patient)
+            next_patient += 1
+            hospital.add_patient(patient, framework.PatientStatus())
+            hospital.assign(rng.choice(active), patient)
+        elif operation < 0.6 and patients:
+            hospital.discharge_patient(rng.choice(patients))
+        elif operation < 0.7 and patients:
+            patient = rng.choice(patients)
+            hospital.unassign(rng.choice(sorted(hospital.staff_view(patient))), patient)
+        elif operation < 0.85 and len(active) > 1:
+            hospital.end_shift(rng.choice(active), end_time=time // 50)
+        elif hospital.inactive_staff_view():
+            hospital.start_shift(rng.choice(sorted(hospital.inactive_staff_view())),
+                                 framework.StaffOptions(ppe=framework.PPE.FULL_PPE, shift_end=time + SHIFT_LENGTH))
+        assert hospital.least_busy() == scan[0](hospital)
+        assert hospital.most_rested() == scan[1](hospital)
+    assert next_patient > 500
+
+
+def _least_busy_run(state_type, max_patients: int):
+    scenario = icu_scenario(policy=implement.LeastBusyPolicy(max_patients=max_patients, shift_length=SHIFT_LENGTH))
+    setup = scenario.build(6)._replace(hospital_state=_roster(30, 10, state_type))
+    event_file = io.StringIO()
+    env = simpy.Environment()
+    env.process(framework.icu_process(env=env, hospital_state=setup.hospital_state,
+                                      logger=implement.CSVLogger(event_file), policy=setup.policy, model=setup.model))
+    env.run(20 * MINUTES_PER_DAY)
+    return setup.hospital_state, event_file.getvalue()
+
+
+def test_least_busy_run_matches_a_scan_of_the_staff():
+    hospital, events = _least_busy_run(implement.HospitalStateImpl, max_patients=2)
+    assert _least_busy_run(BruteForceState, max_patients=2)[1] == events
+    assert events.count(',PatientAssignment,') > 50
+    # Arrivals are assigned in the hospital state, so least-busy staff never take more than max_patients.
+    loads = [hospital.num_patients(s) for s in hospital.active_staff_view()]
+    assert max(loads) <= 2 and sum(loads) > 0
+
+
+def test_redistribute_gives_each_patient_to_the_staff_member_with_most_spare_capacity():
+    hospital = _roster(8, 0)
+    policy = implement.LeastBusyPolicy(max_patients=5, shift_length=SHIFT_LENGTH)
+    next_patient = 0
+    for staff, load in zip(sorted(hospital.active_staff_view()), [0, 5, 3, 1, 4, 3, 2, 0]):
+        for _ in range(load):
+            patient = framework.PatientInfo(next_patient)
+            next_patient += 1
+            hospital.add_patient(patient, framework.PatientStatus())
+            hospital.assign(staff, patient)
+    orphaned = {framework.PatientInfo(next_patient + i) for i in range(14)}
+
+    # The loop the heap replaced, without its bugs: one scan of the staff per patient.
+    spare = {s: policy.max_patients - hospital.num_patients(s) for s in hospital.active_staff_view()}
+    expected = {}
+    for patient in sorted(orphaned):
+        staff = max((s for s in spare if spare[s] > 0), key=spare.get, default=None)
+        if staff is None:
+            break
+        expected[patient] = {staff}
+        spare[staff] -= 1
+
+    assert policy.redistribute(orphaned, hospital) == expected
+    assert len(orphaned) == 14
+    # The 14 patients level the spare capacity of the least loaded staff down to one or two.
+    assert len(expected) == 14 and sorted(spare.values()) == [0, 1, 1, 1, 1, 1, 1, 2]
+    more = orphaned | {framework.PatientInfo(10 ** 6 + i) for i in range(20)}
+    assert len(policy.redistribute(more, hospital)) == 22
+
+
+def test_views_follow_the_state_and_cannot_change_it():
+    hospital = _roster(2, 1)
+    first, second = sorted(hospital.active_staff_view())
+    (idle,) = hospital.inactive_staff_view()
+    patient = framework.PatientInfo(0)
+    hospital.add_patient(patient, framework.PatientStatus())
+    active, inactive = hospital.active_staff_view(), hospital.inactive_staff_view()
+    first_patients, idle_patients, patient_staff = (hospital.patients_view(first), hospital.patients_view(idle),
+                                                    hospital.staff_view(patient))
+
+    hospital.assign(first, patient)
+    hospital.start_shift(idle, framework.StaffOptions(ppe=framework.PPE.FULL_PPE, shift_end=SHIFT_LENGTH))
+    hospital.assign(idle, patient)
+    assert first_patients == idle_patients == {patient} and patient_staff == {first, idle}
+    assert active == {first, second, idle} and not inactive
+
+    hospital.end_shift(first, end_time=10)
+    assert not first_patients and patient_staff == {idle} and inactive == {first}
+    hospital.discharge_patient(patient)
+    assert not idle_patients and not patient_staff and hospital.staff_view(patient) == set()
+
+    hospital.assign(second, framework.PatientInfo(1))
+    for view in (active, inactive, hospital.patients_view(second)):
+        for method in ('add', 'discard', 'remove', 'clear', 'update'):
+            assert not hasattr(view, method)
+        before = set(view)
+        changed = view
+        changed |= {framework.PatientInfo(2)}  # set operations make a new set
+        assert type(changed) is set and set(view) == before
+    assert hospital.get_patients(second) == {framework.PatientInfo(1)}
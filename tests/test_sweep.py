@@ -0,0 +1,58 @@
+import os
+import shutil
+from ppe import implement
+from ppe import sweep
+from conftest import MINUTES_PER_DAY, REQ_VENT, RESOURCE_DIR, SEVERE, icu_scenario
+
+DEMAND_FILE = os.path.join(RESOURCE_DIR, 'demands_3_24.csv')
+SETTINGS = sweep.sweep_settings(icu_scenario(), 20 * MINUTES_PER_DAY)
+
+
+def _cells(path, columns=('T_600', 'T_800')):
+    policies = sweep.policy_grid(implement.FirstComeFirstServedPolicy, max_beds=[20, 30], max_ventilators=[15])
+    return sweep.sweep_cells(sweep.demand_columns(path, columns), policies, [0])
+
+
+def test_cell_keys_depend_on_demand_content_not_location(tmp_path):
+    copy = tmp_path / 'copy'
+    copy.mkdir()
+    shutil.copy(DEMAND_FILE, copy / 'demands_3_24.csv')
+    other = tmp_path / 'other'
+    other.mkdir()
+    shutil.copy(os.path.join(RESOURCE_DIR, 'demands_3_25.csv'), other / 'demands_3_24.csv')
+
+    keys = [c.key(SETTINGS) for c in _cells(DEMAND_FILE)]
+    assert len(set(keys)) == len(keys)
+    assert [c.key(SETTINGS) for c in _cells(str(copy / 'demands_3_24.csv'))] == keys
+    assert not set(c.key(SETTINGS) for c in _cells(str(other / 'demands_3_24.csv'), ['T_600'])) & set(keys)
+
+
+def test_cell_keys_ignore_fields_left_at_their_defaults():
+    policy = implement.FirstComeFirstServedPolicy(max_beds=20, max_ventilators=15)
+    assert sweep.policy_parameters(policy) == {'type': 'FirstComeFirstServedPolicy',
+                                               'fields': {'max_beds': 20, 'max_ventilators': 15}}
+    scheduled = policy._replace(capacity_schedule=(implement.CapacityChange(time=5, max_beds=10, max_ventilators=5),))
+    cell = sweep.SweepCell(demand=sweep.DemandColumn(DEMAND_FILE, 'T_600'), policy=policy, seed=0)
+    assert cell.key(SETTINGS) != cell._replace(policy=scheduled).key(SETTINGS)
+
+
+def test_sweep_resumes_from_its_results_table(tmp_path):
+    results = str(tmp_path / 'results.csv')
+    cells = _cells(DEMAND_FILE)
+    template = icu_scenario()
+    assert sweep.run_sweep(template, cells[:2], 20 * MINUTES_PER_DAY, results, max_workers=1) == 2
+    assert sweep.run_sweep(template, cells, 20 * MINUTES_PER_DAY, results, max_workers=1) == len(cells) - 2
+    assert sweep.run_sweep(template, cells, 20 * MINUTES_PER_DAY, results, max_workers=1) == 0
+
+
+def test_sweep_reruns_cells_when_its_settings_change(tmp_path):
+    results = str(tmp_path / 'results.csv')
+    cells = _cells(DEMAND_FILE, ['T_600'])
+    template = icu_scenario()
+    horizon = 20 * MINUTES_PER_DAY
+    assert sweep.run_sweep(template, cells, horizon, results, max_workers=1) == len(cells)
+    assert sweep.run_sweep(template, cells, horizon + MINUTES_PER_DAY, results, max_workers=1) == len(cells)
+    assert sweep.run_sweep(template, cells, horizon, results, demand_scale=0.5, max_workers=1) == len(cells)
+    assert sweep.run_sweep(template._replace(noicu_survivalprobs={SEVERE: 0.5, REQ_VENT: 0.1}), cells, horizon,
+                           results, max_workers=1) == len(cells)
+    assert sweep.run_sweep(template, cells, horizon, results, max_workers=1) == 0
@@ -0,0 +1,44 @@
+import pytest
+from ppe import implement
+from ppe import replication
+from ppe import sampling
+from ppe import whatif
+from conftest import MINUTES_PER_DAY, REQ_VENT, SEVERE, icu_scenario
+
+HORIZON = 40 * MINUTES_PER_DAY
+POLICIES = [implement.FirstComeFirstServedPolicy(max_beds=30, max_ventilators=20),
+            implement.FirstComeFirstServedPolicy(max_beds=15, max_ventilators=15),
+            implement.FirstComeFirstServedPolicy(max_beds=40, max_ventilators=10, capacity_schedule=(
+                implement.CapacityChange(time=20 * MINUTES_PER_DAY, max_beds=20, max_ventilators=10),))]
+
+
+def _scenario(stays: str) -> replication.ICUScenario:
+    scenario = icu_scenario(sampling.SamplingMode.COMMON_RANDOM_NUMBERS)
+    if stays == 'continuous':
+        # Stays that are not whole minutes, which must be replayed without rounding.
+        scenario = scenario._replace(stay_dists={SEVERE: sampling.Exponential(5 * MINUTES_PER_DAY + 0.3),
+                                                 REQ_VENT: sampling.Exponential(8 * MINUTES_PER_DAY + 0.3)})
+    return scenario
+
+
+@pytest.mark.parametrize('stays', ['poisson', 'continuous'])
+def test_replayed_policies_match_direct_runs(stays):
+    scenario = _scenario(stays)
+    direct = [replication.run_replication(scenario._replace(policy=p).build, HORIZON, i, 4)
+              for i, p in enumerate(POLICIES)]
+    assert len({(s.admissions, s.declines) for s in direct}) == len(POLICIES)  # the policies make a difference
+    assert min(s.declines for s in direct) > 0
+
+    stream = whatif.generate_stream(scenario, HORIZON, 4)
+    assert len(stream) == direct[0].arrivals
+    assert [whatif.evaluate_policy(stream, p, HORIZON, i) for i, p in enumerate(POLICIES)] == direct
+    for max_workers in (1, 2):
+        assert whatif.evaluate_policies(stream, POLICIES, HORIZON, max_workers=max_workers) == direct
+    assert whatif.compare_policies(scenario, POLICIES, HORIZON, 4, max_workers=1) == direct
+
+
+def test_stream_keeps_the_stays_the_model_drew():
+    stream = whatif.generate_stream(_scenario('continuous'), HORIZON, 4)
+    assert not (stream.records['stay_length'] % 1 == 0).all()
+    replayed = whatif.ReplayModel(whatif.generate_stream(_scenario('poisson'), HORIZON, 4))
+    assert all(type(stay) is int for stay in replayed._stay_lengths)